@@ -1,9 +1,15 @@
+import os
+import sys
 from collections import OrderedDict
 
 import streamlit as st
 
+# Make the modules shared by the en and fr apps importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # TODO : change TITLE, TEAM_MEMBERS and PROMOTION values in config.py.
 import config
+from unhappy_earth import figures
 
 # TODO : you can (and should) rename and add tabs in the ./tabs folder, and import them here.
 from tabs import intro, donnees, existence, correlation, prediction, conclusion
@@ -64,6 +70,10 @@ def run():
 
     tab.run()
 
+    # Instrumentation of the figures, with ?stats in the URL.
+    if 'stats' in st.query_params:
+        st.sidebar.json(figures.stats())
+
 
 if __name__ == "__main__":
     run()
@@ -1,17 +1,136 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import seaborn as sns
 
 from scipy.stats import pearsonr
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.metrics import r2_score
+
+from unhappy_earth import aggregates, countries, data, figures, pairwise, polyfit
 
 
 title = "Is the evolution of temperatures correlated to $CO_2$ emissions?"
 sidebar_name = "Correlations"                                                  
+language = "en"
                                                     
+
+def plot_evolution(co2_temps):
+    """
+    Plot the CO2 emissions and the 10 years rolling average of the temperatures.
+    """
+    fig, ax1 = figures.subplots(figsize=(18,10))
+
+    ax1.grid(color='grey', alpha=0.3, linewidth=1)
+    ax1.plot(co2_temps['year'], co2_temps['Land use emissions (GtCO2)'],
+         label = "Land use CO2 emissions")
+    ax1.plot(co2_temps['year'], co2_temps['Fossil fuel and industry emissions (GtCO2)'],
+         label = "Fossil fuel and industry CO2 emissions")
+    ax1.plot(co2_temps['year'], co2_temps['Total emissions (GtCO2)'],
+         label="Total emissions")
+    ax1.set_xlabel("Year", fontsize=14)
+    ax1.set_ylabel("$CO_2$ emitted / Gigatons", fontsize=14)
+
+    ax2 = ax1.twinx()
+    ax2.grid(color='grey', alpha=0, linewidth=2)
+    ax2.plot(co2_temps['year'], co2_temps['abs_10y_mov_avg'], c='r', linestyle='--',
+         label = "Absolute temperatures: 10 years rolling averages")
+    ax2.set_ylabel("Absolute temperature / °C", fontsize=14)
+
+    ax1.set_title("Evolution of absolute temperatures and $CO_2$ emissions", fontsize=14)
+    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
+    return fig
+
+
+def plot_heatmap(co2_temps):
+    """
+    Plot the heatmap of the correlations of the columns of co2_temps.
+    """
+    fig, ax = figures.subplots()
+    sns.heatmap(co2_temps.drop('abs', axis=1).corr(method="pearson"), ax=ax)#,annot=True)
+    return fig
+
+
+def plot_country_correlations(corr):
+    """
+    Plot the matrix of the correlation coefficients between the countries.
+    """
+    fig, ax = figures.subplots(figsize=(12,12))
+    image = ax.imshow(corr.r, cmap='coolwarm', vmin=-1, vmax=1)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_title("Correlation coefficients between countries", fontsize=14)
+    fig.colorbar(image, ax=ax, shrink=0.8)
+    return fig
+
+
+def plot_scatter(co2_temps):
+    """
+    Plot the 10 years rolling average of the temperatures against the CO2 emissions.
+    """
+    fig, ax = figures.subplots(figsize=(18,10))
+    ax.grid(color='grey', alpha=0.5, linewidth=2)
+    ax.scatter(co2_temps['Total emissions (GtCO2)'], co2_temps['abs_10y_mov_avg'], 
+                c=co2_temps['abs_10y_mov_avg'], cmap='jet', s=20,
+                label="Absolute temperatures : 10 years rolling averages")
+    ax.set_xlabel('Emitted $CO_2$ / Gigatons',  fontsize=14)
+    ax.set_ylabel('Absolute temperatures / °C / 10 years rolling averages', fontsize=14)
+    ax.set_title("Evolution of absolute temperatures according to $CO_2$ emissions", fontsize=14)
+    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
+    return fig
+
+
+def plot_linear_regression(x, y, y_pred):
+    """
+    Plot the scatter plot of the temperatures against the CO2 emissions, with the regression line.
+    """
+    fig, ax1 = figures.subplots(figsize=(18,10))
+    ax1.grid(color='grey', alpha=0.5, linewidth=2)
+    ax1.scatter(x,
+                y, 
+                c=y,
+                cmap='jet',
+                s=20,
+                label='Absolute temperatures')
+
+    ax2 = ax1
+    ax2.plot(x,
+             y_pred,
+             'r--',
+             label='Linear Regression')
+
+    ax1.set_title("Evolution of absolute temperatures according to $CO_2$ emissions : Scatterplot & Regression line", fontsize=14)
+    ax1.set_xlabel('Emitted $CO_2$ / Gigatons', fontsize=14)
+    ax1.set_ylabel('Absolute temperatures / °C / 10 years rolling averages', fontsize=14)
+    ax1.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
+    return fig
+
+
+def plot_polynomial_regression(x, y, y_poly_pred, degree):
+    """
+    Plot the scatter plot of the temperatures against the CO2 emissions, with the 'degree'
+    polynomial regression curve.
+    """
+    fig, ax1 = figures.subplots(figsize=(18,10))
+    ax1.grid(color='grey', alpha=0.5, linewidth=2)
+    ax1.scatter(x,
+                y, 
+                c=y,
+                cmap='jet',
+                s=20,
+                label='Absolute temperatures')
+
+    ax2 = ax1
+    ax2.plot(x,
+             y_poly_pred,
+             'r--',
+             label=f'{degree} degree polynomial regression')
+
+    ax1.set_title(f"Evolution of absolute temperatures according to $CO_2$ emissions : Scatterplot & {degree} degree regression curve",
+                  fontsize=14)
+    ax1.set_xlabel('Emitted $CO_2$ / Gigatons', fontsize=14)
+    ax1.set_ylabel('Absolute temperatures / °C / 10 years rolling averages', fontsize=14)
+    ax1.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
+    return fig
+
+
 def run():
     
     st.image("streamlit/en/assets/Reftinsky_reservoir_of_Sverdlovsk_region.jpg", use_column_width=True)   
@@ -33,13 +152,13 @@ def run():
         )
     
     # Lecture des datasets
-    global_land = pd.read_csv('data/unhappy_earth/temperatures_globales.csv')
-    co2_global = pd.read_csv('data/unhappy_earth/co2_global.csv')
+    temps_globales_year = aggregates.load('temperatures_globales_yearly')
+    co2_global = data.load('co2_global')
 
     # Preprocess sur datasets
     co2_global_reduc = co2_global.rename(columns={'Year': 'year'})
-    temps_reduc = global_land.groupby('year').agg({'abs': 'mean'}).reset_index()
-    temps_reduc = temps_reduc.loc[(temps_reduc['year'] >= 1850) & (temps_reduc['year'] < 2021),:]
+    temps_reduc = temps_globales_year[['year', 'abs']]
+    temps_reduc = temps_reduc.loc[(temps_reduc['year'] >= 1850) & (temps_reduc['year'] < 2021),:].copy()
     temps_reduc['abs_10y_mov_avg'] = temps_reduc['abs'].rolling(10).mean()
     co2_temps = pd.merge(temps_reduc, co2_global_reduc, on='year')
     co2_temps['Total emissions (GtCO2)'] = co2_temps['Land use emissions (GtCO2)'] + co2_temps['Fossil fuel and industry emissions (GtCO2)']
@@ -52,6 +171,9 @@ def run():
                                                         'Total emissions (GtCO2)']] / 1e+09
 
     co2_temps = co2_temps[co2_temps['year']>=1860]
+    # Les graphiques sont dessinés une fois par version des données
+    # (et valeur des widgets), voir unhappy_earth.figures.
+    co2_version = (aggregates.version('temperatures_globales_yearly'), data.data_version('co2_global'))
     
     # Affichage optionnel d'un aperçu du DF :
     
@@ -74,27 +196,8 @@ def run():
         
     st.markdown("We compare the evolution of the 4 main variables in the following graph:")
     
-    fig, ax1 = plt.subplots(figsize=(18,10))
-    
-    ax1.grid(color='grey', alpha=0.3, linewidth=1)
-    ax1.plot(co2_temps['year'], co2_temps['Land use emissions (GtCO2)'],
-         label = "Land use CO2 emissions")
-    ax1.plot(co2_temps['year'], co2_temps['Fossil fuel and industry emissions (GtCO2)'],
-         label = "Fossil fuel and industry CO2 emissions")
-    ax1.plot(co2_temps['year'], co2_temps['Total emissions (GtCO2)'],
-         label="Total emissions")
-    ax1.set_xlabel("Year", fontsize=14)
-    ax1.set_ylabel("$CO_2$ emitted / Gigatons", fontsize=14)
-    
-    ax2 = ax1.twinx()
-    ax2.grid(color='grey', alpha=0, linewidth=2)
-    ax2.plot(co2_temps['year'], co2_temps['abs_10y_mov_avg'], c='r', linestyle='--',
-         label = "Absolute temperatures: 10 years rolling averages")
-    ax2.set_ylabel("Absolute temperature / °C", fontsize=14)
-    
-    ax1.set_title("Evolution of absolute temperatures and $CO_2$ emissions", fontsize=14)
-    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
-    st.pyplot(fig)
+    st.image(figures.image(plot_evolution, co2_version, language, data=(co2_temps,)),
+             use_column_width=True)
     
     # Commentaire graphique :
         
@@ -121,9 +224,8 @@ def run():
         )    
     
     with st.expander("Display a 'heatmap' of the DataFrame's correlations...") :
-        fig, ax = plt.subplots()
-        sns.heatmap(co2_temps.drop('abs', axis=1).corr(method="pearson"), ax=ax)#,annot=True)
-        st.pyplot(fig)
+        st.image(figures.image(plot_heatmap, co2_version, language, data=(co2_temps,)),
+                 use_column_width=True)
     
         st.markdown(
             """
@@ -176,6 +278,47 @@ def run():
              of the other**.
         """
         )
+
+    
+# Corrélations entre pays :
+    
+    st.header("Correlations between countries")
+    
+    st.markdown(
+        """
+        Let's now **compare the countries with each other**: for each pair of countries, we compute the Pearson correlation coefficient and
+        its p-value over the periods for which both countries have values. The temperatures are compared through their **monthly
+        anomalies** (gap to the average temperature of the same month in the country), which removes the seasons.
+        """
+        )
+    
+    tables = {pairwise.TEMPERATURES: "Monthly temperature anomalies",
+              pairwise.CO2: "Yearly $CO_2$ emissions"}
+    table = st.radio("Variable:", list(tables), format_func=tables.get, horizontal=True)
+    
+    # Toutes les paires sont calculées une fois par version des données.
+    corr = pairwise.correlations(table)
+    
+    col1, col2 = st.columns(2)
+    with col1 :
+        default = 'france' if table == pairwise.TEMPERATURES else 'FRA'
+        country = st.selectbox("Country:", corr.names, index=corr.names.index(default),
+                               format_func=countries.name)
+    with col2 :
+        k = st.slider("Number of countries:", 5, 30, 10)
+    
+    columns = {'r': "Correlation coefficient", 'p': "p-value", 'n': "Common observations"}
+    col1, col2 = st.columns(2)
+    with col1 :
+        st.markdown("**Most correlated countries**")
+        st.dataframe(corr.top(country, k).rename(index=countries.name, columns=columns))
+    with col2 :
+        st.markdown("**Least correlated countries**")
+        st.dataframe(corr.top(country, k, ascending=True).rename(index=countries.name, columns=columns))
+    
+    with st.expander("Display the heatmap of all the countries...") :
+        st.image(figures.image(plot_country_correlations, (table, data.data_version(table)), language,
+                               data=(corr,)), use_column_width=True)
  
     
 # Régressions température / émissions CO2 :
@@ -188,16 +331,8 @@ def run():
         """
         )
     
-    fig, ax = plt.subplots(figsize=(18,10))
-    plt.grid(color='grey', alpha=0.5, linewidth=2)
-    ax.scatter(co2_temps['Total emissions (GtCO2)'], co2_temps['abs_10y_mov_avg'], 
-                c=co2_temps['abs_10y_mov_avg'], cmap='jet', s=20,
-                label="Absolute temperatures : 10 years rolling averages")
-    ax.set_xlabel('Emitted $CO_2$ / Gigatons',  fontsize=14)
-    ax.set_ylabel('Absolute temperatures / °C / 10 years rolling averages', fontsize=14)
-    ax.set_title("Evolution of absolute temperatures according to $CO_2$ emissions", fontsize=14)
-    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
-    st.pyplot(fig)
+    st.image(figures.image(plot_scatter, co2_version, language, data=(co2_temps,)),
+             use_column_width=True)
     
     # Commentaire graphique :
         
@@ -208,7 +343,8 @@ def run():
          **The objective of a regression is to explain a variable Y by means of another variable X.**
          With a polynomial regression, the relationship between the explanatory variable and the explained variable is modeled as a $n$ degree polynomial.
         
-         We **model the link between our two variables** thanks to the **LinearRegression** and **PolynomialFeatures** Scikit-Learn functions:
+         We **model the link between our two variables** with a **least squares fit** of the polynomial of each degree, computed for all the
+         degrees at once from a **QR factorization** of the powers of the $CO_2$ emissions:
         """
         )
     
@@ -219,25 +355,27 @@ def run():
     
     col1, col2 = st.columns(2)
     with col1 :
-        degree = st.slider('Select the regression degree:', 1,5)
+        degree = st.slider('Select the regression degree:', 1, polyfit.MAX_DEGREE)
+    
+    # Toutes les régressions (degrés 1 à polyfit.MAX_DEGREE) sont calculées une
+    # fois par version des données : le slider ne fait qu'une lecture.
+    fits = polyfit.cached(('co2_temps', co2_version),
+                          x['Total emissions (GtCO2)'], y)
+    fit = fits[degree]
     
     if degree == 1 :
         
-        # Entraînement de la régression :
-        
-        lr = LinearRegression()
-        lr.fit(x, y)
-        y_pred = lr.predict(x)
+        y_pred = fit['yhat']
         
         st.markdown(
             f"""
-            Intercept (Y value when X = 0): **${lr.intercept_}$**
+            Intercept (Y value when X = 0): **${fit['intercept']}$**
             
-            Coefficient (regression 'slope'): **${lr.coef_[0]}$**
+            Coefficient (regression 'slope'): **${fit['coef'][0]}$**
 
             A $1$ degree polynomial regression is a simple linear regression, which can be interpreted as follows:
                 
-            $Temperature \ (°C) = {round(lr.intercept_, 3)} + {round(lr.coef_[0], 3)} * CO_2 \ emissions \ (Gt)$
+            $Temperature \ (°C) = {round(fit['intercept'], 3)} + {round(fit['coef'][0], 3)} * CO_2 \ emissions \ (Gt)$
             
             Let's visualize the linear regression result by displaying it on the scatter plot:
             """
@@ -245,32 +383,14 @@ def run():
             
         # Affichage scatter + droite régression :
         
-        fig, ax1 = plt.subplots(figsize=(18,10))
-        plt.grid(color='grey', alpha=0.5, linewidth=2)
-        ax1.scatter(x,
-                    y, 
-                    c=y,
-                    cmap='jet',
-                    s=20,
-                    label='Absolute temperatures')
-    
-        ax2 = ax1
-        ax2.plot(x,
-                 y_pred,
-                 'r--',
-                 label='Linear Regression')
-        
-        ax1.set_title("Evolution of absolute temperatures according to $CO_2$ emissions : Scatterplot & Regression line", fontsize=14)
-        plt.xlabel('Emitted $CO_2$ / Gigatons', fontsize=14)
-        plt.ylabel('Absolute temperatures / °C / 10 years rolling averages', fontsize=14)
-        plt.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
-        st.pyplot(fig)
+        st.image(figures.image(plot_linear_regression, co2_version, language, data=(x, y, y_pred)),
+                 use_column_width=True)
     
         # Evaluation de la régression :
         
         st.markdown("In order to **evaluate our regression**, we use the **$R^2$ score** metric.")
     
-        score = round(r2_score(y, y_pred), 5)
+        score = round(fit['r2'], 5)
         st.markdown(f"Score : **${score}$**")
     
     
@@ -278,29 +398,18 @@ def run():
     
     if degree > 1 :
         
-        # Entraînement de la régression :
-        
-        poly_feats = PolynomialFeatures(degree=degree, include_bias=False)
-        x_poly = poly_feats.fit_transform(x)
-        
-        plr = LinearRegression()
-        plr.fit(x_poly, y)
-        
-        y_poly_pred = plr.predict(x_poly)
-        
-        coeffs = []
-        for i in plr.coef_ :
-            coeffs.append(i)
+        y_poly_pred = fit['yhat']
+        coeffs = fit['coef'].tolist()
         
         st.markdown(
             f"""
-            Intercept (Y value when X = 0): **${round(plr.intercept_,5)}$**
+            Intercept (Y value when X = 0): **${round(fit['intercept'],5)}$**
             
             Coefficient (regression 'slope'): **${coeffs}$**
 
             This is a ${degree}$ degree polynomial regression, for which:
             
-            $Temperature \ (°C) = {round(plr.intercept_,5)} + \sum_1^{degree} coef_{degree} * (polynomial \ of \ (CO_2 \ emissions \ (Gt))_{degree}$
+            $Temperature \ (°C) = {round(fit['intercept'],5)} + \sum_1^{degree} coef_{degree} * (polynomial \ of \ (CO_2 \ emissions \ (Gt))_{degree}$
             
             Let's visualize the polynomial regression result by displaying it on the scatter plot:
             """
@@ -308,40 +417,39 @@ def run():
         
         # Affichage scatter + droite régression :
         
-        fig, ax1 = plt.subplots(figsize=(18,10))
-        plt.grid(color='grey', alpha=0.5, linewidth=2)
-        ax1.scatter(x,
-                    y, 
-                    c=y,
-                    cmap='jet',
-                    s=20,
-                    label='Absolute temperatures')
-    
-        ax2 = ax1
-        ax2.plot(x,
-                 y_poly_pred,
-                 'r--',
-                 label=f'{degree} degree polynomial regression')
-        
-        ax1.set_title(f"Evolution of absolute temperatures according to $CO_2$ emissions : Scatterplot & {degree} degree regression curve",
-                      fontsize=14)
-        plt.xlabel('Emitted $CO_2$ / Gigatons', fontsize=14)
-        plt.ylabel('Absolute temperatures / °C / 10 years rolling averages', fontsize=14)
-        plt.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
-        st.pyplot(fig)
+        st.image(figures.image(plot_polynomial_regression, co2_version, language,
+                               data=(x, y, y_poly_pred), degree=degree), use_column_width=True)
         
         # Evaluation de la régression :
         
         st.markdown("In order to **evaluate our regression**, we use the **$R^2$ score** metric.")
     
-        score = round(r2_score(y, y_poly_pred), 5)
+        score = round(fit['r2'], 5)
         st.markdown(f"Score : **${score}$**")
     
+    # Validation croisée :
+    
+    st.markdown(
+        f"""
+        The $R^2$ score of the data the regression was trained on always increases with the degree. To **detect overfitting**, we also
+        score each degree by **cross-validation**: the years are split into {polyfit.FOLDS} consecutive periods, and each period is
+        predicted by the regression trained on the others.
+        
+        Cross-validated score: **${round(fit['cv_r2'], 5)}$**
+        """
+        )
+    
+    with st.expander("Compare the scores of all the degrees...") :
+        st.dataframe(polyfit.scores(fits).rename(columns={'r2': 'R²', 'cv_r2': 'Cross-validated R²',
+                                                          'cv_rmse': 'Cross-validated RMSE (°C)'}))
+    
     st.markdown(
         """
-        By varying the degree of the polynomial regression from 1 to 5, **we obtain increasing $R^2$ scores between 0.918 and 0.966** (with a
-        risk of overfitting).
-        **Therefore the model is efficient** and confirms the close relationship that exists between our 2 variables. **$CO_2$ emissions are
+        By varying the degree of the polynomial regression from 1 to 5, the $R^2$ score on the training data increases from 0.918 to 0.966,
+        but **the cross-validated score does not**: it is the highest for the linear regression ($0.81$), and it is negative for the degrees
+        2, 4 and 5 ($-0.29$, $-39.6$ and $-16.9$), whose predictions of the held-out periods are worse than the mean temperature. **The higher
+        degrees overfit** the training data, and do not fit better: the linear regression is the one to keep.
+        **This linear model is efficient** and confirms the close relationship that exists between our 2 variables. **$CO_2$ emissions are
         a major explanatory variable for the rise in temperatures**.
         """
         )    
@@ -2,34 +2,77 @@ import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from unhappy_earth import countries, data, decimate, figures, lazy
+
 
 title = "Data sources"
 sidebar_name = "Data sources"
+language = "en"
 
 plt.style.use('seaborn-whitegrid')
 
 
-def read_temps():
-    globales = pd.read_csv('data/unhappy_earth/temperatures_globales.csv')
-    hemispheres = pd.read_csv('data/unhappy_earth/temperatures_hemispheres.csv')
-    countries = pd.read_csv('data/unhappy_earth/temperatures_countries.csv')
-    return globales, hemispheres, countries
+def plot_temperatures(temps_countries, options):
+    """
+    Plot the 10 years rolling averages of the temperatures of the 'options' countries.
+    """
+    temps_countries_10y = temps_countries.rolling_mean(options, 120)
+    fig, ax = figures.subplots(figsize=(10,6))
+    # Only the months which are visible at the width of the chart.
+    for country in options:
+        rows = decimate.line(ax, temps_countries_10y[country])
+        ax.plot(temps_countries_10y['year'].iloc[rows], temps_countries_10y[country].iloc[rows], label=country)
+    ax.set_ylim(bottom=0)
+    ax.grid(visible=True, alpha=0.5)
+    ax.legend(loc='lower left')
+    ax.set_title("10 years moving average temperature by country")
+    return fig
+
+
+def plot_co2_countries(co2_countries, options):
+    """
+    Plot the yearly CO2 emissions of the 'options' countries.
+    """
+    co2_countries_selected = co2_countries.select(options)
+    fig, ax = figures.subplots(figsize=(10,6))
+    for code in options:
+        rows = decimate.line(ax, co2_countries_selected[code])
+        ax.plot(co2_countries_selected['year'].iloc[rows], co2_countries_selected[code].iloc[rows],
+                label=countries.name(code))
+    ax.set_ylim(bottom=0)
+    ax.grid(visible=True, alpha=0.5)
+    ax.legend(loc='lower left')
+    ax.set_title("Yearly $CO_2$ emissions, by country")
+    return fig
 
-def read_co2():
-    globales = pd.read_csv('data/unhappy_earth/co2_global.csv')
-    countries = pd.read_csv('data/unhappy_earth/co2_countries.csv')
-    return globales, countries
+
+def plot_co2_global(co2_global):
+    """
+    Plot the yearly global CO2 emissions of land use, and of fossil fuel and industry.
+    """
+    fig, ax = figures.subplots(figsize=(10,6))
+    ax.plot(co2_global['Year'], co2_global['Land use emissions (GtCO2)'], label='Land use emissions (GtCO2)')
+    ax.plot(co2_global['Year'], co2_global['Fossil fuel and industry emissions (GtCO2)'], label='Fossil fuel and industry emissions (GtCO2)')
+    # ax.plot(co2_countries['year'], co2_countries['OWID_WRL'], label='Total global')
+    ax.set_ylim(bottom=0)
+    ax.grid(visible=True, alpha=0.5)
+    ax.legend(loc='upper left')
+    ax.set_title("Global $CO_2$ production, per year")
+    return fig
 
 
 def run():
 
     st.title(title)
 
-    temps_globales, temps_hemis, temps_countries = read_temps()
-    temps_countries_10y = pd.concat([temps_countries['year'], temps_countries.iloc[:,2:].rolling(120).mean()], axis=1)
+    temps_globales = data.load('temperatures_globales')
+    temps_hemis = data.load('temperatures_hemispheres')
+    co2_global = data.load('co2_global')
 
-    co2_global, co2_countries = read_co2()
-    co2_countries_10y = pd.concat([co2_countries['year'], co2_countries.iloc[:,2:].rolling(120).mean()], axis=1)
+    # Per-country datasets: only the columns of the selected countries are
+    # read and computed.
+    temps_countries = lazy.dataset('temperatures_countries')
+    co2_countries = lazy.dataset('co2_countries')
     
     st.header('Identifying data sources')
     
@@ -102,20 +145,16 @@ We can visualise the evolution of temperatures across the 180 countries of the d
     # Add country selection
     options = st.multiselect(
         'Select a country',
-        temps_countries.columns[2:],
+        temps_countries.columns,
         ['france', 'united-states-of-america', 'china'],
         key = "temps_countries")
 
     if len(options) == 0 : 
         st.markdown("Warning: please select at least one country.")
     else :
-        fig, ax = plt.subplots(figsize=(10,6))
-        ax.plot(temps_countries_10y['year'], temps_countries_10y[options], label=options)
-        ax.set_ylim(bottom=0)
-        ax.grid(visible=True, alpha=0.5)
-        ax.legend(loc='lower left')
-        ax.set_title("10 years moving average temperature by country")
-        st.pyplot(fig=fig, )
+        # The charts are drawn once per data version and selection.
+        st.image(figures.image(plot_temperatures, data.data_version('temperatures_countries'), language,
+                               data=(temps_countries,), options=options), use_column_width=True)
         
         
     st.header('Carbon dioxyde datasets')
@@ -149,20 +188,17 @@ We can visualise the evolution of $CO_2$ emissions by country. Please select the
     # Add country selection
     options = st.multiselect(
         'Select a country',
-        co2_countries.columns[1:],
+        co2_countries.columns,
         default=['FRA', 'USA', 'CHN', 'OWID_WRL'],
+        format_func=lambda code: f"{countries.name(code)} ({code})",
         key="co2_countries")
 
     if len(options) == 0 : 
         st.markdown("Warning: please select at least one country.")
     else :
-        fig, ax = plt.subplots(figsize=(10,6))
-        ax.plot(co2_countries['year'], co2_countries[options], label=options)
-        ax.set_ylim(bottom=0)
-        ax.grid(visible=True, alpha=0.5)
-        ax.legend(loc='lower left')
-        ax.set_title("Yearly $CO_2$ emissions, by country")
-        st.pyplot(fig=fig)
+        st.image(figures.image(plot_co2_countries, data.data_version('co2_countries', countries.NAME),
+                               language, data=(co2_countries,), options=options),
+                 use_column_width=True)
         
     st.markdown(
         """
@@ -177,15 +213,8 @@ Let's visualize the evolution of these two values (expressed in Gigatons) over t
     )
     
     # Add country selection
-    fig, ax = plt.subplots(figsize=(10,6))
-    ax.plot(co2_global['Year'], co2_global['Land use emissions (GtCO2)'], label='Land use emissions (GtCO2)')
-    ax.plot(co2_global['Year'], co2_global['Fossil fuel and industry emissions (GtCO2)'], label='Fossil fuel and industry emissions (GtCO2)')
-#    ax.plot(co2_countries['year'], co2_countries['OWID_WRL'], label='Total global')
-    ax.set_ylim(bottom=0)
-    ax.grid(visible=True, alpha=0.5)
-    ax.legend(loc='upper left')
-    ax.set_title("Global $CO_2$ production, per year")
-    st.pyplot(fig=fig)
+    st.image(figures.image(plot_co2_global, data.data_version('co2_global'), language,
+                           data=(co2_global,)), use_column_width=True)
         
 
     st.header('Reading and pre-processing of data')
@@ -1,22 +1,179 @@
+import warnings
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from prophet import Prophet
+
+from unhappy_earth import countries, data, decimate, figures, forecast, harmonic
 
 
 title = "Forecast"
 sidebar_name = "Forecast"
+language = "en"
+
+ENGINES = ["Prophet", "Fast (harmonic regression)"]
+# Seconds between the checks of the fits running in the background.
+POLL_SECONDS = 2
+
+
+def plot_fast(fast, series, xlabel, ylabel):
+    """
+    Plot the fast forecast of 'series' like Prophet does: measures as dots,
+    forecast as a line, and its uncertainty interval.
+    """
+    history = fast['history'][series].dropna()
+    fig, ax = figures.subplots(figsize=(16,6))
+    # Only the months which are visible at the width of the chart.
+    history = history.iloc[decimate.scatter(ax, history)]
+    predicted = pd.concat([fast[column][series].rename(column) for column in ('yhat', 'yhat_lower', 'yhat_upper')],
+                         axis=1)
+    predicted = predicted.iloc[decimate.line(ax, predicted)]
+    ax.plot(history.index, history, 'k.', markersize=4)
+    ax.plot(predicted.index, predicted['yhat'], ls='-', c='#0072B2')
+    ax.fill_between(predicted.index, predicted['yhat_lower'], predicted['yhat_upper'],
+                    color='#0072B2', alpha=0.2)
+    ax.grid(True, which='major', c='gray', ls='-', lw=1, alpha=0.2)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.tight_layout()
+    return fig
+
+
+def plot_fast_components(fast, series):
+    """
+    Plot the trend and the yearly seasonality of the fast forecast of 'series'.
+    """
+    fig, axes = figures.subplots(2, 1, figsize=(18, 10))
+    axes[0].plot(fast['trend'].index, fast['trend'][series], ls='-', c='#0072B2')
+    seasonality = fast['seasonality'][series]
+    one_year = seasonality.groupby(seasonality.index.month).first()
+    axes[1].plot(one_year.index, one_year, ls='-', c='#0072B2')
+    axes[1].set_xticks(range(1, 13))
+    for ax in axes:
+        ax.grid(True, which='major', c='gray', ls='-', lw=1, alpha=0.2)
+    fig.tight_layout()
+    return fig
+
+
+def plot_training(new_column):
+    """
+    Plot the monthly temperatures of the training period, with their linear trend.
+    """
+    fig, ax1 = figures.subplots(figsize=(16,4))
+    formatter = mdates.DateFormatter("%Y") ### formatter of the date
+
+    ax1.xaxis.set_major_formatter(formatter) ## calling the formatter for the x-axis   
+
+    ax1.plot(mdates.date2num(new_column['ds']), new_column['y'], label="Absolute Temperature")    
+
+    x = mdates.date2num(new_column['ds'])
+    z = np.polyfit(x, new_column['y'], 1)
+    p = np.poly1d(z)
+
+    ax1.plot(x,p(x),"r--", label="Trend")
+    ax1.set_xlabel("Date (by year)", fontsize=14)
+    ax1.set_ylabel("Absolute Temperature in °C", fontsize=14)
+    ax1.set_title("Absolute Temperature between 1975 and 2022 (monthly data)", fontsize=18)
+    ax1.grid(color='grey', alpha=0.2)
+
+    fig.legend(loc='upper center', bbox_to_anchor=(0.20, 0.91))
+    return fig
+
+
+def fast_series(fast, series):
+    """
+    Return the fast forecasts of 'series' only, as plot_forecast() and
+    plot_components() read them.
+    """
+    return {name: frame[[series]] for name, frame in fast.items() if name != 'model'}
+
+
+def plot_forecast(model, engine, series, title):
+    """
+    Plot the forecast of 'engine': 'model' is the parameters of the Prophet
+    forecast, read from the forecast cache, or the fast forecasts of which
+    'series' is plotted.
+    """
+    if engine == ENGINES[0]:
+        m, fcst = forecast.cached(model)
+        # On a figure of its own, which Prophet would create with pyplot.
+        fig, ax = figures.subplots(figsize=(16,6), facecolor='w')
+        # Prophet's plotting code warns about the deprecated pandas and matplotlib calls it makes.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            m.plot(fcst, ax=ax, xlabel ='Date (by year)', ylabel='Absolute Temperature in °C')
+    else:
+        fig = plot_fast(model, series, xlabel='Date (by year)', ylabel='Absolute Temperature in °C')
+    axes = fig.get_axes()
+
+    axes[0].set_xlabel('Date (by year)', fontsize=18)
+    axes[0].set_ylabel('Absolute Temperature in °C', fontsize=18)
+
+    fig.suptitle(title,  y=1.02, fontsize=24)
+    return fig
+
+
+def plot_components(model, engine, series):
+    """
+    Plot the trend and the seasonality of the forecast of 'engine' (see plot_forecast()).
+    Prophet draws them with pyplot.
+    """
+    if engine == ENGINES[0]:
+        m, fcst = forecast.cached(model)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fig = m.plot_components(fcst, figsize=(18, 10))
+    else:
+        fig = plot_fast_components(model, series)
+    fig.suptitle("Trend forecast of the absolute temperature and seasonal deviation", y=1.02, fontsize=24)
+    axes = fig.get_axes()
+
+    axes[0].set_xlabel('Date (by year)', fontsize=18)
+    axes[0].set_ylabel('Absolute Temperature in °C', fontsize=18)
+    axes[1].set_xlabel("Month", fontsize=18)
+    axes[1].set_ylabel('Seasonal temp deviation / trend, in°C', fontsize=18)
+    return fig
+
+
+def fit_in_background(params):
+    """
+    Return the Future of the fit of 'params' in a worker process, submitted
+    unless the forecast is stored. The session keeps it, so that a failed fit
+    is reported rather than submitted again on every rerun.
+    """
+    fits = st.session_state.setdefault('forecast_fits', {})
+    cache_key = forecast.key(params)
+    future = fits.get(cache_key)
+    if future is None or (future.done() and future.exception() is None):
+        future = fits[cache_key] = forecast.submit(params)
+    return future
+
+
+def fit_status(future, message):
+    """
+    Display 'message' in place of the charts while 'future' runs, or its error.
+    """
+    if future.done() and future.exception() is not None:
+        st.error("The model could not be fitted: {}".format(future.exception()))
+    else:
+        st.info(message)
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def rerun_when_fitted(futures):
+    """
+    Rerun the tab once one of the fits 'futures' is done, checking every
+    POLL_SECONDS: the tab is displayed meanwhile.
+    """
+    if any(future.done() for future in futures):
+        st.rerun()
 
 
 def run():
 
     st.image("streamlit/en/assets/station_meteo.jpg", use_column_width=True)    
 
-#Importer les donnes:
-    df = pd.read_csv('data/unhappy_earth/temperatures_globales.csv')
-    
     st.title("Modeling / Temperature Forecast over the next decades.")
     
     st.markdown("---")
@@ -46,51 +203,44 @@ def run():
     ''', unsafe_allow_html=True)
 
 #Definition des donnes a traiter: 
-    new_column = df.loc[(df['date'] >= '1975-01-15')] 
-    new_column = new_column[['date', 'abs']] 
-    new_column.dropna(inplace=True)
-    new_column.columns = ['ds', 'y'] 
+    new_column = forecast.training_frame('temperatures_globales', '1975-01-15')
 
 # Affichage graphe evolution températures / tendance:
-    fig, ax1 = plt.subplots(figsize=(16,4))
-    formatter = mdates.DateFormatter("%Y") ### formatter of the date
-    
-    ax1.xaxis.set_major_formatter(formatter) ## calling the formatter for the x-axis   
-    
-    ax1.plot(mdates.date2num(new_column['ds']), new_column['y'], label="Absolute Temperature")    
-
-    x = mdates.date2num(new_column['ds'])
-    z = np.polyfit(x, new_column['y'], 1)
-    p = np.poly1d(z)
-     
-    ax1.plot(x,p(x),"r--", label="Trend")
-    ax1.set_xlabel("Date (by year)", fontsize=14)
-    ax1.set_ylabel("Absolute Temperature in °C", fontsize=14)
-    plt.title("Absolute Temperature between 1975 and 2022 (monthly data)", fontsize=18)
-    plt.grid(color='grey', alpha=0.2)
-
-    fig.legend(loc='upper center', bbox_to_anchor=(0.20, 0.91))
-    
-    st.pyplot(fig)
+    st.image(figures.image(plot_training, data.data_version('temperatures_globales'), language,
+                           data=(new_column,)), use_column_width=True)
 
 
 #Prediction Prophet    
     st.markdown("From our data, Facebook Prophet calculates the following temperature **forecast over the next 50 years**:")
 
 
-    m = Prophet(seasonality_mode='additive').fit(new_column)
-    future = m.make_future_dataframe(periods=600, freq='M')
-    fcst = m.predict(future)
-    fig = m.plot(fcst, figsize=(16,6), xlabel ='Date (by year)', ylabel='Absolute Temperature in °C')
-    axes = fig.get_axes()
-
-    axes[0].set_xlabel('Date (by year)', fontsize=18)
-    axes[0].set_ylabel('Absolute Temperature in °C', fontsize=18)
+    engine = st.radio("Forecasting engine:", ENGINES, horizontal=True, key='forecast_engine')
 
-    fig.suptitle("Temperature forecast over the next 50 years",  y=1.02, fontsize=24)
-    import warnings
-    warnings.filterwarnings("ignore")
-    st.pyplot(fig)
+    # Fits running in the background, until which the tab displays placeholders.
+    fitting = []
+    if engine == ENGINES[0]:
+        # Fitted once per version of the data, then served from the forecast cache.
+        # The fit runs in a worker process, shared by the sessions requesting it:
+        # the tab is displayed meanwhile, and rerun once the forecast is stored.
+        params = forecast.params('temperatures_globales', '1975-01-15',
+                                 seasonality_mode='additive', periods=600, freq='M')
+        fit = fit_in_background(params)
+        if not fit.done():
+            fitting.append(fit)
+        model, version = params, forecast.key(params)
+        ready = forecast.is_stored(params)
+    else:
+        st.markdown("The fast engine models the temperature as a linear trend plus a 12 months seasonality, fitted by least squares: the global, hemisphere and country series are all forecast in a few milliseconds.")
+        model = fast_series(harmonic.forecast_all('1975-01-15', periods=600), 'global')
+        version = harmonic.version()
+        ready = True
+    # Drawn once per version of the forecast, see unhappy_earth.figures.
+    if ready:
+        st.image(figures.image(plot_forecast, version, language, data=(model,), engine=engine, series='global',
+                               title="Temperature forecast over the next 50 years"),
+                 use_column_width=True)
+    else:
+        fit_status(fit, "Fitting the model, the forecast will be displayed in a few seconds...")
 
     st.markdown("The forecast (which starts from year 2022 on this graph) shows a clear **increasing temperature evolution**.")
 
@@ -99,17 +249,59 @@ def run():
     st.markdown("- **The trend** ;")
     st.markdown("- **Seasonal deviation** from the trend :")
     
-    fig = m.plot_components(fcst, figsize=(18, 10))
-    fig.suptitle("Trend forecast of the absolute temperature and seasonal deviation", y=1.02, fontsize=24)
-    axes = fig.get_axes()
+    if ready:
+        st.image(figures.image(plot_components, version, language, data=(model,), pyplot=engine == ENGINES[0],
+                               engine=engine, series='global'),
+                 use_column_width=True)
+    elif not fit.done():
+        st.info("The components will be displayed with the forecast.")
 
-    axes[0].set_xlabel('Date (by year)', fontsize=18)
-    axes[0].set_ylabel('Absolute Temperature in °C', fontsize=18)
-    axes[1].set_xlabel("Month", fontsize=18)
-    axes[1].set_ylabel('Seasonal temp deviation / trend, in°C', fontsize=18)
-    warnings.filterwarnings("ignore")
-    
-    st.pyplot(fig)
+#Precision sur les 10 dernieres annees
+    st.markdown("To compare both engines, each model is also trained **without the last 10 years**, which are then forecast and compared with the measures:")
+
+    holdout = {ENGINES[1]: forecast.holdout_fast('temperatures_globales', '1975-01-15')}
+    holdout_params = forecast.holdout_params('temperatures_globales', '1975-01-15',
+                                             seasonality_mode='additive', freq='M')
+    # The table is displayed without Prophet until its fit is done.
+    fitted = forecast.cached(holdout_params) if forecast.is_stored(holdout_params) else None
+    if fitted is not None:
+        holdout[ENGINES[0]] = forecast.holdout_prophet(holdout_params, fitted[1])
+    elif engine == ENGINES[0]:
+        holdout_fit = fit_in_background(holdout_params)
+        if not holdout_fit.done():
+            fitting.append(holdout_fit)
+        fit_status(holdout_fit, "Fitting the model on the training period: its accuracy will be added to the table in a few seconds...")
+    else:
+        st.info("Select the Prophet engine to compute its accuracy on the last 10 years.")
+    holdout = pd.DataFrame(holdout).T[['mae', 'rmse', 'coverage']]
+    holdout.columns = ["MAE (°C)", "RMSE (°C)", "Coverage of the 80 % interval"]
+    st.table(holdout.style.format({holdout.columns[0]: '{:.3f}', holdout.columns[1]: '{:.3f}',
+                                   holdout.columns[2]: '{:.0%}'}))
+
+    if fitting:
+        rerun_when_fitted(fitting)
+
+#Prediction par pays
+    st.markdown("The same model is fitted on the temperatures of **each country** since 1975. Choose a country to display its forecast over the next 50 years:")
+
+    # Read from the forecasts precomputed for all the countries.
+    stored = forecast.stored_countries()
+    if not stored:
+        st.info("The per-country forecasts are not computed yet for the current data. They are precomputed with `PYTHONPATH=streamlit python -m unhappy_earth.forecast countries`.")
+    else:
+        country = st.selectbox("Choose a country", stored,
+                               index=stored.index('france') if 'france' in stored else 0,
+                               format_func=countries.name,
+                               key='forecast_country')
+        country_params = forecast.params(forecast.COUNTRIES, forecast.COUNTRIES_START, column=country)
+        # Listed as stored, but it may have been removed since, e.g. by a refresh of the data.
+        if forecast.cached(country_params) is None:
+            st.info("The forecast of this country is no longer available for the current data: choose another country.")
+        else:
+            st.image(figures.image(plot_forecast, forecast.key(country_params), language, data=(country_params,),
+                                   engine=ENGINES[0], series=None,
+                                   title="Temperature forecast over the next 50 years: {}".format(countries.name(country))),
+                     use_column_width=True)
 
 #Conclusion
 
@@ -1,17 +1,136 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import seaborn as sns
 
 from scipy.stats import pearsonr
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.metrics import r2_score
+
+from unhappy_earth import aggregates, countries, data, figures, pairwise, polyfit
 
 
 title = "L'évolution des températures est-elle corrélée aux émissions de $CO_2$ ?"
 sidebar_name = "Corrélations"                                                  
+language = "fr"
                                                     
+
+def plot_evolution(co2_temps):
+    """
+    Plot the CO2 emissions and the 10 years rolling average of the temperatures.
+    """
+    fig, ax1 = figures.subplots(figsize=(18,10))
+
+    ax1.grid(color='grey', alpha=0.3, linewidth=1)
+    ax1.plot(co2_temps['year'], co2_temps['Land use emissions (GtCO2)'],
+         label = "Emissions de CO2 dues à l'utilisation des sols")
+    ax1.plot(co2_temps['year'], co2_temps['Fossil fuel and industry emissions (GtCO2)'],
+         label = "Emissions de CO2 des combustibles fossiles et de l'industrie")
+    ax1.plot(co2_temps['year'], co2_temps['Total emissions (GtCO2)'],
+         label="Emissions totales")
+    ax1.set_xlabel("Year", fontsize=14)
+    ax1.set_ylabel("$CO_2$ émis / Gigatonnes", fontsize=14)
+
+    ax2 = ax1.twinx()
+    ax2.grid(color='grey', alpha=0, linewidth=2)
+    ax2.plot(co2_temps['year'], co2_temps['abs_10y_mov_avg'], c='r', linestyle='--',
+         label = "Températures absolues : moyennes glissantes s/ 10 ans")
+    ax2.set_ylabel("Température absolue / °C", fontsize=14)
+
+    ax1.set_title("Evolution des températures absolues et des émissions de $CO^2$", fontsize=14)
+    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
+    return fig
+
+
+def plot_heatmap(co2_temps):
+    """
+    Plot the heatmap of the correlations of the columns of co2_temps.
+    """
+    fig, ax = figures.subplots()
+    sns.heatmap(co2_temps.drop('abs', axis=1).corr(method="pearson"), ax=ax)#,annot=True)
+    return fig
+
+
+def plot_country_correlations(corr):
+    """
+    Plot the matrix of the correlation coefficients between the countries.
+    """
+    fig, ax = figures.subplots(figsize=(12,12))
+    image = ax.imshow(corr.r, cmap='coolwarm', vmin=-1, vmax=1)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_title("Coefficients de corrélation entre pays", fontsize=14)
+    fig.colorbar(image, ax=ax, shrink=0.8)
+    return fig
+
+
+def plot_scatter(co2_temps):
+    """
+    Plot the 10 years rolling average of the temperatures against the CO2 emissions.
+    """
+    fig, ax = figures.subplots(figsize=(18,10))
+    ax.grid(color='grey', alpha=0.5, linewidth=2)
+    ax.scatter(co2_temps['Total emissions (GtCO2)'], co2_temps['abs_10y_mov_avg'], 
+                c=co2_temps['abs_10y_mov_avg'], cmap='jet', s=20,
+                label="Températures absolues : moyennes glissantes s/ 10 ans")
+    ax.set_xlabel('$CO^2$ émis / Gigatonnes',  fontsize=14)
+    ax.set_ylabel('Température absolue / °C / Moyennes glissantes sur 10 ans', fontsize=14)
+    ax.set_title("Evolution des températures absolues en fonction des émissions de $CO^2$", fontsize=14)
+    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
+    return fig
+
+
+def plot_linear_regression(x, y, y_pred):
+    """
+    Plot the scatter plot of the temperatures against the CO2 emissions, with the regression line.
+    """
+    fig, ax1 = figures.subplots(figsize=(18,10))
+    ax1.grid(color='grey', alpha=0.5, linewidth=2)
+    ax1.scatter(x,
+                y, 
+                c=y,
+                cmap='jet',
+                s=20,
+                label='Températures absolues')
+
+    ax2 = ax1
+    ax2.plot(x,
+             y_pred,
+             'r--',
+             label='Régression linéaire')
+
+    ax1.set_title("Evolution des températures absolues en fonction des émissions de $CO^2$ : Scatterplot & Droite de régression", fontsize=14)
+    ax1.set_xlabel('$CO_2$ émis / Gigatonnes', fontsize=14)
+    ax1.set_ylabel('Température absolue / °C / Moyennes glissantes sur 10 ans', fontsize=14)
+    ax1.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
+    return fig
+
+
+def plot_polynomial_regression(x, y, y_poly_pred, degree):
+    """
+    Plot the scatter plot of the temperatures against the CO2 emissions, with the 'degree'
+    polynomial regression curve.
+    """
+    fig, ax1 = figures.subplots(figsize=(18,10))
+    ax1.grid(color='grey', alpha=0.5, linewidth=2)
+    ax1.scatter(x,
+                y, 
+                c=y,
+                cmap='jet',
+                s=20,
+                label='Températures absolues')
+
+    ax2 = ax1
+    ax2.plot(x,
+             y_poly_pred,
+             'r--',
+             label=f'Régression polynomiale de degré {degree}')
+
+    ax1.set_title(f"Evolution des températures absolues en fonction des émissions de $CO^2$ : Scatterplot & Courbe de régression de degré {degree}",
+                  fontsize=14)
+    ax1.set_xlabel('$CO_2$ émis / Gigatonnes', fontsize=14)
+    ax1.set_ylabel('Température absolue / °C / Moyennes glissantes sur 10 ans', fontsize=14)
+    ax1.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
+    return fig
+
+
 def run():
     
     st.image("streamlit/fr/assets/Reftinsky_reservoir_of_Sverdlovsk_region.jpg", use_column_width=True)   
@@ -33,13 +152,13 @@ def run():
         )
     
     # Lecture des datasets
-    global_land = pd.read_csv('data/unhappy_earth/temperatures_globales.csv')
-    co2_global = pd.read_csv('data/unhappy_earth/co2_global.csv')
+    temps_globales_year = aggregates.load('temperatures_globales_yearly')
+    co2_global = data.load('co2_global')
 
     # Preprocess sur datasets
     co2_global_reduc = co2_global.rename(columns={'Year': 'year'})
-    temps_reduc = global_land.groupby('year').agg({'abs': 'mean'}).reset_index()
-    temps_reduc = temps_reduc.loc[(temps_reduc['year'] >= 1850) & (temps_reduc['year'] < 2021),:]
+    temps_reduc = temps_globales_year[['year', 'abs']]
+    temps_reduc = temps_reduc.loc[(temps_reduc['year'] >= 1850) & (temps_reduc['year'] < 2021),:].copy()
     temps_reduc['abs_10y_mov_avg'] = temps_reduc['abs'].rolling(10).mean()
     co2_temps = pd.merge(temps_reduc, co2_global_reduc, on='year')
     co2_temps['Total emissions (GtCO2)'] = co2_temps['Land use emissions (GtCO2)'] + co2_temps['Fossil fuel and industry emissions (GtCO2)']
@@ -52,6 +171,9 @@ def run():
                                                         'Total emissions (GtCO2)']] / 1e+09
 
     co2_temps = co2_temps[co2_temps['year']>=1860]
+    # Les graphiques sont dessinés une fois par version des données
+    # (et valeur des widgets), voir unhappy_earth.figures.
+    co2_version = (aggregates.version('temperatures_globales_yearly'), data.data_version('co2_global'))
     
     # Affichage optionnel d'un aperçu du DF :
     
@@ -74,27 +196,8 @@ def run():
         
     st.markdown("**Nous comparons l’évolution des 4 principales variables dans le graphique suivant :**")
     
-    fig, ax1 = plt.subplots(figsize=(18,10))
-    
-    ax1.grid(color='grey', alpha=0.3, linewidth=1)
-    ax1.plot(co2_temps['year'], co2_temps['Land use emissions (GtCO2)'],
-         label = "Emissions de CO2 dues à l'utilisation des sols")
-    ax1.plot(co2_temps['year'], co2_temps['Fossil fuel and industry emissions (GtCO2)'],
-         label = "Emissions de CO2 des combustibles fossiles et de l'industrie")
-    ax1.plot(co2_temps['year'], co2_temps['Total emissions (GtCO2)'],
-         label="Emissions totales")
-    ax1.set_xlabel("Year", fontsize=14)
-    ax1.set_ylabel("$CO_2$ émis / Gigatonnes", fontsize=14)
-    
-    ax2 = ax1.twinx()
-    ax2.grid(color='grey', alpha=0, linewidth=2)
-    ax2.plot(co2_temps['year'], co2_temps['abs_10y_mov_avg'], c='r', linestyle='--',
-         label = "Températures absolues : moyennes glissantes s/ 10 ans")
-    ax2.set_ylabel("Température absolue / °C", fontsize=14)
-    
-    ax1.set_title("Evolution des températures absolues et des émissions de $CO^2$", fontsize=14)
-    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
-    st.pyplot(fig)
+    st.image(figures.image(plot_evolution, co2_version, language, data=(co2_temps,)),
+             use_column_width=True)
     
     # Commentaire graphique :
         
@@ -123,9 +226,8 @@ def run():
         )    
     
     with st.expander("Afficher une 'heatmap' des corrélations du DataFrame...") :
-        fig, ax = plt.subplots()
-        sns.heatmap(co2_temps.drop('abs', axis=1).corr(method="pearson"), ax=ax)#,annot=True)
-        st.pyplot(fig)
+        st.image(figures.image(plot_heatmap, co2_version, language, data=(co2_temps,)),
+                 use_column_width=True)
     
         st.markdown(
             """
@@ -178,6 +280,47 @@ def run():
             les variations de l'autre**.
         """
         )
+
+    
+# Corrélations entre pays :
+    
+    st.header("Corrélations entre pays")
+    
+    st.markdown(
+        """
+        **Comparons maintenant les pays entre eux** : pour chaque paire de pays, nous calculons le coefficient de corrélation de Pearson et
+        sa p-value sur les périodes pour lesquelles les deux pays ont des valeurs. Les températures sont comparées via leurs **anomalies
+        mensuelles** (écart à la température moyenne du même mois dans le pays), ce qui élimine les saisons.
+        """
+        )
+    
+    tables = {pairwise.TEMPERATURES: "Anomalies mensuelles de température",
+              pairwise.CO2: "Emissions annuelles de $CO_2$"}
+    table = st.radio("Variable :", list(tables), format_func=tables.get, horizontal=True)
+    
+    # Toutes les paires sont calculées une fois par version des données.
+    corr = pairwise.correlations(table)
+    
+    col1, col2 = st.columns(2)
+    with col1 :
+        default = 'france' if table == pairwise.TEMPERATURES else 'FRA'
+        country = st.selectbox("Pays :", corr.names, index=corr.names.index(default),
+                               format_func=countries.name)
+    with col2 :
+        k = st.slider("Nombre de pays :", 5, 30, 10)
+    
+    columns = {'r': "Coefficient de corrélation", 'p': "p-value", 'n': "Observations communes"}
+    col1, col2 = st.columns(2)
+    with col1 :
+        st.markdown("**Pays les plus corrélés**")
+        st.dataframe(corr.top(country, k).rename(index=countries.name, columns=columns))
+    with col2 :
+        st.markdown("**Pays les moins corrélés**")
+        st.dataframe(corr.top(country, k, ascending=True).rename(index=countries.name, columns=columns))
+    
+    with st.expander("Afficher la heatmap de tous les pays...") :
+        st.image(figures.image(plot_country_correlations, (table, data.data_version(table)), language,
+                               data=(corr,)), use_column_width=True)
  
     
 # Régressions température / émissions CO2 :
@@ -191,16 +334,8 @@ def run():
         """
         )
     
-    fig, ax = plt.subplots(figsize=(18,10))
-    plt.grid(color='grey', alpha=0.5, linewidth=2)
-    ax.scatter(co2_temps['Total emissions (GtCO2)'], co2_temps['abs_10y_mov_avg'], 
-                c=co2_temps['abs_10y_mov_avg'], cmap='jet', s=20,
-                label="Températures absolues : moyennes glissantes s/ 10 ans")
-    ax.set_xlabel('$CO^2$ émis / Gigatonnes',  fontsize=14)
-    ax.set_ylabel('Température absolue / °C / Moyennes glissantes sur 10 ans', fontsize=14)
-    ax.set_title("Evolution des températures absolues en fonction des émissions de $CO^2$", fontsize=14)
-    fig.legend(loc='upper center', bbox_to_anchor=(0.30, 0.85), fontsize=14, frameon=True)
-    st.pyplot(fig)
+    st.image(figures.image(plot_scatter, co2_version, language, data=(co2_temps,)),
+             use_column_width=True)
     
     # Commentaire graphique :
         
@@ -213,8 +348,8 @@ def run():
         Avec une régression polynomiale, la relation entre la variable explicative et la variable expliquée est modélisée comme un polynôme
         à $n$ degrés.
         
-        Nous **modélisons le lien entre nos deux variables** grâce aux fonctions **LinearRegression** et **PolynomialFeatures** de
-        Scikit-Learn :
+        Nous **modélisons le lien entre nos deux variables** par un **ajustement aux moindres carrés** du polynôme de chaque degré, calculé
+        pour tous les degrés à la fois à partir d'une **factorisation QR** des puissances des émissions de $CO_2$ :
         """
         )
     
@@ -225,25 +360,27 @@ def run():
     
     col1, col2 = st.columns(2)
     with col1 :
-        degree = st.slider('Sélectionnez le degré de la régression :', 1,5)
+        degree = st.slider('Sélectionnez le degré de la régression :', 1, polyfit.MAX_DEGREE)
+    
+    # Toutes les régressions (degrés 1 à polyfit.MAX_DEGREE) sont calculées une
+    # fois par version des données : le slider ne fait qu'une lecture.
+    fits = polyfit.cached(('co2_temps', co2_version),
+                          x['Total emissions (GtCO2)'], y)
+    fit = fits[degree]
     
     if degree == 1 :
         
-        # Entraînement de la régression :
-        
-        lr = LinearRegression()
-        lr.fit(x, y)
-        y_pred = lr.predict(x)
+        y_pred = fit['yhat']
         
         st.markdown(
             f"""
-            Intercept (valeur de Y lorsque X = 0) : **${lr.intercept_}$**
+            Intercept (valeur de Y lorsque X = 0) : **${fit['intercept']}$**
             
-            Coefficient ('pente' de la régression) : **${lr.coef_[0]}$**
+            Coefficient ('pente' de la régression) : **${fit['coef'][0]}$**
 
             Une régression polynomiale de degré $1$ est une régression linéaire simple, qui peut s'interpréter ainsi :
                 
-            $Température \ (°C) = {round(lr.intercept_, 3)} + {round(lr.coef_[0], 3)} * émissions \ de \ CO_2 \ (Gt)$
+            $Température \ (°C) = {round(fit['intercept'], 3)} + {round(fit['coef'][0], 3)} * émissions \ de \ CO_2 \ (Gt)$
             
             Visualisons le résultat de la régression linéaire en l'affichant sur le nuage de points :
             """
@@ -253,32 +390,14 @@ def run():
     
         #st.markdown("Visualisons le résultat de la régression linéaire en l'affichant sur le nuage de points :")
         
-        fig, ax1 = plt.subplots(figsize=(18,10))
-        plt.grid(color='grey', alpha=0.5, linewidth=2)
-        ax1.scatter(x,
-                    y, 
-                    c=y,
-                    cmap='jet',
-                    s=20,
-                    label='Températures absolues')
-    
-        ax2 = ax1
-        ax2.plot(x,
-                 y_pred,
-                 'r--',
-                 label='Régression linéaire')
-        
-        ax1.set_title("Evolution des températures absolues en fonction des émissions de $CO^2$ : Scatterplot & Droite de régression", fontsize=14)
-        plt.xlabel('$CO_2$ émis / Gigatonnes', fontsize=14)
-        plt.ylabel('Température absolue / °C / Moyennes glissantes sur 10 ans', fontsize=14)
-        plt.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
-        st.pyplot(fig)
+        st.image(figures.image(plot_linear_regression, co2_version, language, data=(x, y, y_pred)),
+                 use_column_width=True)
     
         # Evaluation de la régression :
         
         st.markdown("Afin d'**évaluer notre régression**, nous utilisons comme métrique le **score $R^2$**.")
     
-        score = round(r2_score(y, y_pred), 5)
+        score = round(fit['r2'], 5)
         st.markdown(f"Score obtenu : **${score}$**")
     
     
@@ -286,29 +405,18 @@ def run():
     
     if degree > 1 :
         
-        # Entraînement de la régression :
-        
-        poly_feats = PolynomialFeatures(degree=degree, include_bias=False)
-        x_poly = poly_feats.fit_transform(x)
-        
-        plr = LinearRegression()
-        plr.fit(x_poly, y)
-        
-        y_poly_pred = plr.predict(x_poly)
-        
-        coeffs = []
-        for i in plr.coef_ :
-            coeffs.append(i)
+        y_poly_pred = fit['yhat']
+        coeffs = fit['coef'].tolist()
         
         st.markdown(
             f"""
-            Intercept (valeur de Y lorsque X = 0) : **${round(plr.intercept_,5)}$**
+            Intercept (valeur de Y lorsque X = 0) : **${round(fit['intercept'],5)}$**
             
             Coefficients ('pentes' des courbes la régression) : **${coeffs}$**
 
             Il s'agit d'une régression polynomiale de degré ${degree}$, pour laquelle :
             
-            $Température \ (°C) = {round(plr.intercept_,5)} + \sum_1^{degree} coef_{degree} * (polynôme \ de \ (émissions \ de \ CO_2 \ (Gt))_{degree}$
+            $Température \ (°C) = {round(fit['intercept'],5)} + \sum_1^{degree} coef_{degree} * (polynôme \ de \ (émissions \ de \ CO_2 \ (Gt))_{degree}$
             
             Visualisons le résultat de la régression linéaire en l'affichant sur le nuage de points :
             """
@@ -316,40 +424,40 @@ def run():
         
         # Affichage scatter + droite régression :
         
-        fig, ax1 = plt.subplots(figsize=(18,10))
-        plt.grid(color='grey', alpha=0.5, linewidth=2)
-        ax1.scatter(x,
-                    y, 
-                    c=y,
-                    cmap='jet',
-                    s=20,
-                    label='Températures absolues')
-    
-        ax2 = ax1
-        ax2.plot(x,
-                 y_poly_pred,
-                 'r--',
-                 label=f'Régression polynomiale de degré {degree}')
-        
-        ax1.set_title(f"Evolution des températures absolues en fonction des émissions de $CO^2$ : Scatterplot & Courbe de régression de degré {degree}",
-                      fontsize=14)
-        plt.xlabel('$CO_2$ émis / Gigatonnes', fontsize=14)
-        plt.ylabel('Température absolue / °C / Moyennes glissantes sur 10 ans', fontsize=14)
-        plt.legend(loc='upper left', bbox_to_anchor=(0.05, 0.9), fontsize=14, frameon=True)
-        st.pyplot(fig)
+        st.image(figures.image(plot_polynomial_regression, co2_version, language,
+                               data=(x, y, y_poly_pred), degree=degree), use_column_width=True)
         
         # Evaluation de la régression :
         
         st.markdown("Afin d'**évaluer notre régression**, nous utilisons comme métrique le **score $R^2$**.")
     
-        score = round(r2_score(y, y_poly_pred), 5)
+        score = round(fit['r2'], 5)
         st.markdown(f"Score obtenu : **${score}$**")
     
+    # Validation croisée :
+    
+    st.markdown(
+        f"""
+        Le score $R^2$ sur les données d'entraînement de la régression augmente toujours avec le degré. Pour **détecter l'overfitting**,
+        nous évaluons aussi chaque degré par **validation croisée** : les années sont découpées en {polyfit.FOLDS} périodes consécutives,
+        et chaque période est prédite par la régression entraînée sur les autres.
+        
+        Score en validation croisée : **${round(fit['cv_r2'], 5)}$**
+        """
+        )
+    
+    with st.expander("Comparer les scores de tous les degrés...") :
+        st.dataframe(polyfit.scores(fits).rename(columns={'r2': 'R²', 'cv_r2': 'R² en validation croisée',
+                                                          'cv_rmse': 'RMSE en validation croisée (°C)'}))
+    
     st.markdown(
         """
-        En faisant varier de 1 à 5 le degré de la régression polynomiale, **nous obtenons des scores $R^2$ croissants compris entre 0.918
-        et 0.966** (avec un risque d'overfitting).
-        **Le modèle est donc performant** et confirme l'étroite relation qui existe entre nos 2 variables. **Les émissions de $CO_2$ sont
+        En faisant varier de 1 à 5 le degré de la régression polynomiale, le score $R^2$ sur les données d'entraînement croît de 0.918 à
+        0.966, mais **pas le score en validation croisée** : il est le plus élevé pour la régression linéaire ($0.81$), et il est négatif
+        pour les degrés 2, 4 et 5 ($-0.29$, $-39.6$ et $-16.9$), dont les prédictions des périodes mises de côté sont moins bonnes que la
+        température moyenne. **Les degrés plus élevés sur-apprennent** les données d'entraînement, sans mieux les ajuster : c'est la régression
+        linéaire qu'il faut retenir.
+        **Ce modèle linéaire est performant** et confirme l'étroite relation qui existe entre nos 2 variables. **Les émissions de $CO_2$ sont
         donc bien une variable explicative majeure de la hausse des températures**.
         """
         )    
@@ -1,25 +1,15 @@
 import streamlit as st
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 
+import streamlit.components.v1 as components
 
-title = "Confirmation du phénomène"
-sidebar_name = "Confirmation"
-
+from unhappy_earth import aggregates, choropleth, decimate, figures, geometry, webmap
 
-def read_temps():
-    globales = pd.read_csv('data/unhappy_earth/temperatures_globales.csv')
-    hemispheres = pd.read_csv(
-        'data/unhappy_earth/temperatures_hemispheres.csv')
-    countries = pd.read_csv('data/unhappy_earth/temperatures_countries.csv')
-    return globales, hemispheres, countries
 
-
-def read_co2():
-    globales = pd.read_csv('data/unhappy_earth/co2_global.csv')
-    countries = pd.read_csv('data/unhappy_earth/co2_countries.csv')
-    return globales, countries
+title = "Confirmation du phénomène"
+sidebar_name = "Confirmation"
+language = "fr"
 
 
 def plot_month(df, title):
@@ -29,87 +19,145 @@ def plot_month(df, title):
     Plot 12-months moving average temperature.
     """
     # Set the figure size and grid.
-    plt.figure(figsize=(24, 10))
-    plt.grid(color='grey', alpha=0.2)
+    fig, ax = figures.subplots(figsize=(24, 10))
+    ax.grid(color='grey', alpha=0.2)
+
+    # Only the months which are visible at the width of the chart, on a time
+    # axis since they are not evenly spaced.
+    df = df.assign(date=pd.to_datetime(df['date']))
+    lines = df.iloc[decimate.line(ax, df[['abs', 'mov_average']])]
+    points = df.iloc[decimate.scatter(ax, df['abs'])]
 
     # Display line for monthly measures
-    plt.plot(df['date'], df['abs'], c='lightgrey', zorder=1)
+    ax.plot(lines['date'], lines['abs'], c='lightgrey', zorder=1)
     # Display points (circles) for monthly measures
-    plt.scatter(df['date'], df['abs'], c=df['abs'], cmap='jet', s=15, zorder=2,
-                label='Moyennes mensuelles')
+    scatter = ax.scatter(points['date'], points['abs'], c=points['abs'], cmap='jet', s=15, zorder=2,
+                         label='Moyennes mensuelles')
     # Display 12-months moving average as a straight, larger line.
-    plt.plot(df['date'], df['mov_average'], color='k',
-             linewidth=2, label='Moyenne glissante sur 12 mois')
+    ax.plot(lines['date'], lines['mov_average'], color='k',
+            linewidth=2, label='Moyenne glissante sur 12 mois')
 
     # Add the cmap.
-    plt.colorbar()
-    plt.clim(df['abs'].min(), df['abs'].max())
+    fig.colorbar(scatter, ax=ax)
+    scatter.set_clim(df['abs'].min(), df['abs'].max())
 
     # Labels, legend, title.
-    plt.xlabel('Date (par mois)')
-    plt.ylabel('Température absolue en °C')
-    plt.legend()
-    plt.title(title)
+    ax.set_xlabel('Date (par mois)')
+    ax.set_ylabel('Température absolue en °C')
+    ax.legend()
+    ax.set_title(title)
 
-    return plt
+    return fig
 
 
-def plot_year(df, title, show_uncert=False):
+def plot_year(temp_year, title, show_uncert=False):
     """
-    Display both a plot and a scatter plot from a DF, with x = date (by year) and y = absolute temperature.
+    Display both a plot and a scatter plot from a DF of yearly averages (year, abs, uncert), with x = date (by year)
+    and y = absolute temperature.
     The 'show_uncert' parameter allows, if True, to display the uncertainty margin.
     Add a cmap to colorize the scatter plot based on y value, when uncertainty is not plotted.
     """
-    # Compute the average of abs and uncert by year.
-    temp_year = df[['year', 'abs', 'uncert']].groupby(
-        'year').mean().reset_index()
     # Set the figure size and grid.
-    plt.figure(figsize=(12, 5))
-    plt.grid(color='grey', alpha=0.2)
+    fig, ax = figures.subplots(figsize=(12, 5))
+    ax.grid(color='grey', alpha=0.2)
 
     # Display absolute temperatures.
-    plt.plot(temp_year['year'], temp_year['abs'], c='grey', zorder=1)
+    ax.plot(temp_year['year'], temp_year['abs'], c='grey', zorder=1)
 
     # If required, display points and fill the area of uncertainty measures.
     if show_uncert == True:
-        plt.scatter(temp_year['year'], temp_year['abs'],
-                    edgecolor='none', zorder=2, label='Moyennes annuelles')
-        plt.fill_between(temp_year['year'],
-                         temp_year['abs'] - temp_year['uncert'],
-                         temp_year['abs'] + temp_year['uncert'],
-                         color='#D3D3D3', 
-                         zorder=0, label='Incertitude')
+        ax.scatter(temp_year['year'], temp_year['abs'],
+                   edgecolor='none', zorder=2, label='Moyennes annuelles')
+        ax.fill_between(temp_year['year'],
+                        temp_year['abs'] - temp_year['uncert'],
+                        temp_year['abs'] + temp_year['uncert'],
+                        color='#D3D3D3', 
+                        zorder=0, label='Incertitude')
         # Otherwise display absolute temps with a colormap.
     else:
-        plt.scatter(temp_year['year'], temp_year['abs'], c=temp_year['abs'],
-                    cmap='jet', vmin=-40.5, vmax=40, edgecolor='none', 
-                    zorder=2, label='Moyennes annuelles')
-        plt.colorbar()
-        plt.clim(temp_year['abs'].min(), temp_year['abs'].max())
+        scatter = ax.scatter(temp_year['year'], temp_year['abs'], c=temp_year['abs'],
+                             cmap='jet', vmin=-40.5, vmax=40, edgecolor='none', 
+                             zorder=2, label='Moyennes annuelles')
+        fig.colorbar(scatter, ax=ax)
+        scatter.set_clim(temp_year['abs'].min(), temp_year['abs'].max())
 
     # Labels, legend, title.
-    plt.xlabel('Date (par annnée)')
-    plt.ylabel('Température absolue en °C')
-    plt.title(title)
-    plt.legend()
+    ax.set_xlabel('Date (par annnée)')
+    ax.set_ylabel('Température absolue en °C')
+    ax.set_title(title)
+    ax.legend()
+
+    return fig
+
 
-    return plt
+def plot_hemispheres(hems_mov_average_10y):
+    """
+    Plot the centered 10 years rolling averages of both hemispheres.
+    """
+    fig, ax1 = figures.subplots(figsize=(18, 8))
+    # Only the months which are visible at the width of the chart, at their dates.
+    columns = ['north_abs_10y_centered', 'south_abs_10y_centered']
+    hems_mov_average_10y = hems_mov_average_10y.iloc[decimate.line(ax1, hems_mov_average_10y[columns])]
+    hems_mov_average_10y = hems_mov_average_10y.set_axis(pd.to_datetime(hems_mov_average_10y.index))
+    hems_mov_average_10y['north_abs_10y_centered'].plot(ax=ax1, label='Hémisphère Nord')
+    hems_mov_average_10y['south_abs_10y_centered'].plot(ax=ax1, label='Hémisphère Sud')
+    ax1.set_title('Température par hémisphère terrestre - moyenne glissante sur 10 ans, centrée')
+    ax1.legend()
+    ax1.grid()
+    return fig
+
+
+def plot_country_groups(temps_countries_year, temps_countries_year_centered, countries1, countries2):
+    """
+    Plot the centered 10 years rolling averages of two groups of countries, with solid
+    and dotted lines.
+    """
+    fig, ax1 = figures.subplots(figsize=(18, 8))
+    #ax1.set_ylim(-.5, 2)
+    for c in countries1:
+        rows = decimate.line(ax1, temps_countries_year_centered[c])
+        ax1.plot(temps_countries_year['year'].iloc[rows], temps_countries_year_centered[c].iloc[rows], alpha=.5, label=c, linestyle='-')
+    for c in countries2:
+        rows = decimate.line(ax1, temps_countries_year_centered[c])
+        ax1.plot(temps_countries_year['year'].iloc[rows], temps_countries_year_centered[c].iloc[rows], alpha=.7, label=c, linestyle=':')
+    ax1.legend()
+    ax1.grid()
+    return fig
+
+
+def plot_temperatures(annee):
+    """
+    Return the PNG map of the temperatures of the countries in 'annee'.
+    """
+    return choropleth.temperature_map('Températures des terres').render(annee)
+
+
+def plot_difference(merge, breaks, annee):
+    """
+    Plot the map of the differences between the temperatures of 'annee' and of 1900,
+    classified with the natural 'breaks' of the year.
+    """
+    # Not added to the cached frame, which is shared by all sessions.
+    diff = merge[annee] - merge[1900]
+
+    # plot world map 
+    fig, ax1 = figures.subplots(figsize=(14, 12))
+    merge.plot(ax=ax1, column=diff, 
+               legend=True, cmap='YlOrRd',
+               missing_kwds= dict(color="lightgrey",), 
+               edgecolor='darkgrey', linewidth=1, legend_kwds={'loc': 'lower left'},
+               scheme='UserDefined', classification_kwds={'bins': breaks.tolist()})
+    ax1.set_title('Différence de températures', fontsize=25)
+    return fig
 
 
 def run():
 
     st.title(title)
 
-    temps_globales, temps_hemis, temps_countries = read_temps()
-#        [temps_countries['year'], temps_countries.iloc[:, 2:].rolling(120).mean()], axis=1)
-#    temps_globales['uncert_abs'] = temps_globales['abs'] + temps_globales['uncert']
-    temps_globales['uncert_mov_average'] = temps_globales['mov_average'] + temps_globales['uncert']
-#    temps_globales_10y = pd.concat(
-#        [temps_globales['year'], temps_globales.iloc[:, 3:].rolling(120).mean()], axis=1)
-
-    co2_global, co2_countries = read_co2()
-#    co2_countries_10y = pd.concat(
-#        [co2_countries['year'], co2_countries.iloc[:, 2:].rolling(120).mean()], axis=1)
+    # Yearly averages, rolling averages and centered series are precomputed
+    # once per data version in the aggregates store.
+    temps_globales_year = aggregates.load('temperatures_globales_yearly')
 
     st.header('Pouvons-nous confirmer le phénomène de changement climatique ?')
 
@@ -141,8 +189,11 @@ rendant plus visible la tendance générale :
     #     st.pyplot(fig=fig, )
 
     uncert = st.checkbox("Inclure l'incertitude", key='temps_globales_uncert')
-    st.pyplot(fig=plot_year(temps_globales.iloc[:-1,:],
-                            'Températures globales annuelles', show_uncert=uncert))
+    # The charts are drawn once per data version and widget values.
+    st.image(figures.image(plot_year, aggregates.version('temperatures_globales_yearly'), language,
+                           data=(temps_globales_year[temps_globales_year['months'] == 12],),
+                           title='Températures globales annuelles', show_uncert=uncert),
+             use_column_width=True)
 
     st.markdown(
         """
@@ -193,35 +244,10 @@ Visualisons l'évolution de la température dans différentes parties du monde,
     )
         
     # Moyenne glissante sur 10 ans.
-    hems_mov_average_10y_na = []
-    hems_mov_average_10y_nu = []
-    hems_mov_average_10y_sa = []
-    hems_mov_average_10y_su = []
-    for i in np.arange(120, temps_hemis.shape[0]):
-        i_prec = i - 120
-        hems_mov_average_10y_na.append(temps_hemis.iloc[i_prec:i, 4].mean())
-        hems_mov_average_10y_nu.append(temps_hemis.iloc[i_prec:i, 5].mean())
-        hems_mov_average_10y_sa.append(temps_hemis.iloc[i_prec:i, 8].mean())
-        hems_mov_average_10y_su.append(temps_hemis.iloc[i_prec:i, 9].mean())
-
-    hems_mov_average_10y = pd.DataFrame({'north_abs': hems_mov_average_10y_na, 
-                                         'north_uncert': hems_mov_average_10y_nu, 
-                                         'south_abs': hems_mov_average_10y_sa, 
-                                         'south_uncert': hems_mov_average_10y_su
-                                         }, index=temps_hemis['date'][120:])
-    
-    hems_mov_average_10y['north_abs_10y_centered'] = hems_mov_average_10y['north_abs'] - hems_mov_average_10y['north_abs'].mean()
-    hems_mov_average_10y['north_uncert_10y_centered'] = hems_mov_average_10y['north_uncert'] - hems_mov_average_10y['north_uncert'].mean()
-    hems_mov_average_10y['south_abs_10y_centered'] = hems_mov_average_10y['south_abs'] - hems_mov_average_10y['south_abs'].mean()
-    hems_mov_average_10y['south_uncert_10y_centered'] = hems_mov_average_10y['south_uncert'] - hems_mov_average_10y['south_uncert'].mean()
+    hems_mov_average_10y = aggregates.load('temperatures_hemispheres_120m').set_index('date')
     
-    fig, ax1 = plt.subplots(figsize=(18, 8))
-    hems_mov_average_10y['north_abs_10y_centered'].plot(label='Hémisphère Nord')
-    hems_mov_average_10y['south_abs_10y_centered'].plot(label='Hémisphère Sud')
-    plt.title('Température par hémisphère terrestre - moyenne glissante sur 10 ans, centrée')
-    plt.legend()
-    plt.grid()
-    st.pyplot(fig)
+    st.image(figures.image(plot_hemispheres, aggregates.version('temperatures_hemispheres_120m'), language,
+                           data=(hems_mov_average_10y,)), use_column_width=True)
     
     st.markdown(
         """
@@ -247,19 +273,9 @@ Vous pouvez choisir d'autres ensembles de pays pour visualiser d'autres comparai
     
     
 
-    # Compute yearly average
-    temps_countries_year = pd.DataFrame(columns=temps_countries.iloc[:,2:].columns)
-    #display(temps_countries)
-    temps_countries_year = temps_countries.groupby(by='year').agg('mean')
-    temps_countries_year = temps_countries_year.reset_index()
-    
-    #display(temps_countries_year)
-    for c in temps_countries_year.columns[1:]:
-      temps_countries_year[c] = temps_countries_year[c].rolling(10).mean()
-    
-    temps_countries_year_centered = temps_countries_year.copy()
-    for c in temps_countries_year.columns:
-      temps_countries_year_centered[c] = temps_countries_year[c] - temps_countries_year[c].mean()
+    # Compute yearly average, 10 years rolling average, and centered series.
+    temps_countries_year = aggregates.load('temperatures_countries_yearly_10y')
+    temps_countries_year_centered = aggregates.load('temperatures_countries_yearly_10y_centered')
     
     selected_countries_n = ['sudan', 'united-states-of-america', 
                           'greenland', 'russia', 'china']
@@ -278,15 +294,12 @@ Vous pouvez choisir d'autres ensembles de pays pour visualiser d'autres comparai
     if len(countries1) == 0 or len(countries2) == 0: 
         st.markdown("Attention : Selectionner au moins un pays pour chaque groupe.")
     else :
-        fig, ax1 = plt.subplots(figsize=(18, 8))
-        #plt.ylim(-.5, 2)
-        for c in countries1:
-            plt.plot(temps_countries_year['year'], temps_countries_year_centered[c], alpha=.5, label=c, linestyle='-')
-        for c in countries2:
-            plt.plot(temps_countries_year['year'], temps_countries_year_centered[c], alpha=.7, label=c, linestyle=':')
-        plt.legend()
-        plt.grid()
-        st.pyplot(fig)
+        st.image(figures.image(plot_country_groups,
+                               (aggregates.version('temperatures_countries_yearly_10y'),
+                                aggregates.version('temperatures_countries_yearly_10y_centered')), language,
+                               data=(temps_countries_year, temps_countries_year_centered),
+                               countries1=countries1, countries2=countries2),
+                 use_column_width=True)
 
 
     st.markdown(
@@ -312,79 +325,35 @@ collectées. Le graphique suivant permet de naviguer dans le temps, des premièr
     )
     
         
-    import geopandas as gpd
-    
-    # get the geometry (and some more info) about countries.
-    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
-    # rename the columns so that we can merge with our data
-    world.columns=['pop_est', 'continent', 'name', 'CODE', 'gdp_md_est', 'geometry']
-    # Fix some bugs/missing codes in pycountry
-    world['CODE'].loc[world['name'] == 'France'] = 'FRA'
-    world['CODE'].loc[world['name'] == 'Norway'] = 'NOR'
-    
-    # Build our dataframe with proper formatting.
-    df_geo = temps_countries_year.set_index('year').T.reset_index().rename(columns={'index': 'CODE'})
-    
-    # pycountry lookup doesn't recognise some country name, help it a bit.
-    df_geo['CODE'] = df_geo['CODE'].replace({
-        'russia': 'Russian Federation',
-        'united-states-of-america': 'United States',
-        'united-kingdom': 'United Kingdom',
-        'syria': 'Syrian Arab Republic',
-        'central-african-republic': 'Central African Republic',
-        'south-africa': 'South Africa',
-        'federated-states-of-micronesia': 'Micronesia, Federated States of',
-        'iran': 'Iran, Islamic Republic of',
-        'islas-baleares': 'islas-baleares',
-        'laos': "Lao People's Democratic Republic",
-        'timor': 'Timor-Leste',
-        'south-korea': "Korea, Republic of",
-        'north-korea': "Korea, Democratic People's Republic of",
-        'cabo-verde': 'Cabo Verde',
-        'costa-rica': 'Costa Rica',
-        'saudi-arabia': 'Saudi Arabia',
-        'bosnia-and-herzegovina': 'Bosnia and Herzegovina',
-        'reunion': 'Réunion',
-        'new-zealand': 'New Zealand',
-        })
-
-    
-    # convert countries to 3-letter code
-    import pycountry
-    remove_rows = []
-    for i, v in enumerate(df_geo['CODE']):
-        try:
-          c = pycountry.countries.lookup(v)
-          df_geo.iloc[i, 0] = c.alpha_3
-        except Exception:
-          #display(f"Could not find country {v}.")
-          remove_rows.append(i)
-    df_geo = df_geo.drop(index=remove_rows, axis=0)
-    
-    # then merge with our data 
-    merge = pd.merge(world, df_geo, on='CODE', how='outer')
-    
+    # Countries merged with their temperatures (one column per year), computed
+    # once per data version: the maps only select the column of their year.
+    merge = geometry.world_temperatures()
     
-    from matplotlib.colors import Normalize
-    from mapclassify import UserDefined
     
-    temps_countries_from, temps_countries_to = int(temps_countries.iloc[0, 1]), int(temps_countries.iloc[-1, 1])
-    annee = st.slider("Choisir l'année", 
-                      temps_countries_from, 
-                      temps_countries_to, 
-                      1900, key='temps_annee')
+    temps_countries_from, temps_countries_to = int(temps_countries_year['year'].iloc[0]), int(temps_countries_year['year'].iloc[-1])
+    animated = st.checkbox('Animer dans le navigateur (toutes les années sont envoyées une fois)', key='temps_anime')
+    if animated:
+        # In the browser, the years and the animation need no request to the server.
+        labels = {'temperature': 'Température',
+                  'difference': 'Différence avec 1900',
+                  'temperatureTitle': 'Températures des terres',
+                  'differenceTitle': 'Différence de températures',
+                  'play': '▶ Lecture',
+                  'pause': '⏸ Pause',
+                  'missing': 'Données manquantes',
+                  'initialYear': 1900}
+        components.html(webmap.page(labels), height=webmap.HEIGHT)
+    else:
+        annee = st.slider("Choisir l'année", 
+                          temps_countries_from, 
+                          temps_countries_to, 
+                          1900, key='temps_annee')
     
     
-    bins = UserDefined(merge[annee], bins=[0,3,5,7,9,11,13,15,17,19,21,23,25,27]).bins
-    fig, ax1 = plt.subplots(figsize=(14, 12))
-    # plot world map 
-    merge.plot(ax=ax1, column=annee,
-               legend=True, cmap='YlOrRd',
-               missing_kwds= dict(color="lightgrey",), 
-               edgecolor='darkgrey', linewidth=1, legend_kwds={'loc': 'lower left'},
-               scheme='userdefined', classification_kwds={'bins':bins}, norm=Normalize(0, len(bins)), vmin=-20, vmax=23)
-    ax1.set_title('Températures des terres', fontsize=25)
-    st.pyplot(fig)
+        # The map is drawn once per data version: a new year only recolors the
+        # countries, once per year.
+        st.image(figures.image(plot_temperatures, geometry.version(), language, annee=annee),
+                 use_column_width=True)
 
     st.markdown(
         """
@@ -406,20 +375,17 @@ une date choisie).
     )
 
     
-    annee = st.slider("Choisir l'année", 
-                      1900, 
-                      temps_countries_to, 2014, key='temps_annee_diff')
-    merge['diff'] = merge[annee] - merge[1900]
-
-    # plot world map 
-    fig, ax1 = plt.subplots(figsize=(14, 12))
-    merge.plot(ax=ax1, column='diff', 
-               legend=True, cmap='YlOrRd',
-               missing_kwds= dict(color="lightgrey",), 
-               edgecolor='darkgrey', linewidth=1, legend_kwds={'loc': 'lower left'},
-               scheme='NaturalBreaks')
-    plt.title('Différence de températures', fontsize=25)
-    st.pyplot(fig)
+    if animated:
+        st.info("La carte animée ci-dessus montre aussi cette différence : choisissez son mode 'Différence avec 1900'.")
+    else:
+        annee = st.slider("Choisir l'année", 
+                          1900, 
+                          temps_countries_to, 2014, key='temps_annee_diff')
+        # Natural breaks of the differences, computed for all the years with the aggregates.
+        breaks = aggregates.load(aggregates.DIFFERENCE_BREAKS).set_index('year').loc[annee].dropna()
+        st.image(figures.image(plot_difference,
+                               (geometry.version(), aggregates.version(aggregates.DIFFERENCE_BREAKS)), language,
+                               data=(merge, breaks), pyplot=True, annee=annee), use_column_width=True)
 
     st.markdown(
         """
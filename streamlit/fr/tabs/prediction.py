@@ -1,22 +1,179 @@
+import warnings
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from prophet import Prophet
+
+from unhappy_earth import countries, data, decimate, figures, forecast, harmonic
 
 
 title = "Prédictions"
 sidebar_name = "Prédictions"
+language = "fr"
+
+ENGINES = ["Prophet", "Rapide (régression harmonique)"]
+# Seconds between the checks of the fits running in the background.
+POLL_SECONDS = 2
+
+
+def plot_fast(fast, series, xlabel, ylabel):
+    """
+    Plot the fast forecast of 'series' like Prophet does: measures as dots,
+    forecast as a line, and its uncertainty interval.
+    """
+    history = fast['history'][series].dropna()
+    fig, ax = figures.subplots(figsize=(16,6))
+    # Only the months which are visible at the width of the chart.
+    history = history.iloc[decimate.scatter(ax, history)]
+    predicted = pd.concat([fast[column][series].rename(column) for column in ('yhat', 'yhat_lower', 'yhat_upper')],
+                         axis=1)
+    predicted = predicted.iloc[decimate.line(ax, predicted)]
+    ax.plot(history.index, history, 'k.', markersize=4)
+    ax.plot(predicted.index, predicted['yhat'], ls='-', c='#0072B2')
+    ax.fill_between(predicted.index, predicted['yhat_lower'], predicted['yhat_upper'],
+                    color='#0072B2', alpha=0.2)
+    ax.grid(True, which='major', c='gray', ls='-', lw=1, alpha=0.2)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.tight_layout()
+    return fig
+
+
+def plot_fast_components(fast, series):
+    """
+    Plot the trend and the yearly seasonality of the fast forecast of 'series'.
+    """
+    fig, axes = figures.subplots(2, 1, figsize=(18, 10))
+    axes[0].plot(fast['trend'].index, fast['trend'][series], ls='-', c='#0072B2')
+    seasonality = fast['seasonality'][series]
+    one_year = seasonality.groupby(seasonality.index.month).first()
+    axes[1].plot(one_year.index, one_year, ls='-', c='#0072B2')
+    axes[1].set_xticks(range(1, 13))
+    for ax in axes:
+        ax.grid(True, which='major', c='gray', ls='-', lw=1, alpha=0.2)
+    fig.tight_layout()
+    return fig
+
+
+def plot_training(new_column):
+    """
+    Plot the monthly temperatures of the training period, with their linear trend.
+    """
+    fig, ax1 = figures.subplots(figsize=(16,4))
+    formatter = mdates.DateFormatter("%Y") ### formatter of the date
+
+    ax1.xaxis.set_major_formatter(formatter) ## calling the formatter for the x-axis   
+
+    ax1.plot(mdates.date2num(new_column['ds']), new_column['y'], label="Temperature absolue")    
+
+    x = mdates.date2num(new_column['ds'])
+    z = np.polyfit(x, new_column['y'], 1)
+    p = np.poly1d(z)
+
+    ax1.plot(x,p(x),"r--", label="Tendance")
+    ax1.set_xlabel("Date (par annnée)", fontsize=14)
+    ax1.set_ylabel("Température absolue en °C", fontsize=14)
+    ax1.set_title("Température absolue entre 1975 et 2022 (données mensuelles)", fontsize=18)
+    ax1.grid(color='grey', alpha=0.2)
+
+    fig.legend(loc='upper center', bbox_to_anchor=(0.20, 0.91))
+    return fig
+
+
+def fast_series(fast, series):
+    """
+    Return the fast forecasts of 'series' only, as plot_forecast() and
+    plot_components() read them.
+    """
+    return {name: frame[[series]] for name, frame in fast.items() if name != 'model'}
+
+
+def plot_forecast(model, engine, series, title):
+    """
+    Plot the forecast of 'engine': 'model' is the parameters of the Prophet
+    forecast, read from the forecast cache, or the fast forecasts of which
+    'series' is plotted.
+    """
+    if engine == ENGINES[0]:
+        m, fcst = forecast.cached(model)
+        # On a figure of its own, which Prophet would create with pyplot.
+        fig, ax = figures.subplots(figsize=(16,6), facecolor='w')
+        # Prophet's plotting code warns about the deprecated pandas and matplotlib calls it makes.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            m.plot(fcst, ax=ax, xlabel ='Date (par annnée)', ylabel='Température absolue en °C')
+    else:
+        fig = plot_fast(model, series, xlabel='Date (par annnée)', ylabel='Température absolue en °C')
+    axes = fig.get_axes()
+
+    axes[0].set_xlabel('Date (par annnée)', fontsize=18)
+    axes[0].set_ylabel('Température absolue en °C', fontsize=18)
+
+    fig.suptitle(title,  y=1.02, fontsize=24)
+    return fig
+
+
+def plot_components(model, engine, series):
+    """
+    Plot the trend and the seasonality of the forecast of 'engine' (see plot_forecast()).
+    Prophet draws them with pyplot.
+    """
+    if engine == ENGINES[0]:
+        m, fcst = forecast.cached(model)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fig = m.plot_components(fcst, figsize=(18, 10))
+    else:
+        fig = plot_fast_components(model, series)
+    fig.suptitle("Prediction de la tendance de la température absolue et de la variation saisonnière", y=1.02, fontsize=24)
+    axes = fig.get_axes()
+
+    axes[0].set_xlabel('Date (par annnée)', fontsize=18)
+    axes[0].set_ylabel('Température absolue en °C', fontsize=18)
+    axes[1].set_xlabel("Mois de l'année", fontsize=18)
+    axes[1].set_ylabel('Var saisonnière temp / tendance, en°C', fontsize=18)
+    return fig
+
+
+def fit_in_background(params):
+    """
+    Return the Future of the fit of 'params' in a worker process, submitted
+    unless the forecast is stored. The session keeps it, so that a failed fit
+    is reported rather than submitted again on every rerun.
+    """
+    fits = st.session_state.setdefault('forecast_fits', {})
+    cache_key = forecast.key(params)
+    future = fits.get(cache_key)
+    if future is None or (future.done() and future.exception() is None):
+        future = fits[cache_key] = forecast.submit(params)
+    return future
+
+
+def fit_status(future, message):
+    """
+    Display 'message' in place of the charts while 'future' runs, or its error.
+    """
+    if future.done() and future.exception() is not None:
+        st.error("Le modèle n'a pas pu être entraîné : {}".format(future.exception()))
+    else:
+        st.info(message)
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def rerun_when_fitted(futures):
+    """
+    Rerun the tab once one of the fits 'futures' is done, checking every
+    POLL_SECONDS: the tab is displayed meanwhile.
+    """
+    if any(future.done() for future in futures):
+        st.rerun()
 
 
 def run():
 
     st.image("streamlit/fr/assets/station_meteo.jpg", use_column_width=True)    
 
-#Importer les donnes:
-    df = pd.read_csv('data/unhappy_earth/temperatures_globales.csv')
-    
     st.title("Modélisation / prédiction de la température sur les prochaines années.")
     
     st.markdown("---")
@@ -46,51 +203,45 @@ def run():
     ''', unsafe_allow_html=True)
 
 #Definition des donnes a traiter: 
-    new_column = df.loc[(df['date'] >= '1975-01-15')] 
-    new_column = new_column[['date', 'abs']] 
-    new_column.dropna(inplace=True)
-    new_column.columns = ['ds', 'y'] 
+    new_column = forecast.training_frame('temperatures_globales', '1975-01-15')
 
 # Affichage graphe evolution températures / tendance:
-    fig, ax1 = plt.subplots(figsize=(16,4))
-    formatter = mdates.DateFormatter("%Y") ### formatter of the date
-    
-    ax1.xaxis.set_major_formatter(formatter) ## calling the formatter for the x-axis   
-    
-    ax1.plot(mdates.date2num(new_column['ds']), new_column['y'], label="Temperature absolue")    
-
-    x = mdates.date2num(new_column['ds'])
-    z = np.polyfit(x, new_column['y'], 1)
-    p = np.poly1d(z)
-     
-    ax1.plot(x,p(x),"r--", label="Tendance")
-    ax1.set_xlabel("Date (par annnée)", fontsize=14)
-    ax1.set_ylabel("Température absolue en °C", fontsize=14)
-    plt.title("Température absolue entre 1975 et 2022 (données mensuelles)", fontsize=18)
-    plt.grid(color='grey', alpha=0.2)
-
-    fig.legend(loc='upper center', bbox_to_anchor=(0.20, 0.91))
-    
-    st.pyplot(fig)
+    st.image(figures.image(plot_training, data.data_version('temperatures_globales'), language,
+                           data=(new_column,)), use_column_width=True)
 
 
 #Prediction Prophet    
     st.markdown("A partir de nos données, Facebook Prophet calcule la **prédiction** suivante pour les **températures sur les 50 prochaines années**:")
 
 
-    m = Prophet(seasonality_mode='additive').fit(new_column)
-    future = m.make_future_dataframe(periods=600, freq='M')
-    fcst = m.predict(future)
-    fig = m.plot(fcst, figsize=(16,6), xlabel ='Date (par annnée)', ylabel='Température absolue en °C')
-    axes = fig.get_axes()
-
-    axes[0].set_xlabel('Date (par annnée)', fontsize=18)
-    axes[0].set_ylabel('Température absolue en °C', fontsize=18)
+    engine = st.radio("Moteur de prédiction :", ENGINES, horizontal=True, key='forecast_engine')
 
-    fig.suptitle("Prédiction de la température sur les 50 prochaines années",  y=1.02, fontsize=24)
-    import warnings
-    warnings.filterwarnings("ignore")
-    st.pyplot(fig)
+    # Fits running in the background, until which the tab displays placeholders.
+    fitting = []
+    if engine == ENGINES[0]:
+        # Fitted once per version of the data, then served from the forecast cache.
+        # The fit runs in a worker process, shared by the sessions requesting it:
+        # the tab is displayed meanwhile, and rerun once the forecast is stored.
+        params = forecast.params('temperatures_globales', '1975-01-15',
+                                 seasonality_mode='additive', periods=600, freq='M')
+        fit = fit_in_background(params)
+        if not fit.done():
+            fitting.append(fit)
+        model, version = params, forecast.key(params)
+        ready = forecast.is_stored(params)
+    else:
+        st.markdown("Le moteur rapide modélise la température par une tendance linéaire et une saisonnalité de 12 mois, ajustées par moindres carrés : les séries globale, des hémisphères et de tous les pays sont prédites en quelques millisecondes.")
+        model = fast_series(harmonic.forecast_all('1975-01-15', periods=600), 'global')
+        version = harmonic.version()
+        ready = True
+    # Les graphiques sont dessinés une fois par version de la prédiction,
+    # voir unhappy_earth.figures.
+    if ready:
+        st.image(figures.image(plot_forecast, version, language, data=(model,), engine=engine, series='global',
+                               title="Prédiction de la température sur les 50 prochaines années"),
+                 use_column_width=True)
+    else:
+        fit_status(fit, "Entraînement du modèle, la prédiction s'affichera dans quelques secondes...")
 
     st.markdown("La prédiction qui commence à partir de l'année 2022 sur ce graphique, nous montre **toujours une évolution** de la température **à la hausse**. ")
 
@@ -99,17 +250,59 @@ def run():
     st.markdown("- **la tendance** ;")
     st.markdown("- **les déviations saisonnières** de cette tendance :")
     
-    fig = m.plot_components(fcst, figsize=(18, 10))
-    fig.suptitle("Prediction de la tendance de la température absolue et de la variation saisonnière", y=1.02, fontsize=24)
-    axes = fig.get_axes()
+    if ready:
+        st.image(figures.image(plot_components, version, language, data=(model,), pyplot=engine == ENGINES[0],
+                               engine=engine, series='global'),
+                 use_column_width=True)
+    elif not fit.done():
+        st.info("Les composantes s'afficheront avec la prédiction.")
 
-    axes[0].set_xlabel('Date (par annnée)', fontsize=18)
-    axes[0].set_ylabel('Température absolue en °C', fontsize=18)
-    axes[1].set_xlabel("Mois de l'année", fontsize=18)
-    axes[1].set_ylabel('Var saisonnière temp / tendance, en°C', fontsize=18)
-    warnings.filterwarnings("ignore")
-    
-    st.pyplot(fig)
+#Precision sur les 10 dernieres annees
+    st.markdown("Pour comparer les deux moteurs, chaque modèle est aussi entraîné **sans les 10 dernières années**, qui sont ensuite prédites et comparées aux mesures :")
+
+    holdout = {ENGINES[1]: forecast.holdout_fast('temperatures_globales', '1975-01-15')}
+    holdout_params = forecast.holdout_params('temperatures_globales', '1975-01-15',
+                                             seasonality_mode='additive', freq='M')
+    # The table is displayed without Prophet until its fit is done.
+    fitted = forecast.cached(holdout_params) if forecast.is_stored(holdout_params) else None
+    if fitted is not None:
+        holdout[ENGINES[0]] = forecast.holdout_prophet(holdout_params, fitted[1])
+    elif engine == ENGINES[0]:
+        holdout_fit = fit_in_background(holdout_params)
+        if not holdout_fit.done():
+            fitting.append(holdout_fit)
+        fit_status(holdout_fit, "Entraînement du modèle sur la période d'apprentissage : sa précision sera ajoutée au tableau dans quelques secondes...")
+    else:
+        st.info("Sélectionnez le moteur Prophet pour calculer sa précision sur les 10 dernières années.")
+    holdout = pd.DataFrame(holdout).T[['mae', 'rmse', 'coverage']]
+    holdout.columns = ["MAE (°C)", "RMSE (°C)", "Couverture de l'intervalle à 80 %"]
+    st.table(holdout.style.format({holdout.columns[0]: '{:.3f}', holdout.columns[1]: '{:.3f}',
+                                   holdout.columns[2]: '{:.0%}'}))
+
+    if fitting:
+        rerun_when_fitted(fitting)
+
+#Prediction par pays
+    st.markdown("Le même modèle est entraîné sur les températures de **chaque pays** depuis 1975. Choisissez un pays pour afficher sa prédiction sur les 50 prochaines années :")
+
+    # Read from the forecasts precomputed for all the countries.
+    stored = forecast.stored_countries()
+    if not stored:
+        st.info("Les prédictions par pays ne sont pas encore calculées pour les données actuelles. Elles sont précalculées avec `PYTHONPATH=streamlit python -m unhappy_earth.forecast countries`.")
+    else:
+        country = st.selectbox("Choisir un pays", stored,
+                               index=stored.index('france') if 'france' in stored else 0,
+                               format_func=countries.name,
+                               key='forecast_country')
+        country_params = forecast.params(forecast.COUNTRIES, forecast.COUNTRIES_START, column=country)
+        # Listed as stored, but it may have been removed since, e.g. by a refresh of the data.
+        if forecast.cached(country_params) is None:
+            st.info("La prédiction de ce pays n'est plus disponible pour les données actuelles : choisissez un autre pays.")
+        else:
+            st.image(figures.image(plot_forecast, forecast.key(country_params), language, data=(country_params,),
+                                   engine=ENGINES[0], series=None,
+                                   title="Prédiction de la température sur les 50 prochaines années : {}".format(countries.name(country))),
+                     use_column_width=True)
 
 #Conclusion
 
@@ -0,0 +1,5 @@
+"""
+
+Code shared by the en and fr Streamlit apps.
+
+"""
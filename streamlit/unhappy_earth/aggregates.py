@@ -0,0 +1,229 @@
+"""
+
+Derived aggregates of the datasets, computed once per data version.
+
+The tabs display yearly means, rolling means and mean-centered series rather
+than the raw monthly values. They are materialized here:
+* temperatures_globales_yearly: yearly means of the global temperatures, their
+  10 years rolling mean, and its centered variant,
+* temperatures_hemispheres_yearly: yearly means of both hemispheres,
+* temperatures_hemispheres_120m: 120 months rolling means of both hemispheres
+  (mean of the 120 previous months), and their centered variant,
+* temperatures_countries_yearly: yearly means of each country,
+* temperatures_countries_yearly_10y: their 10 years rolling mean, and
+  temperatures_countries_yearly_10y_centered its centered variant,
+* temperatures_countries_120m: 120 months rolling mean of each country,
+* temperatures_countries_difference_breaks: for each year from 1900, the
+  natural breaks (unhappy_earth.jenks) of the differences between the 10 years
+  rolling means of the countries in that year and in 1900, which classify the
+  map of the differences.
+
+Each aggregate is computed from the float64 values of its source dataset (as
+in its CSV file), and versioned against the content hash of its source
+datasets (and of the DEPENDENCIES it also reads).
+Build them in data/unhappy_earth/aggregates/ with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.aggregates
+
+When the built aggregates are missing or out of date, they are computed in
+memory on first use, once per process.
+
+"""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import columnar, countries, data, jenks, rolling
+
+
+# Bump when the computation of an aggregate changes.
+FORMAT_VERSION = 4
+
+DIFFERENCE_BREAKS = 'temperatures_countries_difference_breaks'
+REFERENCE_YEAR = 1900
+
+HEMISPHERE_COLUMNS = ['north_abs', 'north_uncert', 'south_abs', 'south_uncert']
+
+# name -> (version, frame)
+_cache = {}
+_lock = threading.Lock()
+
+
+def _yearly(frame, columns):
+    """
+    Return the yearly means of 'columns', with the number of months of each year.
+    """
+    grouped = frame.groupby('year')
+    yearly = pd.concat([grouped.size().rename('months'), grouped[columns].mean()], axis=1)
+    return yearly.reset_index()
+
+
+def _centered(frame, columns, suffix='_centered'):
+    for c in columns:
+        frame[c + suffix] = frame[c] - frame[c].mean()
+    return frame
+
+
+def globales_yearly(globales):
+    yearly = _yearly(globales, ['abs', 'uncert'])
+    yearly['abs_10y'] = rolling.rolling_mean(yearly['abs'], 10)
+    return _centered(yearly, ['abs_10y'])
+
+
+def hemispheres_yearly(hemispheres):
+    return _yearly(hemispheres, HEMISPHERE_COLUMNS)
+
+
+def hemispheres_120m(hemispheres):
+    """
+    Mean of the 120 previous months (current one excluded), ignoring missing
+    values, from the 121st month on.
+    """
+    rolled = rolling.rolling_frame(hemispheres, HEMISPHERE_COLUMNS, 120, min_periods=1,
+                                   closed='left')
+    frame = pd.concat([hemispheres[['date']], rolled], axis=1).iloc[120:].reset_index(drop=True)
+    return _centered(frame, HEMISPHERE_COLUMNS, suffix='_10y_centered')
+
+
+def _countries(countries):
+    return [c for c in countries.columns if c not in ('date', 'year')]
+
+
+def countries_yearly(countries):
+    return _yearly(countries, _countries(countries)).drop(columns='months')
+
+
+def countries_yearly_10y(countries):
+    yearly = countries_yearly(countries)
+    columns = _countries(yearly)
+    yearly[columns] = rolling.rolling_frame(yearly, columns, 10)
+    return yearly
+
+
+def countries_yearly_10y_centered(countries):
+    yearly = countries_yearly_10y(countries)
+    columns = _countries(yearly)
+    yearly[columns] = yearly[columns] - yearly[columns].mean()
+    return yearly
+
+
+def countries_120m(countries):
+    columns = _countries(countries)
+    return pd.concat([countries[['date', 'year']], rolling.rolling_frame(countries, columns, 120)],
+                     axis=1)
+
+
+def countries_difference_breaks(frame):
+    """
+    Natural breaks of the differences of the 10 years rolling means of the
+    countries (the ones of the maps, with an ISO3 code) with REFERENCE_YEAR:
+    year, then break_1 ... break_K, NaN past the number of distinct values.
+    """
+    yearly = countries_yearly_10y(frame).set_index('year')
+    codes = countries.mapping(countries.TEMPERATURES)
+    yearly = yearly[[c for c in yearly.columns if codes.get(c) is not None]].loc[REFERENCE_YEAR:]
+    differences = yearly.to_numpy() - yearly.loc[REFERENCE_YEAR].to_numpy()
+    breaks = np.full((len(yearly), jenks.K), np.nan)
+    for i, row in enumerate(differences):
+        row_breaks = jenks.natural_breaks(row)
+        breaks[i, :len(row_breaks)] = row_breaks
+    columns = [f'break_{i}' for i in range(1, jenks.K + 1)]
+    return pd.concat([yearly.index.to_frame(index=False),
+                      pd.DataFrame(breaks, columns=columns)], axis=1)
+
+
+# name -> (source dataset, function computing the aggregate from it)
+AGGREGATES = {
+    'temperatures_globales_yearly': ('temperatures_globales', globales_yearly),
+    'temperatures_hemispheres_yearly': ('temperatures_hemispheres', hemispheres_yearly),
+    'temperatures_hemispheres_120m': ('temperatures_hemispheres', hemispheres_120m),
+    'temperatures_countries_yearly': ('temperatures_countries', countries_yearly),
+    'temperatures_countries_yearly_10y': ('temperatures_countries', countries_yearly_10y),
+    'temperatures_countries_yearly_10y_centered': ('temperatures_countries',
+                                                   countries_yearly_10y_centered),
+    'temperatures_countries_120m': ('temperatures_countries', countries_120m),
+    DIFFERENCE_BREAKS: ('temperatures_countries', countries_difference_breaks),
+}
+
+# name -> other datasets read by the aggregate
+DEPENDENCIES = {
+    DIFFERENCE_BREAKS: [countries.NAME],
+}
+
+
+def aggregate_dir(name):
+    return os.path.join(data.DATA_DIR, 'aggregates', name)
+
+
+def version(name):
+    """
+    Return the version of aggregate 'name': a hash of its source data and of
+    the aggregates format.
+    """
+    source, _ = AGGREGATES[name]
+    versions = ':'.join(data.version(dataset) for dataset in [source, *DEPENDENCIES.get(name, [])])
+    return hashlib.sha1(f'{FORMAT_VERSION}:{name}:{versions}'.encode()).hexdigest()
+
+
+def source_frame(source):
+    """
+    Return dataset 'source' with the float64 values of its CSV file, in a
+    frame of its own rather than the shared one of data.load().
+    """
+    frame = columnar.load(source, source_hash=data.version(source), float64=True)
+    if frame is None:
+        return pd.read_csv(data.path(source))
+    # A deep copy consolidates the columns into one block per dtype, which
+    # the groupby and rolling operations are much faster on.
+    return frame.copy()
+
+
+def compute(name):
+    source, func = AGGREGATES[name]
+    return func(source_frame(source))
+
+
+def build(name):
+    return columnar.save(compute(name), aggregate_dir(name), version(name))
+
+
+def build_all(sources=None):
+    """
+    Build the aggregates of the 'sources' datasets (all by default).
+    """
+    return {name: build(name) for name, (source, _) in AGGREGATES.items()
+            if sources is None or source in sources
+            or any(dataset in sources for dataset in DEPENDENCIES.get(name, []))}
+
+
+def is_built():
+    return os.path.isdir(os.path.join(data.DATA_DIR, 'aggregates'))
+
+
+def load(name, columns=None):
+    """
+    Return aggregate 'name' as a DataFrame, only with 'columns' if given.
+    Like data.load(), the frame must not be modified in place.
+    """
+    current = version(name)
+    with _lock:
+        cached = _cache.get(name)
+        if cached is None or cached[0] != current:
+            frame = columnar.read(aggregate_dir(name), source_hash=current, float64=True)
+            if frame is None:
+                frame = compute(name)
+            cached = (current, frame)
+            _cache[name] = cached
+    frame = cached[1]
+    if columns is not None:
+        return frame[list(columns)]
+    return frame.copy(deep=False)
+
+
+if __name__ == '__main__':
+    for name, meta in build_all().items():
+        print(f"{name}: {meta['rows']} rows, {len(meta['columns'])} columns")
@@ -0,0 +1,284 @@
+"""
+
+Rolling-origin backtesting of the temperature forecasts.
+
+For each cutoff (every few years from 1975 on), each model is trained on the
+months before the cutoff, within its training window, and forecasts the
+following 'horizon' months, which are compared with the measures. The errors
+are reported by horizon year: MAE, RMSE and coverage of the prediction
+interval.
+
+A model is a forecaster and its training window: 'start' (first date)
+and/or 'window' (number of years before the cutoff). The forecaster is a
+name of FORECASTERS (the functions of this module), or any importable
+function with the same signature, given as a function or as its
+'module:function' path, which the worker processes import. Each (model,
+cutoff) is run once per version of the data, in the worker processes of
+unhappy_earth.jobs, and its result stored in data/unhappy_earth/backtests/,
+so that adding a model or a cutoff only runs the new ones (rename a
+forecaster of your own when its code changes).
+
+Compare the models, or forecasters of your own trained on all the months
+before the cutoffs, from the repository root with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.backtest [model | module:function ...]
+
+"""
+
+import concurrent.futures
+import hashlib
+import importlib
+import json
+import os
+import statistics
+import sys
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import columnar, data, forecast, harmonic, jobs
+
+
+# Bump when the forecasters or the stored results change.
+FORMAT_VERSION = 1
+
+NAME = 'temperatures_globales'
+COLUMN = 'abs'
+FIRST_CUTOFF = '1975-01-15'
+EVERY_YEARS = 5
+HORIZON = 120
+INTERVAL_WIDTH = 0.8
+# Minimum number of training months of a (model, cutoff).
+MIN_TRAIN = 36
+
+
+def _z(interval_width=INTERVAL_WIDTH):
+    return statistics.NormalDist().inv_cdf(0.5 + interval_width / 2)
+
+
+def prophet(train, months, seasonality_mode='additive'):
+    """
+    Prophet, set up like the Forecast tab.
+    """
+    from prophet import Prophet
+
+    model = Prophet(seasonality_mode=seasonality_mode, interval_width=INTERVAL_WIDTH)
+    model.fit(train)
+    fcst = model.predict(pd.DataFrame({'ds': pd.to_datetime(columnar.months_to_dates(months))}))
+    return fcst['yhat'].to_numpy(), fcst['yhat_lower'].to_numpy(), fcst['yhat_upper'].to_numpy()
+
+
+def fast(train, months):
+    """
+    Linear trend plus 12 months seasonality (unhappy_earth.harmonic).
+    """
+    model = harmonic.fit(columnar.dates_to_months(train['ds']), train['y'].to_numpy())
+    yhat, lower, upper = model.predict(months, INTERVAL_WIDTH)
+    return yhat[:, 0], lower[:, 0], upper[:, 0]
+
+
+def seasonal_naive(train, months):
+    """
+    Value of the same month of the last training year. The interval grows
+    with the number of years ahead, as for a seasonal random walk.
+    """
+    train_months = columnar.dates_to_months(train['ds'])
+    last = pd.Series(train['y'].to_numpy(), index=train_months % 12).groupby(level=0).last()
+    yhat = last.reindex(months % 12).to_numpy()
+    y = pd.Series(train['y'].to_numpy(), index=train_months)
+    sigma = np.nanstd((y - y.reindex(train_months - 12).to_numpy()).to_numpy())
+    years_ahead = (months - train_months[-1] - 1) // 12 + 1
+    half_width = _z() * sigma * np.sqrt(years_ahead)
+    return yhat, yhat - half_width, yhat + half_width
+
+
+def climatology(train, months):
+    """
+    Mean of the same month over the training window, with the interval of its
+    dispersion.
+    """
+    by_month = pd.Series(train['y'].to_numpy(),
+                         index=columnar.dates_to_months(train['ds']) % 12).groupby(level=0)
+    yhat = by_month.mean().reindex(months % 12).to_numpy()
+    half_width = _z() * by_month.std().reindex(months % 12).to_numpy()
+    return yhat, yhat - half_width, yhat + half_width
+
+
+FORECASTERS = {
+    'prophet': prophet,
+    'fast': fast,
+    'seasonal_naive': seasonal_naive,
+    'climatology': climatology,
+}
+
+# name -> forecaster and training window ('start' date and/or 'window' years).
+MODELS = {
+    'prophet_1975': {'forecaster': 'prophet', 'start': '1975-01-15'},
+    'prophet_30y': {'forecaster': 'prophet', 'window': 30},
+    'fast_1975': {'forecaster': 'fast', 'start': '1975-01-15'},
+    'fast_30y': {'forecaster': 'fast', 'window': 30},
+    'seasonal_naive_5y': {'forecaster': 'seasonal_naive', 'window': 5},
+    'climatology_30y': {'forecaster': 'climatology', 'window': 30},
+}
+
+
+def reference(forecaster):
+    """
+    Return the reference of 'forecaster' stored in a model: a name of
+    FORECASTERS or 'module:function' path, or the path of a function.
+    """
+    if not callable(forecaster):
+        return forecaster
+    if forecaster.__module__ == '__main__' or '<locals>' in forecaster.__qualname__:
+        raise ValueError(f"Forecaster {forecaster.__qualname__} can not be imported by the workers: "
+                         f"define it at the top level of a module")
+    return f'{forecaster.__module__}:{forecaster.__qualname__}'
+
+
+def resolve(forecaster):
+    """
+    Return the function of the forecaster reference 'forecaster'.
+    """
+    if forecaster in FORECASTERS:
+        return FORECASTERS[forecaster]
+    module_name, sep, qualname = forecaster.partition(':')
+    if not sep:
+        raise ValueError(f"Unknown forecaster {forecaster!r}, expected one of "
+                         f"{sorted(FORECASTERS)} or a 'module:function' path")
+    func = importlib.import_module(module_name)
+    for attr in qualname.split('.'):
+        func = getattr(func, attr)
+    return func
+
+
+def _model(model):
+    return dict(model, forecaster=reference(model['forecaster']))
+
+
+def backtest_root():
+    return os.path.join(data.DATA_DIR, 'backtests')
+
+
+def cutoffs(first=FIRST_CUTOFF, every_years=EVERY_YEARS, name=NAME, column=COLUMN):
+    """
+    Return the cutoff dates: every 'every_years' years from 'first' on, while
+    at least one month is left to forecast.
+    """
+    series = forecast.training_frame(name, None, column)
+    first_month = columnar.dates_to_months([first])[0]
+    last_month = columnar.dates_to_months(series['ds'])[-1]
+    return list(columnar.months_to_dates(np.arange(first_month, last_month, 12 * every_years)))
+
+
+def _train_test(model, cutoff, horizon, name, column):
+    series = forecast.training_frame(name, None, column)
+    months = columnar.dates_to_months(series['ds'])
+    cutoff_month = columnar.dates_to_months([cutoff])[0]
+    rows = months < cutoff_month
+    if 'start' in model:
+        rows &= series['ds'].to_numpy() >= model['start']
+    if 'window' in model:
+        rows &= months >= cutoff_month - 12 * model['window']
+    test = (months >= cutoff_month) & (months < cutoff_month + horizon)
+    return series.loc[rows].reset_index(drop=True), series.loc[test].reset_index(drop=True)
+
+
+def key(model, cutoff, horizon=HORIZON, name=NAME, column=COLUMN):
+    identity = {'model': _model(model), 'cutoff': cutoff, 'horizon': horizon, 'name': name,
+                'column': column, 'data_version': data.version(name), 'format': FORMAT_VERSION}
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+def _path(cache_key):
+    return os.path.join(backtest_root(), cache_key + '.pkl')
+
+
+def run(model, cutoff, horizon=HORIZON, name=NAME, column=COLUMN):
+    """
+    Train 'model' before 'cutoff' and return the frame of its forecasts of
+    the following months: month, horizon (months ahead, from 1), y, yhat,
+    yhat_lower, yhat_upper. Empty when there is not enough training data.
+    """
+    train, test = _train_test(model, cutoff, horizon, name, column)
+    columns = ['month', 'horizon', 'y', 'yhat', 'yhat_lower', 'yhat_upper']
+    if len(train) < MIN_TRAIN or len(test) == 0:
+        return pd.DataFrame(columns=columns)
+    months = columnar.dates_to_months(test['ds'])
+    options = {k: v for k, v in model.items() if k not in ('forecaster', 'start', 'window')}
+    yhat, lower, upper = resolve(reference(model['forecaster']))(train, months, **options)
+    return pd.DataFrame({'month': months,
+                         'horizon': months - columnar.dates_to_months([cutoff])[0] + 1,
+                         'y': test['y'].to_numpy(), 'yhat': yhat,
+                         'yhat_lower': lower, 'yhat_upper': upper})[columns]
+
+
+def _run_job(model, cutoff, horizon, name, column):
+    """
+    Worker process side of submit(): run and store a (model, cutoff).
+    """
+    cache_key = key(model, cutoff, horizon, name, column)
+    if not os.path.exists(_path(cache_key)):
+        result = run(model, cutoff, horizon, name, column)
+        os.makedirs(backtest_root(), exist_ok=True)
+        tmp_path = _path(cache_key) + '.tmp'
+        result.to_pickle(tmp_path)
+        os.replace(tmp_path, _path(cache_key))
+    return cache_key
+
+
+def submit(model, cutoff, horizon=HORIZON, name=NAME, column=COLUMN):
+    """
+    Run a (model, cutoff) in a worker process, unless it is stored, and
+    return the Future of its key.
+    """
+    model = _model(model)
+    cache_key = key(model, cutoff, horizon, name, column)
+    if os.path.exists(_path(cache_key)):
+        future = concurrent.futures.Future()
+        future.set_result(cache_key)
+        return future
+    # The forecaster is sent as its reference, resolved in the worker.
+    return jobs.submit(('backtest', cache_key), _run_job, model, cutoff, horizon, name, column)
+
+
+def backtest(models=None, cutoff_dates=None, horizon=HORIZON, name=NAME, column=COLUMN):
+    """
+    Run the (model, cutoff) pairs in parallel, and return the frame of all
+    their forecasts, with 'model' and 'cutoff' columns.
+    'models' maps names to models (MODELS by default), whose forecaster may
+    be a function or 'module:function' path of your own.
+    """
+    models = MODELS if models is None else models
+    cutoff_dates = cutoffs(name=name, column=column) if cutoff_dates is None else cutoff_dates
+    futures = {(label, cutoff): submit(model, cutoff, horizon, name, column)
+               for label, model in models.items() for cutoff in cutoff_dates}
+    frames = []
+    for (label, cutoff), future in futures.items():
+        result = pd.read_pickle(_path(future.result()))
+        frames.append(result.assign(model=label, cutoff=cutoff))
+    return pd.concat(frames, ignore_index=True)
+
+
+def report(results):
+    """
+    Return the MAE, RMSE and coverage of each model by horizon year.
+    """
+    results = results.assign(horizon_year=(results['horizon'] - 1) // 12 + 1)
+    rows = []
+    for (label, year), group in results.groupby(['model', 'horizon_year'], sort=False):
+        rows.append(dict(model=label, horizon_year=year, n=len(group),
+                         **forecast.scores(group['y'], group['yhat'], group['yhat_lower'],
+                                           group['yhat_upper'])))
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    # The jobs must reference the functions of the imported module, which the
+    # workers can import, not of __main__.
+    from unhappy_earth import backtest as module
+    selected = sys.argv[1:] or list(module.MODELS)
+    table = module.report(module.backtest({m: module.MODELS.get(m, {'forecaster': m}) for m in selected}))
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None,
+                           'display.width', 200):
+        print(table.pivot(index='horizon_year', columns='model',
+                          values=['mae', 'rmse', 'coverage']).round(3))
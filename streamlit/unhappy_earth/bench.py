@@ -0,0 +1,306 @@
+"""
+
+Micro-benchmarks of the shared modules.
+
+Run them from the repository root with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.bench [name ...]
+
+"""
+
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import (aggregates, choropleth, countries, data, decimate, geometry, harmonic, ingest,
+                          jenks, lazy, pairwise, polyfit, rolling)
+
+
+def _best(func, number=5, repeat=5):
+    """
+    Return the best time of one call of 'func', in milliseconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+
+def _report(title, timings):
+    print(title)
+    base = None
+    for label, ms in timings:
+        base = base or ms
+        print(f"  {label:<40} {ms:9.2f} ms  (x{base / ms:.1f})")
+
+
+def bench_ingest():
+    """
+    Rebuilding the global dataset from the raw TAVG file: streaming parser vs
+    the naive whitespace-separated pd.read_csv approach of the notebooks.
+    """
+    baseline = ingest.parse_tavg(ingest.GLOBAL_FILE)['baseline']
+
+    def naive():
+        frame = pd.read_csv(ingest.GLOBAL_FILE, sep=r'\s+', comment='%', header=None)
+        frame = frame.iloc[:, :4]
+        frame.columns = ['year', 'month', 'ano', 'uncert']
+        frame['date'] = pd.to_datetime(frame[['year', 'month']].assign(day=15)).dt.strftime('%Y-%m-%d')
+        frame['abs'] = frame['ano'] + frame['month'].map(lambda m: baseline[m - 1])
+        return frame
+
+    def streaming():
+        return ingest.to_frame(ingest.parse_tavg(ingest.GLOBAL_FILE))
+
+    _report('Rebuild of temperatures_globales from Complete_TAVG_complete.txt',
+            [('pd.read_csv(sep=r"\\s+")', _best(naive)),
+             ('ingest.parse_tavg + to_frame', _best(streaming))])
+
+
+def bench_rolling():
+    """
+    120 months rolling means of the hemispheres, as displayed by the
+    existence tab: iloc loop of the tab vs pandas vs the cumulative sums of
+    unhappy_earth.rolling.
+    """
+    hemis = pd.read_csv(data.path('temperatures_hemispheres'))
+    columns = ['north_abs', 'north_uncert', 'south_abs', 'south_uncert']
+    positions = [hemis.columns.get_loc(c) for c in columns]
+
+    def loop():
+        return [[hemis.iloc[i - 120:i, k].mean() for k in positions]
+                for i in np.arange(120, hemis.shape[0])]
+
+    def pandas():
+        return hemis[columns].rolling(120, min_periods=1).mean().shift(1).iloc[120:]
+
+    def cumsum():
+        return rolling.rolling_frame(hemis, columns, 120, min_periods=1, closed='left').iloc[120:]
+
+    # The aggregate the existence tab is served, against the loop on the CSV file.
+    served = aggregates.load('temperatures_hemispheres_120m', columns)
+    error = np.nanmax(np.abs(np.array(loop()) - served.to_numpy(np.float64)))
+    _report(f'Hemispheres 120 months rolling means (max difference of the served aggregate '
+            f'with the loop: {error:.1e})',
+            [('iloc loop', _best(loop, number=1, repeat=3)),
+             ('pandas rolling', _best(pandas)),
+             ('rolling.rolling_frame', _best(cumsum))])
+
+
+def bench_harmonic():
+    """
+    Fast forecasts of the global, hemisphere and country series: one
+    least-squares fit per series vs the batched fit of unhappy_earth.harmonic.
+    """
+    history = harmonic.series_table('1975-01-15')
+    months, values = history.index.to_numpy(), history.to_numpy()
+    x = harmonic.design(months, months[0])
+
+    def per_series():
+        coefs = []
+        for s in range(values.shape[1]):
+            valid = ~np.isnan(values[:, s])
+            if valid.sum() > x.shape[1]:
+                coefs.append(np.linalg.lstsq(x[valid], values[valid, s], rcond=None)[0])
+        return coefs
+
+    def batched():
+        return harmonic.fit(months, values)
+
+    _report(f'Harmonic fit of {values.shape[1]} series x {values.shape[0]} months',
+            [('np.linalg.lstsq per series', _best(per_series)),
+             ('harmonic.fit', _best(batched)),
+             ('harmonic.forecast_all (+600 months)',
+              _best(lambda: harmonic.forecast_all('1975-01-15')))])
+
+
+def bench_polyfit():
+    """
+    Polynomial regressions of the Correlations tab, degrees 1 to 5: one
+    scikit-learn fit per degree vs all the degrees (and their cross-validated
+    scores) from the QR factorizations of unhappy_earth.polyfit.
+    """
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import r2_score
+    from sklearn.preprocessing import PolynomialFeatures
+
+    temps = aggregates.load('temperatures_globales_yearly')[['year', 'abs']]
+    temps = temps.assign(abs_10y_mov_avg=temps['abs'].rolling(10).mean())
+    co2 = data.load('co2_global').rename(columns={'Year': 'year'})
+    co2_temps = pd.merge(temps.loc[temps['year'] >= 1860], co2, on='year')
+    x = ((co2_temps['Land use emissions (GtCO2)']
+          + co2_temps['Fossil fuel and industry emissions (GtCO2)']) / 1e9).to_frame()
+    y = co2_temps['abs_10y_mov_avg']
+
+    def sklearn():
+        scores = []
+        for degree in range(1, polyfit.MAX_DEGREE + 1):
+            x_poly = PolynomialFeatures(degree=degree, include_bias=False).fit_transform(x)
+            scores.append(r2_score(y, LinearRegression().fit(x_poly, y).predict(x_poly)))
+        return scores
+
+    _report(f'Polynomial regressions of degrees 1 to {polyfit.MAX_DEGREE} ({len(y)} years)',
+            [('PolynomialFeatures + LinearRegression', _best(sklearn)),
+             (f'polyfit.fit_degrees (+{polyfit.FOLDS} folds CV)',
+              _best(lambda: polyfit.fit_degrees(x.iloc[:, 0], y)))])
+
+
+def bench_pairwise():
+    """
+    Correlations of the monthly temperature anomalies of all the pairs of
+    countries: scipy.stats.pearsonr on the common rows of each pair vs the
+    masked matrix products of unhappy_earth.pairwise.
+    """
+    from scipy.stats import pearsonr
+
+    table = pairwise.temperature_anomalies()
+    values = table.to_numpy(np.float64)
+    valid = ~np.isnan(values)
+
+    def per_pair():
+        r = np.full((values.shape[1], values.shape[1]), np.nan)
+        for i in range(values.shape[1]):
+            for j in range(i + 1, values.shape[1]):
+                rows = valid[:, i] & valid[:, j]
+                if rows.sum() >= pairwise.MIN_PERIODS:
+                    r[i, j] = r[j, i] = pearsonr(values[rows, i], values[rows, j])[0]
+        return r
+
+    pairs = values.shape[1] * (values.shape[1] - 1) // 2
+    _report(f'Correlations of {values.shape[1]} countries ({pairs} pairs x {values.shape[0]} months)',
+            [('scipy.stats.pearsonr per pair', _best(per_pair, number=1, repeat=1)),
+             ('pairwise.correlate', _best(lambda: pairwise.correlate(table)))])
+
+
+def bench_choropleth():
+    """
+    Move of the year slider of the temperatures map (existence tab), up to the
+    PNG image: GeoDataFrame.plot() with the UserDefined scheme, saved as
+    st.pyplot() does, vs the recoloring of unhappy_earth.choropleth.
+    Requires geopandas and mapclassify.
+    """
+    import io
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import Normalize
+    from mapclassify import UserDefined
+
+    merge = geometry.world_temperatures()
+    years = iter(list(range(1900, 2021)) * 100)
+
+    def plot():
+        year = next(years)
+        bins = UserDefined(merge[year], bins=choropleth.TEMPERATURE_BINS).bins
+        fig, ax = plt.subplots(figsize=(14, 12))
+        merge.plot(ax=ax, column=year, legend=True, cmap='YlOrRd',
+                   missing_kwds=dict(color="lightgrey"), edgecolor='darkgrey', linewidth=1,
+                   legend_kwds={'loc': 'lower left'}, scheme='userdefined',
+                   classification_kwds={'bins': bins}, norm=Normalize(0, len(bins)), vmin=-20, vmax=23)
+        ax.set_title('Land temperatures', fontsize=25)
+        fig.savefig(io.BytesIO(), format='png', dpi=choropleth.DPI, bbox_inches='tight')
+        plt.close(fig)
+
+    chart = choropleth.temperature_map('Land temperatures')
+
+    _report(f'Temperatures map of a new year ({len(merge)} countries)',
+            [('GeoDataFrame.plot + savefig', _best(plot, number=1, repeat=5)),
+             ('choropleth.YearlyChoropleth.render', _best(lambda: chart.render(next(years)), number=1))])
+
+
+def bench_jenks():
+    """
+    Move of the year slider of the map of the differences with 1900
+    (existence tab), up to the classes of the countries: the NaturalBreaks
+    scheme of GeoDataFrame.plot(), computed on each move, vs the breaks of the
+    year read from the stored aggregate. Requires mapclassify.
+    """
+    from mapclassify import NaturalBreaks, UserDefined
+
+    yearly = aggregates.load('temperatures_countries_yearly_10y').set_index('year')
+    codes = countries.mapping(countries.TEMPERATURES)
+    yearly = yearly[[c for c in yearly.columns if codes.get(c) is not None]]
+    differences = yearly.loc[aggregates.REFERENCE_YEAR:] - yearly.loc[aggregates.REFERENCE_YEAR]
+    years = iter(list(differences.index[1:]) * 100)
+
+    def natural_breaks():
+        diff = differences.loc[next(years)].dropna()
+        return NaturalBreaks(diff, k=5).yb
+
+    def stored():
+        year = next(years)
+        breaks = aggregates.load(aggregates.DIFFERENCE_BREAKS).set_index('year').loc[year].dropna()
+        return UserDefined(differences.loc[year].dropna(), bins=breaks.tolist()).yb
+
+    _report(f'Classes of the differences with 1900 of a new year ({differences.shape[1]} countries)',
+            [('mapclassify.NaturalBreaks', _best(natural_breaks)),
+             ('stored natural breaks + UserDefined', _best(stored)),
+             ('jenks.natural_breaks (build, per year)',
+              _best(lambda: jenks.natural_breaks(differences.loc[next(years)])))])
+
+
+def bench_decimate():
+    """
+    Charts of long monthly series, up to the image as st.pyplot() saves it,
+    with all the months vs the months selected by unhappy_earth.decimate:
+    the global temperatures as a line and colored points (plot_month() of the
+    existence tab), and the 10 years rolling temperatures of three countries
+    (donnees tab).
+    """
+    import io
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    globales = data.load('temperatures_globales')[['date', 'abs']].copy()
+    globales['date'] = pd.to_datetime(globales['date'])
+    options = ['france', 'united-states-of-america', 'china']
+    countries_10y = lazy.dataset('temperatures_countries').rolling_mean(options, 120)
+
+    def monthly(decimated):
+        fig, ax = plt.subplots(figsize=(24, 10))
+        lines = globales.iloc[decimate.line(ax, globales['abs'])] if decimated else globales
+        points = globales.iloc[decimate.scatter(ax, globales['abs'])] if decimated else globales
+        ax.plot(lines['date'], lines['abs'], c='lightgrey', zorder=1)
+        ax.scatter(points['date'], points['abs'], c=points['abs'], cmap='jet', s=15, zorder=2)
+        return fig
+
+    def by_country(decimated):
+        fig, ax = plt.subplots(figsize=(10, 6))
+        for country in options:
+            rows = decimate.line(ax, countries_10y[country]) if decimated else slice(None)
+            ax.plot(countries_10y['year'].iloc[rows], countries_10y[country].iloc[rows], label=country)
+        ax.legend(loc='lower left')
+        return fig
+
+    def image(chart, decimated, format):
+        fig = chart(decimated)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=format, dpi=200, bbox_inches='tight')
+        plt.close(fig)
+        return len(buffer.getvalue())
+
+    for chart, title in [(monthly, f'Monthly global temperatures ({len(globales)} months), line and points'),
+                         (by_country, f'10 years rolling temperatures of {len(options)} countries '
+                                      f'({len(countries_10y)} months)')]:
+        timings = []
+        for decimated in (False, True):
+            label = 'decimate' if decimated else 'all the months'
+            sizes = ', '.join(f'{format} {image(chart, decimated, format) // 1024} kB' for format in ('png', 'svg'))
+            timings.append((f'{label} ({sizes})',
+                            _best(lambda: image(chart, decimated, 'png'), number=1, repeat=3)))
+        _report(title, timings)
+
+
+BENCHMARKS = {
+    'ingest': bench_ingest,
+    'rolling': bench_rolling,
+    'harmonic': bench_harmonic,
+    'polyfit': bench_polyfit,
+    'pairwise': bench_pairwise,
+    'choropleth': bench_choropleth,
+    'jenks': bench_jenks,
+    'decimate': bench_decimate,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,204 @@
+"""
+
+Choropleth maps of the countries which are drawn once and only recolored.
+
+GeoDataFrame.plot() creates a new matplotlib artist for each country polygon,
+classifies the values and lays the figure out on every call. Here a
+ChoroplethMap converts the geometries into one PathCollection once, in a
+figure of its own (outside of pyplot), and draws the static parts of the
+figure (axes, title, legend) once: render() only sets the face color of each
+country, draws the collection over the saved background, and encodes the
+image.
+
+YearlyChoropleth precomputes the (country x year) matrices of the values and
+of their classes (index of their bin, as mapclassify.UserDefined), so that
+showing a year is a lookup of a column of colors.
+
+"""
+
+import io
+import threading
+
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PathCollection
+from matplotlib.colors import Normalize, to_rgba
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+from matplotlib.path import Path
+from PIL import Image
+
+from unhappy_earth import geometry
+
+
+# Resolution and margin of the images, as st.pyplot().
+DPI = 200
+PAD_INCHES = 0.1
+# zlib level: 3 encodes about 25% faster than the default 6, for a similar size.
+PNG_COMPRESS_LEVEL = 3
+MISSING_COLOR = 'lightgrey'
+TEMPERATURE_BINS = [0, 3, 5, 7, 9, 11, 13, 15, 17, 19, 21, 23, 25, 27]
+
+# (geometry version, title) -> YearlyChoropleth of the temperatures.
+_maps = {}
+_lock = threading.Lock()
+
+
+def _ring(coords):
+    coords = np.asarray(coords)[:, :2]
+    codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+    codes[0] = Path.MOVETO
+    codes[-1] = Path.CLOSEPOLY
+    return coords, codes
+
+
+def geometry_path(geom):
+    """
+    Return the compound Path of a (Multi)Polygon, with its holes.
+    """
+    polygons = geom.geoms if geom.geom_type == 'MultiPolygon' else [geom]
+    rings = [_ring(ring.coords) for polygon in polygons
+             for ring in [polygon.exterior, *polygon.interiors]]
+    return Path(np.concatenate([coords for coords, _ in rings]),
+                np.concatenate([codes for _, codes in rings]))
+
+
+def classify(values, bins):
+    """
+    Return the class of each value: the index of its bin, the bins being the
+    upper bounds of the classes (included), and len(bins) above the last
+    one; -1 for NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    classes = np.searchsorted(np.asarray(bins, dtype=np.float64), values, side='left')
+    classes[np.isnan(values)] = -1
+    return classes
+
+
+def palette(cmap, n_classes, missing_color=MISSING_COLOR):
+    """
+    Return the RGBA colors of the classes, then of the missing values (so
+    that class -1 is the missing color). As GeoDataFrame.plot(), the classes
+    span the whole colormap, from its first color to its last.
+    """
+    classes = Normalize(0, n_classes - 1)(np.arange(n_classes))
+    colors = matplotlib.colormaps[cmap](classes)
+    return np.vstack([colors, to_rgba(missing_color)])
+
+
+def interval_labels(bins):
+    """
+    Return the legend labels of the classes of classify(values, bins).
+    """
+    labels = [f'<= {bins[0]:.2f}']
+    labels += [f'({low:.2f}, {high:.2f}]' for low, high in zip(bins[:-1], bins[1:])]
+    return labels + [f'> {bins[-1]:.2f}']
+
+
+class ChoroplethMap:
+    """
+    Map of 'geometries' (shapely (Multi)Polygons, in longitude / latitude)
+    whose render() only changes the colors of the countries.
+    """
+
+    def __init__(self, geometries, title=None, legend=None, figsize=(14, 12), edgecolor='darkgrey',
+                 linewidth=1, title_fontsize=25, legend_loc='lower left'):
+        self.figure = Figure(figsize=figsize, dpi=DPI)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.collection = PathCollection([geometry_path(geom) for geom in geometries],
+                                         edgecolor=edgecolor, linewidth=linewidth)
+        self.ax.add_collection(self.collection, autolim=True)
+        self.ax.autoscale_view()
+        # As GeoDataFrame.plot() for geographic coordinates.
+        (_, ymin), (_, ymax) = self.ax.dataLim.get_points()
+        self.ax.set_aspect(1 / np.cos(np.radians((ymin + ymax) / 2)))
+        if title is not None:
+            self.ax.set_title(title, fontsize=title_fontsize)
+        self.legend = None
+        if legend is not None:
+            # (label, color) pairs. Opaque, so that its pixels can be restored
+            # over the countries.
+            self.legend = self.ax.legend(handles=[Patch(facecolor=color, edgecolor=edgecolor, label=label)
+                                                  for label, color in legend],
+                                         loc=legend_loc, framealpha=1)
+        self._lock = threading.Lock()
+        self._layers()
+
+    def _layers(self):
+        """
+        Draw the static parts of the figure once (axes, title, legend), and
+        keep their pixels and the crop of the image (as bbox_inches='tight').
+        """
+        self.collection.set_visible(False)
+        self.canvas.draw()
+        self.collection.set_visible(True)
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._legend_pixels = (None if self.legend is None
+                               else self.canvas.copy_from_bbox(self.legend.get_window_extent()))
+        tight = self.figure.get_tightbbox(self.canvas.get_renderer()).padded(PAD_INCHES)
+        height = int(self.figure.bbox.height)
+        x0, y0, x1, y1 = (np.array(tight.extents) * DPI).round().astype(int)
+        self._crop = (slice(max(height - y1, 0), height - max(y0, 0)),
+                      slice(max(x0, 0), x1))
+
+    def render(self, colors):
+        """
+        Return the PNG image of the map with the countries painted with
+        'colors' (one RGBA color per geometry).
+        """
+        buffer = io.BytesIO()
+        with self._lock:
+            self.collection.set_facecolor(colors)
+            self.canvas.restore_region(self._background)
+            self.ax.draw_artist(self.collection)
+            if self._legend_pixels is not None:
+                self.canvas.restore_region(self._legend_pixels)
+            # The figure is opaque: RGB, and a faster compression level.
+            pixels = np.ascontiguousarray(np.asarray(self.canvas.buffer_rgba())[self._crop + (slice(0, 3),)])
+            Image.fromarray(pixels).save(buffer, format='png', compress_level=PNG_COMPRESS_LEVEL)
+        return buffer.getvalue()
+
+
+class YearlyChoropleth:
+    """
+    ChoroplethMap of the yearly values of the countries, classified in 'bins'.
+    'frame' has a geometry column and one column per year.
+    """
+
+    def __init__(self, frame, years, bins, cmap='YlOrRd', title=None):
+        frame = frame.loc[frame['geometry'].notna()]
+        self.years = list(years)
+        self._column = {year: i for i, year in enumerate(self.years)}
+        # (country, year) matrices.
+        self.values = frame[self.years].to_numpy(np.float64)
+        self.classes = classify(self.values, bins)
+        self.colors = palette(cmap, len(bins) + 1)
+        self.map = ChoroplethMap(frame['geometry'], title=title,
+                                 legend=list(zip(interval_labels(bins), self.colors[:-1])))
+
+    def render(self, year):
+        """
+        Return the PNG image of the map of 'year'.
+        """
+        return self.map.render(self.colors[self.classes[:, self._column[year]]])
+
+
+def temperature_map(title):
+    """
+    Return the YearlyChoropleth of the yearly temperatures of the countries
+    (unhappy_earth.geometry), built once per data version and title.
+    """
+    key = (geometry.version(), title)
+    with _lock:
+        chart = _maps.get(key)
+        if chart is None:
+            frame = geometry.world_temperatures()
+            years = [c for c in frame.columns if isinstance(c, (int, np.integer))]
+            chart = YearlyChoropleth(frame, years, TEMPERATURE_BINS, title=title)
+            # One map per language, of the current data only.
+            for stale in [k for k in _maps if k[0] != key[0]]:
+                del _maps[stale]
+            _maps[key] = chart
+    return chart
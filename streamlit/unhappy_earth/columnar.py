@@ -0,0 +1,211 @@
+"""
+
+Typed columnar copy of the datasets of data/unhappy_earth/.
+
+Each dataset is stored in data/unhappy_earth/columnar/<name>/ as one .npy file
+per column, plus a meta.json file describing the columns and the hash of the
+CSV file it was built from:
+* float columns are stored as float32 when their values are restored
+  exactly by rounding the float32 values to 4 decimals (the CSV files hold 3
+  at most), float64 otherwise,
+* integer columns are stored as int32,
+* 'YYYY-MM-15' date columns are stored as int32 month indices (year * 12 + month - 1).
+
+The files are memory-mapped when loaded, so that several server processes
+share one copy of them in the page cache. The float32 columns are served as
+the float64 values of the CSV file (widen()), so that the values shown and
+computed by the tabs do not change.
+
+Build (or rebuild) the columnar files from the repository root with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.columnar
+
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import data
+
+
+FORMAT_VERSION = 2
+FLOAT32_DECIMALS = 4
+
+
+def dataset_dir(name):
+    return os.path.join(data.DATA_DIR, 'columnar', name)
+
+
+def _is_month_dates(values):
+    return values.str.fullmatch(r'\d{4}-\d{2}-15').all()
+
+
+def months_to_dates(months):
+    """
+    Convert an array of month indices back to 'YYYY-MM-15' strings.
+    """
+    years, month0 = np.divmod(np.asarray(months, dtype=np.int64), 12)
+    if len(years) == 0:
+        return np.array([], dtype=object)
+    # Format each year and month once, then only concatenate per row.
+    first = int(years.min())
+    year_str = [f'{y:04d}' for y in range(first, int(years.max()) + 1)]
+    month_str = [f'-{m:02d}-15' for m in range(1, 13)]
+    return np.array([year_str[y] + month_str[m]
+                     for y, m in zip((years - first).tolist(), month0.tolist())],
+                    dtype=object)
+
+
+def dates_to_months(dates):
+    """
+    Convert 'YYYY-MM-DD' strings to month indices.
+    """
+    dates = pd.Series(dates).astype(str)
+    return (dates.str[:4].astype(np.int32) * 12
+            + dates.str[5:7].astype(np.int32) - 1).to_numpy(np.int32)
+
+
+def widen(values):
+    """
+    Return the float64 values of the CSV file of float32 'values', which were
+    stored as float32 as they are restored exactly by rounding to
+    FLOAT32_DECIMALS decimals.
+    """
+    return np.round(np.asarray(values, dtype=np.float64), FLOAT32_DECIMALS)
+
+
+def widen_frame(frame):
+    """
+    Return 'frame' with its float32 columns widened to float64.
+    """
+    narrow = [c for c in frame.columns if frame[c].dtype == np.float32]
+    if not narrow:
+        return frame
+    return frame.assign(**{c: widen(frame[c].to_numpy()) for c in narrow})
+
+
+def _encode(series):
+    """
+    Return (kind, array) for a column of a dataset.
+    """
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(np.float64)
+        as_f32 = values.astype(np.float32)
+        if np.array_equal(widen(as_f32), values, equal_nan=True):
+            return 'float', as_f32
+        return 'float', values
+    if pd.api.types.is_integer_dtype(series):
+        return 'int', series.to_numpy(np.int32)
+    if _is_month_dates(series.astype(str)):
+        return 'month', dates_to_months(series)
+    # Missing strings are stored empty, and read back as NaN, as from the CSV file.
+    return 'str', series.fillna('').astype(str).to_numpy(dtype=str)
+
+
+def save(frame, out_dir, source_hash):
+    """
+    Write 'frame' as columnar files in directory 'out_dir', recording the
+    hash of the data it was computed from.
+    """
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, column in enumerate(frame.columns):
+        kind, values = _encode(frame[column])
+        file_name = f'c{i:03d}.npy'
+        np.save(os.path.join(tmp_dir, file_name), values)
+        columns.append({'name': column, 'kind': kind, 'file': file_name,
+                        'dtype': values.dtype.str})
+
+    meta = {'format': FORMAT_VERSION,
+            'source_hash': source_hash,
+            'rows': len(frame),
+            'columns': columns}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    # Swap the directories so that readers never see a half-written dataset.
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return meta
+
+
+def read_dir_meta(in_dir):
+    try:
+        with open(os.path.join(in_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != FORMAT_VERSION:
+        return None
+    return meta
+
+
+def read(in_dir, source_hash=None, columns=None, float64=False):
+    """
+    Return the columnar files of directory 'in_dir' as a DataFrame backed by
+    memory-mapped columns, or None if they are missing or were computed from
+    another version of the data than 'source_hash'.
+    If given, only the 'columns' listed are read. With 'float64', the float32
+    columns are read as the float64 values of the CSV file (in memory).
+    """
+    meta = read_dir_meta(in_dir)
+    if meta is None:
+        return None
+    if source_hash is not None and meta['source_hash'] != source_hash:
+        return None
+
+    selected = meta['columns']
+    if columns is not None:
+        by_name = {column['name']: column for column in meta['columns']}
+        selected = [by_name[c] for c in columns]
+
+    arrays = {}
+    for column in selected:
+        values = np.load(os.path.join(in_dir, column['file']), mmap_mode='r')
+        if column['kind'] == 'month':
+            values = months_to_dates(values)
+        elif column['kind'] == 'str' and (values == '').any():
+            values = np.where(values == '', np.nan, values.astype(object))
+        elif float64 and values.dtype == np.float32:
+            values = widen(values)
+        arrays[column['name']] = values
+    # copy=False keeps one block per memory-mapped column instead of
+    # consolidating them into a new in-memory array.
+    return pd.DataFrame(arrays, copy=False)
+
+
+def build(name):
+    """
+    Convert dataset 'name' from CSV to columnar files.
+    """
+    return save(pd.read_csv(data.path(name)), dataset_dir(name), data.version(name))
+
+
+def build_all():
+    return {name: build(name) for name in data.DATASETS}
+
+
+def read_meta(name):
+    return read_dir_meta(dataset_dir(name))
+
+
+def load(name, source_hash=None, columns=None, float64=False):
+    """
+    Return dataset 'name' as a DataFrame backed by memory-mapped columns, or
+    None if the columnar files are missing or were built from another version
+    of the CSV file than 'source_hash'.
+    If given, only the 'columns' listed are read. See read() for 'float64'.
+    """
+    return read(dataset_dir(name), source_hash, columns, float64)
+
+
+if __name__ == '__main__':
+    for name, meta in build_all().items():
+        print(f"{name}: {meta['rows']} rows, {len(meta['columns'])} columns")
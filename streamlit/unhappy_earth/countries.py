@@ -0,0 +1,172 @@
+"""
+
+Country codes of the datasets.
+
+The per-country datasets do not name the countries the same way: the
+temperatures use the slugs of the Berkeley Earth files (e.g.
+'united-states-of-america'), the CO2 emissions the ISO3 codes of Our World
+in Data (e.g. 'USA', and 'OWID_WRL' for the world), and the Natural Earth
+maps have no code for a few countries. The dataset country_codes maps the
+keys of each source to the ISO3 code and display name of the country:
+
+    source,key,iso3,name
+    temperatures,united-states-of-america,USA,United States
+    co2,OWID_WRL,,World
+
+It is built at ingestion time, with pycountry, from the columns of the
+per-country datasets (see build()), and versioned like the other datasets.
+Rebuild it alone from the repository root with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.countries
+
+At request time, the tabs only look the keys up in the dictionaries of
+mapping(), cached per version of the table.
+
+"""
+
+import threading
+
+import pandas as pd
+
+from unhappy_earth import data
+
+
+NAME = 'country_codes'
+TEMPERATURES = 'temperatures'
+CO2 = 'co2'
+NATURAL_EARTH = 'naturalearth'
+
+# Temperature slugs which pycountry does not find, or finds wrongly. None for
+# the regions which are not countries.
+TEMPERATURE_ALIASES = {
+    'burma': 'MMR',
+    'east-timor': 'TLS',
+    'macau': 'MAC',
+    'macedonia': 'MKD',
+    'palestina': 'PSE',
+    'reunion': 'REU',
+    'russia': 'RUS',
+    'swaziland': 'SWZ',
+    'turkey': 'TUR',
+    # Duplicate of 'bahamas'.
+    'the-bahamas': None,
+    'islas-baleares': None,
+    'islas-canarias': None,
+    'tasmania': None,
+    # The island, shared by Indonesia and East Timor.
+    'timor': None,
+}
+
+# Our World in Data codes which are not ISO3 codes: key -> (iso3, name).
+CO2_ALIASES = {
+    'OWID_KOS': ('XKX', 'Kosovo'),
+    'OWID_WRL': (None, 'World'),
+}
+
+# Natural Earth countries without code (-99): name -> iso3.
+NATURAL_EARTH_CODES = {
+    'France': 'FRA',
+    'Norway': 'NOR',
+    'Kosovo': 'XKX',
+}
+
+# (table version, source) -> {key: iso3}, and table version -> {iso3 or key: name}.
+_mappings = {}
+_names = {}
+_lock = threading.Lock()
+
+
+def _country(iso3):
+    import pycountry
+
+    return pycountry.countries.get(alpha_3=iso3)
+
+
+def _display_name(country):
+    return getattr(country, 'common_name', country.name)
+
+
+def _lookup(slug):
+    """
+    Return the pycountry country of a temperature slug, or None.
+    """
+    import pycountry
+
+    if slug in TEMPERATURE_ALIASES:
+        iso3 = TEMPERATURE_ALIASES[slug]
+        return None if iso3 is None else _country(iso3)
+    try:
+        return pycountry.countries.lookup(slug.replace('-', ' '))
+    except LookupError:
+        return None
+
+
+def build(temperature_keys=None, co2_keys=None):
+    """
+    Return the country_codes table of the given keys (by default the columns
+    of the per-country datasets). Keys without a country are left out.
+    """
+    if temperature_keys is None:
+        temperature_keys = pd.read_csv(data.path('temperatures_countries'), nrows=0).columns[2:]
+    if co2_keys is None:
+        co2_keys = pd.read_csv(data.path('co2_countries'), nrows=0).columns[1:]
+
+    rows = []
+    for slug in temperature_keys:
+        country = _lookup(slug)
+        if country is not None:
+            rows.append((TEMPERATURES, slug, country.alpha_3, _display_name(country)))
+    for code in co2_keys:
+        if code in CO2_ALIASES:
+            rows.append((CO2, code) + CO2_ALIASES[code])
+        elif _country(code) is not None:
+            rows.append((CO2, code, code, _display_name(_country(code))))
+    for name, iso3 in NATURAL_EARTH_CODES.items():
+        rows.append((NATURAL_EARTH, name, iso3, name))
+    return pd.DataFrame(rows, columns=['source', 'key', 'iso3', 'name'])
+
+
+def _load():
+    """
+    Build the dictionaries of the current version of the table, once, and
+    return the version.
+    """
+    version = data.version(NAME)
+    with _lock:
+        if version not in _names:
+            table = data.load(NAME)
+            _mappings.clear()
+            _names.clear()
+            for source, group in table.groupby('source'):
+                _mappings[version, source] = {key: None if pd.isna(iso3) else iso3
+                                              for key, iso3 in zip(group['key'], group['iso3'])}
+            codes = table.dropna(subset=['iso3'])
+            _names[version] = dict(zip(codes['iso3'], codes['name']))
+            _names[version].update(zip(table['key'], table['name']))
+    return version
+
+
+def mapping(source):
+    """
+    Return the dictionary key -> ISO3 code (None for the aggregates) of
+    'source': TEMPERATURES, CO2 or NATURAL_EARTH.
+    """
+    version = _load()
+    with _lock:
+        return _mappings.get((version, source), {})
+
+
+def name(key):
+    """
+    Return the display name of an ISO3 code or of a key of any source, or the
+    key itself if unknown.
+    """
+    version = _load()
+    with _lock:
+        return _names.get(version, {}).get(key, key)
+
+
+if __name__ == '__main__':
+    table = build()
+    table.to_csv(data.path(NAME), index=False)
+    print(f"{NAME}: {len(table)} keys, {table['iso3'].nunique()} countries")
@@ -0,0 +1,185 @@
+"""
+
+Data access layer shared by all tabs.
+
+Each dataset of data/unhappy_earth/ is parsed once per process and kept in
+memory. The cache is keyed on the file path, its modification time and size,
+and on a hash of its content: touching a file without changing it keeps the
+cached frame, replacing it triggers a new parse on the next access.
+
+Datasets are read from their memory-mapped columnar copy (see columnar.py)
+when it exists and was built from the current CSV file, from the CSV file
+otherwise. Each dataset is parsed under a lock of its own, so that the first
+loads of different datasets do not wait for each other.
+
+The arrays of the cached frames are read-only: the sessions share them, and
+modifying one in place raises instead of changing it for every session.
+
+"""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import columnar
+
+
+DATA_DIR = 'data/unhappy_earth'
+
+DATASETS = {
+    'temperatures_globales': 'temperatures_globales.csv',
+    'temperatures_hemispheres': 'temperatures_hemispheres.csv',
+    'temperatures_countries': 'temperatures_countries.csv',
+    'co2_global': 'co2_global.csv',
+    'co2_countries': 'co2_countries.csv',
+    'country_codes': 'country_codes.csv',
+}
+
+# name -> {'path', 'hash', 'frame'}
+_cache = {}
+# name -> lock of the parse of that dataset.
+_parsing = {}
+# path -> ((mtime, size), hash)
+_hashes = {}
+_stats = {'hits': 0, 'misses': 0}
+_lock = threading.Lock()
+
+
+def path(name):
+    """
+    Return the path of the CSV file for dataset 'name'.
+    """
+    return os.path.join(DATA_DIR, DATASETS[name])
+
+
+def _stat(file_path):
+    st = os.stat(file_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _hash(file_path):
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_only(frame):
+    """
+    Make the arrays of 'frame' read-only, and return it.
+    """
+    for block in frame._mgr.blocks:
+        if isinstance(block.values, np.ndarray):
+            block.values.flags.writeable = False
+    return frame
+
+
+def _read(name, file_path, digest):
+    frame = columnar.load(name, source_hash=digest, float64=True)
+    if frame is None:
+        frame = pd.read_csv(file_path)
+    return _read_only(frame)
+
+
+def _file_hash(file_path):
+    """
+    Return the content hash of a file, only re-hashing it when its mtime or
+    size changed. Must be called with the lock held.
+    """
+    stat = _stat(file_path)
+    cached = _hashes.get(file_path)
+    if cached is None or cached[0] != stat:
+        cached = (stat, _hash(file_path))
+        _hashes[file_path] = cached
+    return cached[1]
+
+
+def _cached(name, file_path, digest):
+    """
+    Return the cache entry of dataset 'name' if it is up to date, else None.
+    Must be called with the lock held.
+    """
+    entry = _cache.get(name)
+    if entry is not None and entry['path'] == file_path and entry['hash'] == digest:
+        _stats['hits'] += 1
+        return entry
+    return None
+
+
+def load(name):
+    """
+    Return dataset 'name' as a DataFrame.
+    The frame is a shallow copy of the cached one, whose arrays are read-only:
+    callers may add or replace columns, but not modify values in place.
+    """
+    file_path = path(name)
+    with _lock:
+        # Touching a file without changing its content keeps the cached frame.
+        digest = _file_hash(file_path)
+        entry = _cached(name, file_path, digest)
+        if entry is not None:
+            return entry['frame'].copy(deep=False)
+        parse_lock = _parsing.setdefault(name, threading.Lock())
+    # Parsed outside of the lock of the cache, once when several sessions
+    # request the same dataset.
+    with parse_lock:
+        with _lock:
+            entry = _cached(name, file_path, digest)
+        if entry is None:
+            entry = {'path': file_path, 'hash': digest, 'frame': _read(name, file_path, digest)}
+        with _lock:
+            if _cache.get(name) is not entry:
+                _stats['misses'] += 1
+                _cache[name] = entry
+            _parsing.pop(name, None)
+    return entry['frame'].copy(deep=False)
+
+
+def version(name):
+    """
+    Return the content hash of dataset 'name', without parsing it.
+    """
+    with _lock:
+        return _file_hash(path(name))
+
+
+def data_version(*names):
+    """
+    Return a hash identifying the content of the given datasets (all by default).
+    """
+    h = hashlib.sha1()
+    for name in names or sorted(DATASETS):
+        h.update(version(name).encode())
+    return h.hexdigest()
+
+
+def read_temps():
+    return (load('temperatures_globales'),
+            load('temperatures_hemispheres'),
+            load('temperatures_countries'))
+
+
+def read_co2():
+    return load('co2_global'), load('co2_countries')
+
+
+def stats():
+    """
+    Return the cache counters: hits, misses and number of cached datasets.
+    """
+    with _lock:
+        return dict(_stats, datasets=len(_cache))
+
+
+def clear():
+    """
+    Drop all cached datasets and reset the counters.
+    """
+    with _lock:
+        _cache.clear()
+        _hashes.clear()
+        _stats['hits'] = _stats['misses'] = 0
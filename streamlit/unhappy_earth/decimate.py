@@ -0,0 +1,124 @@
+"""
+
+Downsampling of the time series before plotting them.
+
+The monthly series have more points than the charts have pixels: e.g. the
+3,000+ months of a country on the 775 pixels wide axes of a 10 inches figure
+(matplotlib's 100 dpi, about the width of the images in the page). Drawing
+and encoding the extra points only costs time and image size. The plotting
+functions of the tabs select the rows to draw here, for a number of points
+derived from the pixel width of their axes:
+* minmax() keeps the first and last rows and, in each bucket of rows, the
+  rows of the minimum and of the maximum: a line chart of the selected rows
+  shows the same peaks. With several columns, the rows of all the columns
+  are kept, so that they share their x values. Buckets without values keep
+  one missing value, so that the gaps of the lines remain.
+* lttb() (Largest-Triangle-Three-Buckets, Steinarsson 2013) keeps one row
+  per bucket, the one forming the largest triangle with the rows kept in the
+  previous and next buckets, which follows the shape of the series with one
+  point per pixel: for the scatter plots, whose markers would overlap anyway.
+
+line() and scatter() return the rows to keep for an axes. The rows are
+positions (for .iloc or numpy indexing), in increasing order.
+
+"""
+
+import numpy as np
+
+
+# Points per pixel of width of the axes: for the lines, a minimum and a
+# maximum every 2 pixels.
+LINE_POINTS_PER_PIXEL = 1
+SCATTER_POINTS_PER_PIXEL = 1
+
+
+def width(ax):
+    """
+    Return the width of 'ax' in pixels, at the dpi of its figure.
+    """
+    return max(int(ax.get_window_extent().width), 1)
+
+
+def _values(y):
+    values = np.asarray(y, dtype=np.float64)
+    return values.reshape(len(values), -1)
+
+
+def _bucket_extrema(values, buckets, n_buckets):
+    """
+    Return the rows of the minimum and of the maximum of each bucket of one
+    column, NaN rows last (so that they are only chosen in empty buckets).
+    """
+    missing = np.isnan(values)
+    low = np.where(missing, np.inf, values)
+    high = np.where(missing, -np.inf, values)
+    # Sorted by bucket, then by value: the first row of a bucket is its minimum.
+    by_low = np.lexsort((missing, low, buckets))
+    by_high = np.lexsort((missing, -high, buckets))
+    starts = np.searchsorted(buckets[by_low], np.arange(n_buckets))
+    return by_low[starts], by_high[starts]
+
+
+def minmax(y, n_buckets):
+    """
+    Return the rows of the minimum and maximum of each of the 'n_buckets'
+    buckets of rows of 'y' (a series, or the columns of a 2-D array or
+    DataFrame), with the first and last rows. All the rows if there are fewer
+    than 2 * n_buckets.
+    """
+    values = _values(y)
+    n = len(values)
+    if n <= 2 * n_buckets or n_buckets < 1:
+        return np.arange(n)
+    buckets = np.arange(n) * n_buckets // n
+    rows = [np.array([0, n - 1])]
+    for column in values.T:
+        rows.extend(_bucket_extrema(column, buckets, n_buckets))
+    return np.unique(np.concatenate(rows))
+
+
+def lttb(y, n_out, x=None):
+    """
+    Return 'n_out' rows of the series 'y' chosen by Largest-Triangle-Three-
+    Buckets, with the first and last ones. 'x' defaults to the positions of
+    the rows (regular series). The rows with missing values are left out.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.arange(len(y), dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y) & ~np.isnan(x))
+    n = len(valid)
+    if n <= n_out or n_out < 3:
+        return valid
+    x, y = x[valid], y[valid]
+    # Buckets of the rows between the first and the last one.
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    edges[-1] = n - 1
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket, or the last row.
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return valid[selected]
+
+
+def line(ax, y):
+    """
+    Return the rows of 'y' (series, 2-D array or DataFrame) to draw as lines
+    on 'ax' (minmax()).
+    """
+    return minmax(y, width(ax) * LINE_POINTS_PER_PIXEL // 2)
+
+
+def scatter(ax, y, x=None):
+    """
+    Return the rows of the series 'y' to draw as points on 'ax' (lttb()).
+    """
+    return lttb(y, width(ax) * SCATTER_POINTS_PER_PIXEL, x=x)
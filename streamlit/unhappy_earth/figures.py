@@ -0,0 +1,323 @@
+"""
+
+Cache of the rendered matplotlib figures of the tabs.
+
+Most charts of the tabs are deterministic: the same data and the same widget
+values give the same image, yet st.pyplot() draws and rasterizes them again
+on every rerun of the script. image() returns the PNG (or SVG) of the figure
+drawn by a plotting function, cached on:
+
+    (plotting function, data version, language, widget parameters)
+
+so that the drawing only runs on a miss; the tabs display the bytes with
+st.image(). The parameters are normalized (lists to tuples, numpy scalars to
+Python values, keyword order ignored) so that equal widget values give the
+same key. The cache is shared by all the sessions of the process and bounded
+by MAX_BYTES, evicting the least recently used images.
+
+The sessions run in threads, while pyplot is a global state machine (current
+figure and axes) which keeps every figure until it is closed. The charts are
+therefore drawn on figures of their own, created by subplots() outside of
+pyplot with a non-GUI (Agg) canvas, through their Figure and Axes methods
+only: concurrent sessions cannot draw on each other's figures, and the
+figures are freed with their last reference. draw() (and image() on a miss)
+draws and renders them in a pool of MAX_WORKERS worker processes (a
+jobs.ProcessPool of its own, so that they do not wait behind the model fits):
+matplotlib holds the GIL while it draws, so that concurrent sessions only
+render in parallel in processes. The sessions requesting the same image while
+it is rendered share its rendering. The plotting function and its arguments
+are sent to the worker: the function must be importable (defined at the top
+level of a module), others are drawn in the thread of the session, and large
+inputs (e.g. a fitted model) are better loaded by the function from a key.
+
+Third-party charts drawn with pyplot (Prophet's components, GeoDataFrame.plot,
+which calls plt.draw()) are drawn with pyplot=True, in a drawing() context:
+one thread of a process at a time draws with pyplot, every figure opened in
+the context is closed when it exits (once rendered), and at most
+MAX_LIVE_FIGURES pyplot figures stay open in the process, the oldest ones
+being closed first. stats() reports the cache, the pool, the live figures and
+the memory of the process (shown in the sidebar of the apps with ?stats in
+the URL).
+
+"""
+
+import concurrent.futures
+import contextlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from unhappy_earth import jobs
+
+
+# Budget of the cached images: about a hundred maps, or several hundred charts.
+MAX_BYTES = 64 * 2**20
+# Image options of st.pyplot().
+DPI = 200
+FORMATS = ('png', 'svg')
+# pyplot figures left open in the process (by charts not drawn in drawing()).
+MAX_LIVE_FIGURES = 8
+# Worker processes rendering the figures, shared by all the sessions.
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class FigureCache:
+    """
+    Thread-safe LRU cache of images (bytes or str) bounded by a total size.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._images[key] = image
+            self._bytes += len(image)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'images': len(self._images), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+_cache = FigureCache()
+
+# pyplot is not thread-safe: one drawing() at a time, reentrant for nested ones.
+_pyplot_lock = threading.RLock()
+# Figures closed once rendered or at the exit of drawing(), and beyond MAX_LIVE_FIGURES.
+_lifecycle = {'closed_figures': 0, 'evicted_figures': 0}
+
+_pool = jobs.ProcessPool(MAX_WORKERS)
+# cache key -> Future of the image being rendered, until it is cached.
+_rendering = {}
+_rendering_lock = threading.Lock()
+
+
+def normalize(value):
+    """
+    Return a hashable, canonical form of a widget value.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(normalize(item) for item in value))
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(normalize(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def key(func, version, language, params):
+    return (func.__module__, func.__qualname__, version, language, normalize(params))
+
+
+def subplots(nrows=1, ncols=1, figsize=None, facecolor=None, **kwargs):
+    """
+    Return (figure, axes) as plt.subplots(), the figure being created outside
+    of pyplot, with an Agg canvas.
+    """
+    figure = Figure(figsize=figsize, facecolor=facecolor)
+    FigureCanvasAgg(figure)
+    return figure, figure.subplots(nrows, ncols, **kwargs)
+
+
+def _close(figure):
+    plt.close(figure)
+    _lifecycle['closed_figures'] += 1
+
+
+def _evict():
+    """
+    Close the oldest pyplot figures beyond MAX_LIVE_FIGURES.
+    """
+    numbers = plt.get_fignums()
+    for number in numbers[:max(len(numbers) - MAX_LIVE_FIGURES, 0)]:
+        plt.close(number)
+        _lifecycle['evicted_figures'] += 1
+
+
+@contextlib.contextmanager
+def drawing():
+    """
+    Context in which pyplot figures are created, drawn and rendered, by one
+    thread at a time: the figures opened in it are closed when it exits.
+    """
+    with _pyplot_lock:
+        before = set(plt.get_fignums())
+        try:
+            yield
+        finally:
+            for number in plt.get_fignums():
+                if number not in before:
+                    _close(number)
+            _evict()
+
+
+def render(figure, format='png'):
+    """
+    Return the image of a matplotlib figure as st.pyplot() saves it, and close
+    the figure if pyplot created it: bytes for PNG, str for SVG.
+    """
+    buffer = io.BytesIO()
+    if getattr(figure, 'number', None) is None:
+        # Not a pyplot figure: no shared state.
+        figure.savefig(buffer, format=format, dpi=DPI, bbox_inches='tight')
+    else:
+        with _pyplot_lock:
+            try:
+                figure.savefig(buffer, format=format, dpi=DPI, bbox_inches='tight')
+            finally:
+                if plt.fignum_exists(figure.number):
+                    _close(figure)
+    image = buffer.getvalue()
+    return image.decode('utf-8') if format == 'svg' else image
+
+
+def _draw(func, args, kwargs, format, pyplot):
+    """
+    Return the image of the figure returned by func(*args, **kwargs), in a
+    worker process of submit().
+    """
+    if pyplot:
+        with drawing():
+            return render(func(*args, **kwargs), format)
+    figure = func(*args, **kwargs)
+    # Charts rendering their own image, e.g. the choropleth maps.
+    return figure if isinstance(figure, (bytes, str)) else render(figure, format)
+
+
+def importable(func):
+    """
+    Return True if the worker processes can import 'func'.
+    """
+    return func.__module__ != '__main__' and '<' not in func.__qualname__
+
+
+def submit(draw_key, func, *args, format='png', pyplot=False, **kwargs):
+    """
+    Draw the figure returned by func(*args, **kwargs) and render it in a
+    worker process, and return the Future of its image, or the Future of the
+    image of the same 'draw_key' if it is being rendered. 'pyplot' if func
+    draws with pyplot (in drawing()) rather than on a figure of subplots();
+    func may also return the image itself, in 'format'.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown image format {format!r}, expected one of {FORMATS}")
+    if not importable(func):
+        future = concurrent.futures.Future()
+        future.set_result(_draw(func, args, kwargs, format, pyplot))
+        return future
+    # Without a key, a job of its own.
+    job_key = ('figure', object() if draw_key is None else draw_key)
+    return _pool.submit(job_key, _draw, func, args, kwargs, format, pyplot)
+
+
+def draw(func, *args, format='png', pyplot=False, **kwargs):
+    """
+    Return the image of the figure returned by func(*args, **kwargs),
+    rendered in a worker process (not cached).
+    """
+    return submit(None, func, *args, format=format, pyplot=pyplot, **kwargs).result()
+
+
+def image(func, version, language, data=(), format='png', pyplot=False, **params):
+    """
+    Return the image of the figure returned by func(*data, **params),
+    rendered in a worker process only if no image of (func, version,
+    language, params) is cached. 'version' identifies the content of 'data'
+    (e.g. data.data_version()), which is not part of the key.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown image format {format!r}, expected one of {FORMATS}")
+    cache_key = key(func, version, language, dict(params, format=format))
+    with _rendering_lock:
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            return cached
+        # Shared until the image is cached, not only while its job runs.
+        future = _rendering.get(cache_key)
+        owner = future is None
+        if owner:
+            future = _rendering[cache_key] = concurrent.futures.Future()
+    if not owner:
+        return future.result()
+    try:
+        cached = submit(cache_key, func, *data, format=format, pyplot=pyplot, **params).result()
+        _cache.put(cache_key, cached)
+        future.set_result(cached)
+    except Exception as error:
+        future.set_exception(error)
+        raise
+    finally:
+        with _rendering_lock:
+            del _rendering[cache_key]
+    return cached
+
+
+def _memory():
+    """
+    Return the resident memory of the process and its peak, in bytes.
+    """
+    import resource
+
+    # KiB on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        rss = None
+    return {'rss_bytes': rss, 'max_rss_bytes': peak}
+
+
+def stats():
+    """
+    Return the instrumentation of the figures: the image cache, the
+    rendering pool, the live pyplot figures, the figures closed and evicted,
+    and the memory of the process.
+    """
+    with _pyplot_lock:
+        figures = {'live_figures': len(plt.get_fignums()), 'max_live_figures': MAX_LIVE_FIGURES,
+                   **_lifecycle}
+    cache = {f'cache_{name}': value for name, value in _cache.stats().items()}
+    pool = {f'pool_{name}': value for name, value in _pool.stats().items()}
+    return {**cache, **pool, **figures, **_memory()}
+
+
+def clear():
+    _cache.clear()
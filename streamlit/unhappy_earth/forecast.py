@@ -0,0 +1,489 @@
+"""
+
+Cache of the Prophet models and forecasts displayed by the Forecast tab.
+
+Fitting Prophet and sampling the uncertainty intervals of its forecast take
+several seconds. Each (dataset version, series, training window start,
+months held out, seasonality mode, horizon, frequency) is fitted once: the
+serialized model
+and the forecast frame are stored in data/unhappy_earth/forecasts/<key>/
+and reused by the later views and after restarts.
+
+The key includes the content hash of the dataset, so that a forecast is never
+served for another version of the data. When the data change, the model is
+refitted from the parameters of its previous version (warm start), unless
+refit_policy() requires a full fit. refresh() refits the stored forecasts of
+a dataset, and removes those of an older cache format; the ingestion calls
+it for the datasets it changes. invalidate() removes them.
+
+submit() fits a forecast in the background worker processes of
+unhappy_earth.jobs, so that the sessions keep rendering meanwhile, and
+concurrent requests for the same forecast share a single fit. submit_all()
+fans out the forecasts of many series, e.g. of all the countries.
+
+Precompute the per-country forecasts shown by the tab, or remove the stored
+forecasts of one dataset or all of them, with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.forecast countries
+    PYTHONPATH=streamlit python -m unhappy_earth.forecast invalidate [dataset]
+
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import columnar, data, harmonic, jobs, lazy
+
+
+# Bump when the training frame or the stored files change.
+FORMAT_VERSION = 2
+
+COUNTRIES = 'temperatures_countries'
+COUNTRIES_START = '1975-01-15'
+
+# Months held out at the end of a series to measure the accuracy of a forecast.
+HOLDOUT_MONTHS = 120
+
+# Refit policy: a model is warm-started from the parameters of its previous
+# version when at most MAX_WARM_MONTHS months were appended to its training
+# data, and refitted from scratch after MAX_WARM_STARTS warm starts in a row.
+MAX_WARM_MONTHS = 12
+MAX_WARM_STARTS = 12
+
+# Number of (model, forecast) kept in memory, most recently used first.
+CACHE_SIZE = 16
+
+# key -> (model, forecast)
+_cache = collections.OrderedDict()
+# key -> lock of the disk read of that forecast.
+_reading = {}
+_lock = threading.Lock()
+_stats = {'memory': 0, 'disk': 0, 'full': 0, 'warm': 0}
+
+
+def forecast_root():
+    return os.path.join(data.DATA_DIR, 'forecasts')
+
+
+def training_frame(name, start, column='abs', end=None):
+    """
+    Return the (ds, y) frame of the absolute temperatures ('column') of
+    dataset 'name' from date 'start' on (all of them if None), and before date
+    'end' if given, as fitted by Prophet.
+    Only that column is read, e.g. a single country of the per-country dataset.
+    """
+    df = lazy.dataset(name).select([column])
+    rows = df['date'].notna()
+    if start is not None:
+        rows &= df['date'] >= start
+    if end is not None:
+        rows &= df['date'] < end
+    train = df.loc[rows, ['date', column]].dropna()
+    train.columns = ['ds', 'y']
+    return train.reset_index(drop=True)
+
+
+def params(name, start, seasonality_mode='additive', periods=600, freq='M', column='abs',
+           holdout=0):
+    return {'name': name, 'column': column, 'start': start, 'holdout': holdout,
+            'seasonality_mode': seasonality_mode, 'periods': periods, 'freq': freq}
+
+
+def key(params):
+    """
+    Return the cache key of a forecast: a hash of its parameters, of the
+    version of its dataset and of the cache format.
+    """
+    identity = dict(params, data_version=data.version(params['name']), format=FORMAT_VERSION)
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+def _entries():
+    """
+    Yield (directory, meta) of the stored forecasts.
+    """
+    root = forecast_root()
+    if not os.path.isdir(root):
+        return
+    for entry in os.listdir(root):
+        entry_dir = os.path.join(root, entry)
+        try:
+            with open(os.path.join(entry_dir, 'meta.json')) as f:
+                yield entry_dir, json.load(f)
+        except (OSError, ValueError):
+            yield entry_dir, None
+
+
+def _same_params(meta, params):
+    return (meta is not None and meta.get('format') == FORMAT_VERSION
+            and all(meta.get(k) == v for k, v in params.items()))
+
+
+def previous(params):
+    """
+    Return (model, meta) of the latest forecast of 'params' stored for
+    another version of the data, or None.
+    """
+    from prophet.serialize import model_from_json
+
+    current = data.version(params['name'])
+    candidates = [(meta.get('fitted_at', 0), entry_dir, meta) for entry_dir, meta in _entries()
+                  if _same_params(meta, params) and meta.get('data_version') != current]
+    for _, entry_dir, meta in sorted(candidates, key=lambda c: c[0], reverse=True):
+        try:
+            with open(os.path.join(entry_dir, 'model.json')) as f:
+                return model_from_json(f.read()), meta
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def refit_policy(previous_fit, train):
+    """
+    Return 'warm' if the model can be refitted from the parameters of the
+    'previous_fit' (model, meta) on the training frame 'train', 'full' if it
+    must be fitted from scratch: no previous model, more than MAX_WARM_MONTHS
+    new months, revised past values, or MAX_WARM_STARTS warm starts in a row.
+    """
+    if previous_fit is None:
+        return 'full'
+    model, meta = previous_fit
+    history = model.history
+    n_new = len(train) - len(history)
+    if meta.get('warm_starts', 0) >= MAX_WARM_STARTS or not 0 <= n_new <= MAX_WARM_MONTHS:
+        return 'full'
+    same_dates = (pd.to_datetime(train['ds'].iloc[:len(history)]).to_numpy()
+                  == pd.to_datetime(history['ds']).to_numpy()).all()
+    if not same_dates or not np.allclose(train['y'].iloc[:len(history)], history['y'],
+                                         rtol=0, atol=1e-6):
+        return 'full'
+    return 'warm'
+
+
+def stan_init(model):
+    """
+    Return the fitted parameters of 'model', to initialize the optimization
+    of a new fit.
+    """
+    init = {name: model.params[name][0][0] for name in ['k', 'm', 'sigma_obs']}
+    init.update({name: model.params[name][0] for name in ['delta', 'beta']})
+    return init
+
+
+def fit(params):
+    """
+    Fit Prophet on the training window and return (model, forecast, info).
+    The fit is warm-started from the previous version of the forecast when
+    refit_policy() allows it; 'info' tells how it was fitted.
+    """
+    from prophet import Prophet
+
+    end = None
+    if params['holdout']:
+        # The cutoff moves with the data, the number of held out months does not.
+        end, _ = holdout_split(params['name'], params['start'], params['column'],
+                               params['holdout'])
+    train = training_frame(params['name'], params['start'], params['column'], end)
+    previous_fit = previous(params)
+    policy = refit_policy(previous_fit, train)
+
+    began = time.perf_counter()
+    model = Prophet(seasonality_mode=params['seasonality_mode'])
+    if policy == 'warm':
+        model.fit(train, init=stan_init(previous_fit[0]))
+        warm_starts = previous_fit[1].get('warm_starts', 0) + 1
+    else:
+        model.fit(train)
+        warm_starts = 0
+    future = model.make_future_dataframe(periods=params['periods'], freq=params['freq'])
+    fcst = model.predict(future)
+    info = {'fit': policy, 'warm_starts': warm_starts,
+            'fit_seconds': round(time.perf_counter() - began, 3)}
+    return model, fcst, info
+
+
+def _save(cache_key, params, model, fcst, info):
+    """
+    Store a forecast, and remove the forecasts of the same parameters stored
+    for other versions of the data, which it supersedes.
+    """
+    from prophet.serialize import model_to_json
+
+    out_dir = os.path.join(forecast_root(), cache_key)
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    with open(os.path.join(tmp_dir, 'model.json'), 'w') as f:
+        f.write(model_to_json(model))
+    fcst.to_pickle(os.path.join(tmp_dir, 'forecast.pkl'))
+    meta = dict(params, data_version=data.version(params['name']), format=FORMAT_VERSION,
+                fitted_at=time.time(), **info)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp_dir, out_dir)
+
+    for entry_dir, entry_meta in _entries():
+        if entry_dir != out_dir and _same_params(entry_meta, params):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def _read(cache_key):
+    from prophet.serialize import model_from_json
+
+    in_dir = os.path.join(forecast_root(), cache_key)
+    try:
+        with open(os.path.join(in_dir, 'model.json')) as f:
+            model = model_from_json(f.read())
+        fcst = pd.read_pickle(os.path.join(in_dir, 'forecast.pkl'))
+    except (OSError, ValueError):
+        return None
+    return model, fcst
+
+
+def _remember(cache_key, result):
+    """
+    Keep 'result' in the memory cache, dropping the least recently used
+    results. Must be called with the lock held.
+    """
+    _cache[cache_key] = result
+    _cache.move_to_end(cache_key)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def is_stored(params):
+    """
+    Return True if the forecast of 'params' is stored, without reading it.
+    """
+    return os.path.isfile(os.path.join(forecast_root(), key(params), 'meta.json'))
+
+
+def cached(params):
+    """
+    Return the stored (model, forecast) of 'params', or None if it was not
+    computed yet for the current version of the data.
+    """
+    cache_key = key(params)
+    with _lock:
+        if cache_key in _cache:
+            _stats['memory'] += 1
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+        read_lock = _reading.setdefault(cache_key, threading.Lock())
+    # Deserializing the model takes a while: outside of the lock of the cache,
+    # once per forecast when several sessions request it.
+    with read_lock:
+        with _lock:
+            if cache_key in _cache:
+                _stats['memory'] += 1
+                _cache.move_to_end(cache_key)
+                return _cache[cache_key]
+        result = _read(cache_key)
+        with _lock:
+            if result is not None:
+                _stats['disk'] += 1
+                _remember(cache_key, result)
+            _reading.pop(cache_key, None)
+    return result
+
+
+def forecast(name, start, seasonality_mode='additive', periods=600, freq='M', column='abs',
+             holdout=0):
+    """
+    Return (model, forecast) of Prophet fitted on the absolute temperatures
+    ('column') of dataset 'name' from date 'start' on (but the last 'holdout'
+    months), predicting 'periods' periods of frequency 'freq' ahead. Fitted
+    once per version of the data.
+    """
+    p = params(name, start, seasonality_mode, periods, freq, column, holdout)
+    result = cached(p)
+    if result is None:
+        cache_key = key(p)
+        model, fcst, info = fit(p)
+        _save(cache_key, p, model, fcst, info)
+        result = (model, fcst)
+        with _lock:
+            _stats[info['fit']] += 1
+            _remember(cache_key, result)
+    return result
+
+
+def _fit_job(params):
+    """
+    Worker process side of submit(): fit and store the forecast, return its key.
+    Nothing is kept in the memory of the worker, which fits many series.
+    """
+    cache_key = key(params)
+    if not is_stored(params):
+        _save(cache_key, params, *fit(params))
+    return cache_key
+
+
+def submit(params):
+    """
+    Fit the forecast of 'params' in a worker process, unless it is cached, and
+    return the Future of its key. Once done, cached(params) returns it.
+    Submissions of a forecast being fitted share its job.
+    """
+    cache_key = key(params)
+    if is_stored(params):
+        future = concurrent.futures.Future()
+        future.set_result(cache_key)
+        return future
+    return jobs.submit(('forecast', cache_key), _fit_job, params)
+
+
+def submit_all(params_list):
+    """
+    Fit the forecasts of 'params_list' in the worker processes, and return
+    their Futures. Each worker fits one series at a time.
+    """
+    return [submit(p) for p in params_list]
+
+
+def countries_params(start=COUNTRIES_START, **kwargs):
+    """
+    Return the parameters of the forecasts of all the countries.
+    """
+    return [params(COUNTRIES, start, column=country, **kwargs)
+            for country in lazy.dataset(COUNTRIES).columns]
+
+
+def stored_countries(start=COUNTRIES_START, **kwargs):
+    """
+    Return the countries whose forecast is stored for the current data.
+    """
+    return [p['column'] for p in countries_params(start, **kwargs) if is_stored(p)]
+
+
+def scores(actual, yhat, lower, upper):
+    """
+    Return the MAE, RMSE and coverage (share of the actual values inside the
+    prediction interval) of a forecast.
+    """
+    actual, yhat = np.asarray(actual, dtype=np.float64), np.asarray(yhat, dtype=np.float64)
+    error = yhat - actual
+    inside = (actual >= np.asarray(lower)) & (actual <= np.asarray(upper))
+    return {'mae': float(np.mean(np.abs(error))),
+            'rmse': float(np.sqrt(np.mean(error ** 2))),
+            'coverage': float(np.mean(inside))}
+
+
+def holdout_split(name, start, column='abs', months=HOLDOUT_MONTHS):
+    """
+    Return (cutoff date, held out (ds, y) frame): the last 'months' months of
+    the series are held out, the model is trained before the cutoff.
+    """
+    series = training_frame(name, start, column)
+    held_out = series.iloc[-months:].reset_index(drop=True)
+    return held_out['ds'].iloc[0], held_out
+
+
+def holdout_fast(name, start, column='abs', months=HOLDOUT_MONTHS):
+    """
+    Return the scores of the fast (harmonic) forecast on the held out months.
+    """
+    cutoff, held_out = holdout_split(name, start, column, months)
+    train = training_frame(name, start, column, end=cutoff)
+    model = harmonic.fit(columnar.dates_to_months(train['ds']), train['y'].to_numpy())
+    yhat, lower, upper = model.predict(columnar.dates_to_months(held_out['ds']))
+    return scores(held_out['y'], yhat[:, 0], lower[:, 0], upper[:, 0])
+
+
+def holdout_params(name, start, column='abs', months=HOLDOUT_MONTHS, **kwargs):
+    """
+    Return the parameters of the Prophet forecast trained before the cutoff.
+    """
+    # Prophet starts its monthly future at the end of the last training month.
+    return params(name, start, periods=months + 1, column=column, holdout=months, **kwargs)
+
+
+def holdout_prophet(params, fcst):
+    """
+    Return the scores on the held out months of the Prophet forecast 'fcst'
+    of holdout_params().
+    """
+    _, held_out = holdout_split(params['name'], params['start'], params['column'],
+                                params['holdout'])
+    ds = pd.to_datetime(fcst['ds'])
+    by_month = (fcst.assign(month=(ds.dt.year * 12 + ds.dt.month - 1).to_numpy())
+                .drop_duplicates('month').set_index('month'))
+    predicted = by_month.reindex(columnar.dates_to_months(held_out['ds']))
+    return scores(held_out['y'], predicted['yhat'], predicted['yhat_lower'],
+                  predicted['yhat_upper'])
+
+
+def invalidate(name=None):
+    """
+    Remove the stored forecasts of dataset 'name' (all of them by default)
+    from disk, and empty the in-memory cache. Return the number of forecasts
+    removed from disk.
+    """
+    removed = 0
+    with _lock:
+        _cache.clear()
+        for entry_dir, meta in list(_entries()):
+            if name is None or meta is None or meta.get('name') == name:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                removed += 1
+    return removed
+
+
+def refresh(name):
+    """
+    Refit the stored forecasts of dataset 'name' on its current version,
+    warm-started when refit_policy() allows it, in the worker processes, and
+    remove those of an older cache format, which are fitted again on demand.
+    Return the number of refitted forecasts (none if Prophet is missing).
+    """
+    try:
+        import prophet  # noqa: F401
+    except ImportError:
+        # Left stored, to be refitted where Prophet is installed.
+        return 0
+    current = data.version(name)
+    stale = []
+    for entry_dir, meta in list(_entries()):
+        if meta is None or meta.get('name') != name:
+            continue
+        if meta.get('format') != FORMAT_VERSION:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        elif meta.get('data_version') != current:
+            stale.append({k: meta[k] for k in params(name, None)})
+    for future in submit_all(stale):
+        future.result()
+    with _lock:
+        _cache.clear()
+    return len(stale)
+
+
+def stats():
+    with _lock:
+        return dict(_stats, cached=len(_cache))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['countries']:
+        # The jobs must reference the functions of the imported module, which
+        # the workers can import, not of __main__.
+        from unhappy_earth import forecast as module
+        futures = module.submit_all(module.countries_params())
+        for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            future.result()
+            print(f"\r{i}/{len(futures)} countries", end='', flush=True)
+        print()
+    elif sys.argv[1:2] == ['invalidate']:
+        print(f"{invalidate(*sys.argv[2:3])} stored forecasts removed")
+    else:
+        sys.exit(__doc__)
@@ -0,0 +1,111 @@
+"""
+
+World maps of the per-country temperatures, merged once per data version.
+
+The choropleth maps of the existence tab join the Natural Earth countries
+(with the ISO3 codes of unhappy_earth.countries) with the yearly temperatures
+of the countries: one column per year, so that a map only selects the column
+of its year. The merged GeoDataFrame is computed once per version of the
+temperatures and of the country codes, with geometries simplified to the
+resolution of the maps (SIMPLIFY_TOLERANCE degrees, which keeps each polygon
+valid), kept in memory, and pickled in data/unhappy_earth/geometry/ so that
+the other processes and the next runs of the app only unpickle it.
+
+geopandas is only needed to build the maps, and imported on first use.
+
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+from unhappy_earth import aggregates, countries, data
+
+
+# Bump when the merged maps change.
+FORMAT_VERSION = 1
+# In degrees: about a pixel of a 14 inches wide map of the world.
+SIMPLIFY_TOLERANCE = 0.1
+TEMPERATURES = 'temperatures_countries_yearly_10y'
+
+# name -> (version, GeoDataFrame)
+_cache = {}
+_lock = threading.Lock()
+
+
+def geometry_root():
+    return os.path.join(data.DATA_DIR, 'geometry')
+
+
+def _path(name):
+    return os.path.join(geometry_root(), name + '.pkl')
+
+
+def world():
+    """
+    Return the simplified Natural Earth countries: name, CODE (ISO3) and
+    geometry.
+    """
+    import geopandas as gpd
+
+    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+    world = world.rename(columns={'iso_a3': 'CODE'})[['name', 'CODE', 'geometry']]
+    # Natural Earth has no code for a few countries.
+    world['CODE'] = world['name'].map(countries.mapping(countries.NATURAL_EARTH)).fillna(world['CODE'])
+    world['geometry'] = world.geometry.simplify(SIMPLIFY_TOLERANCE, preserve_topology=True)
+    return world
+
+
+def merge_temperatures(world, temperatures):
+    """
+    Return 'world' merged with the yearly 'temperatures' of the countries
+    (year, then one column per country slug): one column per year.
+    """
+    by_country = temperatures.set_index('year').T
+    by_country.index = by_country.index.map(countries.mapping(countries.TEMPERATURES))
+    by_country = by_country.loc[by_country.index.notna()].rename_axis('CODE').reset_index()
+    return pd.merge(world, by_country, on='CODE', how='outer')
+
+
+def version(name=TEMPERATURES):
+    return hashlib.sha1(f'{FORMAT_VERSION}:{SIMPLIFY_TOLERANCE}:{aggregates.version(name)}:'
+                        f'{data.version(countries.NAME)}'.encode()).hexdigest()
+
+
+def _read(name, current):
+    try:
+        with open(_path(name), 'rb') as f:
+            stored_version, frame = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+    return frame if stored_version == current else None
+
+
+def _save(name, current, frame):
+    os.makedirs(geometry_root(), exist_ok=True)
+    tmp_path = _path(name) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((current, frame), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _path(name))
+
+
+def world_temperatures(name=TEMPERATURES):
+    """
+    Return the GeoDataFrame of the countries (name, CODE, geometry) with one
+    column per year of the temperatures aggregate 'name'. Like data.load(),
+    the frame must not be modified in place.
+    """
+    current = version(name)
+    with _lock:
+        cached = _cache.get(name)
+        if cached is None or cached[0] != current:
+            frame = _read(name, current)
+            if frame is None:
+                frame = merge_temperatures(world(), aggregates.load(name))
+                _save(name, current, frame)
+            cached = (current, frame)
+            _cache[name] = cached
+    return cached[1]
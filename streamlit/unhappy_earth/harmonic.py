@@ -0,0 +1,204 @@
+"""
+
+Fast forecasts: linear trend plus 12 months Fourier seasonality.
+
+Each series y is modeled on the month index m (year * 12 + month - 1) as:
+
+    y(m) = a + b * t + sum over k of (c_k * sin(2 pi k m / 12) + d_k * cos(2 pi k m / 12))
+
+with t the time in years since the first month of the training window. All
+the series of a table (one column per series, NaN where a series has no
+value) are fitted at once: the least-squares normal equations of every
+series are built with a single matrix product over the shared design matrix
+and solved as one batch, which takes a few milliseconds for the ~190 series of
+the datasets.
+
+The prediction intervals are the analytic ones of ordinary least squares,
+under the assumption of independent Gaussian residuals:
+
+    yhat +/- z * sigma * sqrt(1 + x' (X'X)^-1 x)
+
+forecast_all() forecasts the global, both hemispheres and all the country
+series in one call.
+
+"""
+
+import statistics
+import threading
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import columnar, data, lazy
+
+
+HARMONICS = 3
+# Same default width as Prophet.
+INTERVAL_WIDTH = 0.8
+
+
+def design(months, origin, harmonics=HARMONICS):
+    """
+    Return the design matrix (one row per month) of the model.
+    """
+    months = np.asarray(months, dtype=np.float64)
+    columns = [np.ones_like(months), (months - origin) / 12]
+    for k in range(1, harmonics + 1):
+        angle = 2 * np.pi * k * months / 12
+        columns += [np.sin(angle), np.cos(angle)]
+    return np.column_stack(columns)
+
+
+def _outer(x):
+    """
+    Return the outer products of the rows of 'x', flattened: (rows, columns ** 2).
+    """
+    return (x[:, :, None] * x[:, None, :]).reshape(len(x), -1)
+
+
+class HarmonicModel:
+    """
+    Fitted coefficients of a table of series, with what the prediction
+    intervals need.
+    """
+
+    def __init__(self, origin, harmonics, coef, xtx_inv, sigma, n_obs):
+        self.origin = origin
+        self.harmonics = harmonics
+        # (series, parameters), (series, parameters, parameters), (series,)
+        self.coef = coef
+        self.xtx_inv = xtx_inv
+        self.sigma = sigma
+        self.n_obs = n_obs
+
+    def predict(self, months, interval_width=INTERVAL_WIDTH):
+        """
+        Return the (yhat, lower, upper) arrays, of shape (months, series).
+        """
+        x = design(months, self.origin, self.harmonics)
+        # Computed as (series, months) products and returned transposed, so
+        # that each series is contiguous, as in a DataFrame.
+        yhat = (self.coef @ x.T).T
+        # x' (X'X)^-1 x for each month and series, as one matrix product.
+        leverage = (self.xtx_inv.reshape(len(self.xtx_inv), -1) @ _outer(x).T).T
+        z = statistics.NormalDist().inv_cdf(0.5 + interval_width / 2)
+        half_width = z * self.sigma * np.sqrt(1 + leverage)
+        return yhat, yhat - half_width, yhat + half_width
+
+    def components(self, months):
+        """
+        Return the (trend, seasonality) arrays, of shape (months, series).
+        """
+        x = design(months, self.origin, self.harmonics)
+        trend = (self.coef[:, :2] @ x[:, :2].T).T
+        return trend, (self.coef[:, 2:] @ x[:, 2:].T).T
+
+
+def fit(months, values, harmonics=HARMONICS):
+    """
+    Fit the model on the table 'values' (months, series), NaN where a series
+    has no value, and return a HarmonicModel.
+    Series with less values than parameters get NaN coefficients.
+    """
+    months = np.asarray(months)
+    values = np.asarray(values, dtype=np.float64).reshape(len(months), -1)
+    x = design(months, months[0], harmonics)
+    n_params = x.shape[1]
+
+    valid = ~np.isnan(values)
+    weights = valid.astype(np.float64)
+    filled = np.where(valid, values, 0)
+    # Normal equations of each series, restricted to its valid months, as
+    # matrix products over the months.
+    xtx = (weights.T @ _outer(x)).reshape(-1, n_params, n_params)
+    xty = filled.T @ x
+    n_obs = valid.sum(axis=0)
+
+    fitted = n_obs > n_params
+    # Identity for the series which cannot be fitted, to keep the batch solvable.
+    xtx[~fitted] = np.eye(n_params)
+    xtx_inv = np.linalg.inv(xtx)
+    coef = np.einsum('sij,sj->si', xtx_inv, xty)
+
+    residuals = np.where(valid, values - x @ coef.T, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma = np.sqrt((residuals ** 2).sum(axis=0) / (n_obs - n_params))
+    coef[~fitted] = np.nan
+    sigma[~fitted] = np.nan
+    return HarmonicModel(months[0], harmonics, coef, xtx_inv, sigma, n_obs)
+
+
+# Series forecast by forecast_all(), besides the countries: name -> (dataset, column).
+SERIES = {
+    'global': ('temperatures_globales', 'abs'),
+    'north': ('temperatures_hemispheres', 'north_abs'),
+    'south': ('temperatures_hemispheres', 'south_abs'),
+}
+COUNTRIES = 'temperatures_countries'
+
+# (data version, start, end) -> table of the last call of series_table().
+_table = {}
+_lock = threading.Lock()
+
+
+def _indexed_by_month(frame):
+    return frame.set_axis(pd.Index(columnar.dates_to_months(frame['date']), name='month'))
+
+
+def version():
+    """
+    Return the version of the datasets of the series forecast by forecast_all().
+    """
+    return data.data_version(*sorted({name for name, _ in SERIES.values()} | {COUNTRIES}))
+
+
+def series_table(start, end=None):
+    """
+    Return the table (one row per month index, one column per series) of the
+    global, hemisphere and country temperatures from date 'start' on, and
+    before date 'end' if given. Cached for the last arguments and data version.
+    """
+    table_key = (version(), start, end)
+    with _lock:
+        if table_key in _table:
+            return _table[table_key]
+
+    parts = []
+    for series, (name, column) in SERIES.items():
+        frame = _indexed_by_month(lazy.dataset(name).select([column]))
+        parts.append(frame[column].astype(np.float64).rename(series))
+    countries = lazy.dataset(COUNTRIES)
+    frame = _indexed_by_month(countries.select(countries.columns))
+    parts.append(frame[countries.columns].astype(np.float64))
+
+    table = pd.concat(parts, axis=1).sort_index()
+    first = columnar.dates_to_months([start])[0]
+    table = table.loc[table.index >= first]
+    if end is not None:
+        table = table.loc[table.index < columnar.dates_to_months([end])[0]]
+    with _lock:
+        _table.clear()
+        _table[table_key] = table
+    return table
+
+
+def forecast_all(start, periods=600, end=None, interval_width=INTERVAL_WIDTH):
+    """
+    Fit all the series of series_table(start, end) and forecast them over
+    their months and the 'periods' following months. Return a dict with:
+    * 'model': the HarmonicModel,
+    * 'history': the fitted table, 'yhat', 'yhat_lower', 'yhat_upper',
+      'trend', 'seasonality': DataFrames indexed by date (ds), one column per
+      series.
+    """
+    history = series_table(start, end)
+    model = fit(history.index.to_numpy(), history.to_numpy())
+    months = np.arange(history.index[0], history.index[-1] + periods + 1)
+    ds = pd.DatetimeIndex(pd.to_datetime(columnar.months_to_dates(months)), name='ds')
+
+    history_ds = pd.DatetimeIndex(pd.to_datetime(columnar.months_to_dates(history.index)), name='ds')
+    result = {'model': model, 'history': history.set_axis(history_ds)}
+    names = ['yhat', 'yhat_lower', 'yhat_upper', 'trend', 'seasonality']
+    for name, values in zip(names, model.predict(months, interval_width) + model.components(months)):
+        result[name] = pd.DataFrame(values, index=ds, columns=history.columns, copy=False)
+    return result
@@ -0,0 +1,434 @@
+"""
+
+Ingestion of the raw Berkeley Earth TAVG text files into the datasets of
+data/unhappy_earth/.
+
+The raw files start with a '%' commented header, which includes the
+Jan 1951 - Dec 1980 monthly absolute temperatures used as baseline, followed
+by a space-separated table whose first four columns are the year, the month,
+the monthly anomaly and its uncertainty. Absolute temperatures are rebuilt
+as anomaly + baseline of the month.
+
+Rebuild the temperature datasets from the repository root with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.ingest
+
+or only append the months and years published since the last run with:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.ingest --incremental
+
+The incremental mode reads the stored datasets and the raw files from their
+end, so that its cost depends on the number of new rows only. The columnar
+copy and the aggregates of the datasets that changed are then rebuilt whole
+rather than extended from their tail: the centered aggregates shift with the
+mean of the whole series, so every one of their rows changes anyway, and the
+refreshed datasets are small enough (a few thousand rows) for the rebuild to
+take some tens of milliseconds.
+
+"""
+
+import glob
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import aggregates, columnar, countries, data, forecast, sparse
+
+
+RAW_DIR = 'data/berkeley_earth'
+GLOBAL_FILE = os.path.join(RAW_DIR, 'Complete_TAVG_complete.txt')
+NORTH_FILE = os.path.join(RAW_DIR, 'Sets_by_hemisphere', 'northern-hemisphere-TAVG-Trend.txt')
+SOUTH_FILE = os.path.join(RAW_DIR, 'Sets_by_hemisphere', 'southern-hemisphere-TAVG-Trend.txt')
+# One <country>-TAVG-Trend.txt file per country, as downloaded from Berkeley Earth.
+COUNTRIES_DIR = os.path.join(RAW_DIR, 'Sets_by_country')
+COUNTRY_SUFFIX = '-TAVG-Trend.txt'
+# Our World in Data export of the global CO2 emissions.
+CO2_FILE = 'data/co2/global-co2-fossil-plus-land-use.csv'
+CO2_ENTITY = 'OWID_WRL'
+
+# Rows of context needed before new rows: 11 for the 12 months rolling average.
+CONTEXT_ROWS = 11
+
+
+def _floats(line):
+    return [float(v) for v in line.lstrip('%').replace('+/-', '').split()]
+
+
+def _month_index(line):
+    year, month = line.split(None, 2)[:2]
+    return int(year) * 12 + int(month) - 1
+
+
+def tail_lines(path, keep, block_size=1 << 16):
+    """
+    Read file 'path' backwards and return its last lines, in file order, as
+    long as keep(line) is True. Blank lines are skipped.
+    """
+    lines = []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        rest = b''
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size) + rest
+            parts = chunk.split(b'\n')
+            # The first part may be an incomplete line, unless we reached the start.
+            rest = parts.pop(0) if pos > 0 else b''
+            for part in reversed(parts):
+                line = part.decode()
+                if not line.strip():
+                    continue
+                if not keep(line):
+                    return lines[::-1]
+                lines.append(line)
+        if rest.strip() and keep(rest.decode()):
+            lines.append(rest.decode())
+    return lines[::-1]
+
+
+def parse_tavg(path, after=None):
+    """
+    Stream a Berkeley Earth TAVG file and return a dict with:
+    * 'baseline': the 12 Jan 1951 - Dec 1980 monthly absolute temperatures,
+    * 'year', 'month', 'ano', 'uncert': arrays of the monthly measures.
+    If 'after' is a month index (year * 12 + month - 1), only the rows after it
+    are read, starting from the end of the file.
+    """
+    baseline = None
+    in_baseline = False
+    rows = []
+
+    with open(path) as f:
+        for line in f:
+            if line.startswith('%'):
+                # The baseline table is the row following the month names,
+                # after the 'monthly absolute temperature' title.
+                if baseline is None:
+                    if 'monthly absolute temperature' in line:
+                        in_baseline = True
+                    elif in_baseline and 'Jan' not in line:
+                        baseline = np.array(_floats(line))
+            elif line.isspace():
+                continue
+            elif after is None:
+                rows.append(line)
+            else:
+                # End of the header: the new rows are at the end of the file.
+                break
+
+    if baseline is None or len(baseline) != 12:
+        raise ValueError(f"No monthly baseline table found in {path}")
+
+    if after is not None:
+        rows = tail_lines(path, lambda line: not line.startswith('%')
+                          and _month_index(line) > after)
+
+    # Only the first four columns are used, the moving averages are
+    # recomputed from them.
+    fields = [v for line in rows for v in line.split(None, 4)[:4]]
+    table = np.array(fields, dtype=np.float64).reshape(-1, 4)
+
+    return {'baseline': baseline,
+            'year': table[:, 0].astype(np.int64),
+            'month': table[:, 1].astype(np.int64),
+            'ano': table[:, 2],
+            'uncert': table[:, 3]}
+
+
+def to_frame(parsed):
+    """
+    Return a DataFrame (date, year, month, ano, uncert, abs) from a parsed file.
+    """
+    year, month = parsed['year'], parsed['month']
+    frame = pd.DataFrame({
+        'date': columnar.months_to_dates(year * 12 + month - 1),
+        'year': year,
+        'month': month,
+        'ano': parsed['ano'],
+        'uncert': parsed['uncert'],
+    })
+    # Files sometimes repeat their last month: keep the latest value.
+    frame = frame.drop_duplicates('date', keep='last').reset_index(drop=True)
+    frame['abs'] = frame['ano'] + parsed['baseline'][frame['month'] - 1]
+    return frame
+
+
+def _interpolate(frame, context=None):
+    """
+    Fill the few isolated NaNs of global and hemisphere series by linear
+    interpolation, then compute the 12 months rolling average.
+    If given, 'context' holds the stored rows preceding 'frame'; they are used
+    for the computations but not returned.
+    """
+    n_context = 0
+    if context is not None:
+        n_context = len(context)
+        frame = pd.concat([context[frame.columns], frame], ignore_index=True)
+    for c in ['ano', 'uncert', 'abs']:
+        frame[c] = frame[c].interpolate(limit_area='inside')
+    frame['mov_average'] = frame['abs'].rolling(12).mean()
+    return frame.iloc[n_context:].reset_index(drop=True)
+
+
+def build_globales(path=GLOBAL_FILE):
+    return _interpolate(to_frame(parse_tavg(path)))
+
+
+def build_hemispheres(north=NORTH_FILE, south=SOUTH_FILE):
+    frames = []
+    for prefix, path in [('north', north), ('south', south)]:
+        frame = _interpolate(to_frame(parse_tavg(path)))
+        frame = frame.rename(columns={'ano': f'{prefix}_ano',
+                                      'abs': f'{prefix}_abs',
+                                      'uncert': f'{prefix}_uncert',
+                                      'mov_average': f'mov_avrg_{prefix}'})
+        frames.append(frame[['date', 'year', 'month', f'{prefix}_ano', f'{prefix}_abs',
+                             f'{prefix}_uncert', f'mov_avrg_{prefix}']])
+    return pd.merge(frames[0], frames[1], on=['date', 'year', 'month'], how='outer')
+
+
+def country_files(countries_dir=COUNTRIES_DIR):
+    """
+    Return {country slug: path} for the per-country files.
+    """
+    paths = sorted(glob.glob(os.path.join(countries_dir, '*' + COUNTRY_SUFFIX)))
+    return {os.path.basename(p)[:-len(COUNTRY_SUFFIX)]: p for p in paths}
+
+
+def build_countries(countries_dir=COUNTRIES_DIR):
+    """
+    Return the wide per-country table of absolute temperatures (date, year,
+    then one column per country). Missing values are kept as NaN, and months
+    without any measure are dropped.
+    """
+    series = {}
+    for country, path in country_files(countries_dir).items():
+        frame = to_frame(parse_tavg(path))
+        series[country] = pd.Series(frame['abs'].to_numpy(), index=frame['date'].to_numpy())
+
+    wide = pd.DataFrame(series).sort_index().dropna(how='all')
+    wide.index.name = 'date'
+    wide = wide.reset_index()
+    wide.insert(1, 'year', wide['date'].str[:4].astype(np.int64))
+    return wide
+
+
+def write(name, frame):
+    frame.to_csv(data.path(name), index=False)
+
+
+def build_all():
+    """
+    Rebuild the temperature datasets from the raw files, their columnar copy,
+    the sparse per-country store, and the built aggregates derived from them.
+    The stored forecasts of the rebuilt datasets are refitted, and the country
+    codes table rebuilt. The per-country dataset is only rebuilt when the
+    per-country files are present.
+    """
+    built = {'temperatures_globales': build_globales(),
+             'temperatures_hemispheres': build_hemispheres()}
+    if country_files():
+        built['temperatures_countries'] = build_countries()
+
+    for name, frame in built.items():
+        write(name, frame)
+        columnar.build(name)
+    # Ahead of the sessions, which do not build it.
+    if not sparse.is_current():
+        sparse.build()
+    refitted = list(built)
+
+    # From the columns of the per-country datasets, before the aggregates
+    # which read it.
+    built[countries.NAME] = countries.build()
+    write(countries.NAME, built[countries.NAME])
+    columnar.build(countries.NAME)
+
+    if aggregates.is_built():
+        aggregates.build_all(sources=built)
+    for name in refitted:
+        forecast.refresh(name)
+    return built
+
+
+def read_stored_tail(name, n_rows):
+    """
+    Return the last 'n_rows' rows of dataset 'name', without reading the whole file.
+    """
+    file_path = data.path(name)
+    with open(file_path) as f:
+        header = f.readline()
+    count = [0]
+
+    def keep(line):
+        count[0] += 1
+        return count[0] <= n_rows and line != header.rstrip('\n')
+
+    lines = tail_lines(file_path, keep)
+    return pd.read_csv(io.StringIO(header + '\n'.join(lines) + '\n'))
+
+
+def append(name, frame):
+    """
+    Append the rows of 'frame' to dataset 'name'.
+    """
+    if len(frame):
+        frame.to_csv(data.path(name), mode='a', header=False, index=False)
+    return len(frame)
+
+
+def tail_offset(path, n_lines, block_size=1 << 16):
+    """
+    Return the offset in file 'path' of the start of its last 'n_lines'
+    lines, reading it backwards.
+    """
+    if n_lines <= 0:
+        return os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        # The newline ending the last line does not start another line.
+        f.seek(max(pos - 1, 0))
+        end = pos - 1 if f.read(1) == b'\n' else pos
+        count = 0
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size)[:max(end - pos, 0)]
+            i = len(chunk)
+            while True:
+                i = chunk.rfind(b'\n', 0, i)
+                if i < 0:
+                    break
+                count += 1
+                if count == n_lines:
+                    return pos + i + 1
+    return 0
+
+
+def replace_tail(name, n_rows, frame):
+    """
+    Replace the last 'n_rows' rows of dataset 'name' by the rows of 'frame'.
+    """
+    file_path = data.path(name)
+    with open(file_path, 'r+b') as f:
+        f.truncate(tail_offset(file_path, n_rows))
+    return append(name, frame)
+
+
+def _new_months(path, stored, prefix=None):
+    """
+    Return the rows of TAVG file 'path' published after the 'stored' ones,
+    with their interpolation and rolling average computed from the stored tail.
+    """
+    cols = ['ano', 'uncert', 'abs']
+    if prefix is not None:
+        stored = stored.rename(columns={f'{prefix}_{c}': c for c in cols})
+        stored = stored.rename(columns={f'mov_avrg_{prefix}': 'mov_average'})
+        stored = stored.dropna(subset=['ano'])
+    last = columnar.dates_to_months(stored['date'])[-1]
+    new = to_frame(parse_tavg(path, after=last))
+    return _interpolate(new, context=stored)
+
+
+def refresh_globales():
+    stored = read_stored_tail('temperatures_globales', CONTEXT_ROWS)
+    new = _new_months(GLOBAL_FILE, stored)
+    return append('temperatures_globales', new[stored.columns])
+
+
+def refresh_hemispheres():
+    """
+    Add the months published since the last run for each hemisphere, after
+    its own last stored month: when one hemisphere is published later than
+    the other, its months already stored (as NaN) are filled in.
+    Return the number of added or filled rows.
+    """
+    name = 'temperatures_hemispheres'
+    prefixes = [('north', NORTH_FILE), ('south', SOUTH_FILE)]
+    # Enough rows for the context of both hemispheres, even if one of them ends earlier.
+    n_rows = 4 * CONTEXT_ROWS
+    while True:
+        stored = read_stored_tail(name, n_rows)
+        if (len(stored) < n_rows
+                or all(stored[f'{prefix}_ano'].count() >= CONTEXT_ROWS for prefix, _ in prefixes)):
+            break
+        n_rows *= 2
+    frames = []
+    for prefix, path in prefixes:
+        new = _new_months(path, stored, prefix)
+        frames.append(new.rename(columns={'ano': f'{prefix}_ano',
+                                          'abs': f'{prefix}_abs',
+                                          'uncert': f'{prefix}_uncert',
+                                          'mov_average': f'mov_avrg_{prefix}'}))
+    new = pd.merge(frames[0], frames[1], on=['date', 'year', 'month'], how='outer')
+    if not len(new):
+        return 0
+    # The stored rows from the first new month on are rewritten, with the
+    # values of the hemisphere published later.
+    rewritten = stored.loc[stored['date'] >= new['date'].min()]
+    rows = new.set_index('date').combine_first(rewritten.set_index('date')).reset_index()
+    rows = rows.astype({'year': np.int64, 'month': np.int64}).sort_values('date')
+    replace_tail(name, len(rewritten), rows[stored.columns])
+    return len(new)
+
+
+def refresh_co2_global():
+    name = 'co2_global'
+    stored = read_stored_tail(name, 1)
+    last = int(stored['Year'].iloc[-1])
+
+    with open(CO2_FILE) as f:
+        header = f.readline()
+    # The OWID export holds the world series only, sorted by year.
+    lines = tail_lines(CO2_FILE, lambda line: line != header.rstrip('\n')
+                       and int(line.split(',')[2]) > last)
+    raw = pd.read_csv(io.StringIO(header + '\n'.join(lines) + '\n'))
+    raw = raw.loc[raw['Code'] == CO2_ENTITY]
+    new = raw[stored.columns].astype({c: np.float64 for c in stored.columns[1:]})
+    return append(name, new)
+
+
+REFRESHERS = {
+    'temperatures_globales': refresh_globales,
+    'temperatures_hemispheres': refresh_hemispheres,
+    'co2_global': refresh_co2_global,
+}
+
+
+def refresh_all():
+    """
+    Append the rows published since the last run to the datasets, rebuild
+    the columnar copy and the built aggregates of the datasets that changed
+    (see the module docstring), and refit their stored forecasts. The sparse
+    per-country store is built if it is missing or out of date.
+    Return {dataset name: number of appended (or filled) rows}.
+    """
+    appended = {name: refresh() for name, refresh in REFRESHERS.items()}
+    for name, n_rows in appended.items():
+        if n_rows and columnar.read_meta(name) is not None:
+            columnar.build(name)
+    if not sparse.is_current():
+        sparse.build()
+    changed = [name for name, n_rows in appended.items() if n_rows]
+    if changed and aggregates.is_built():
+        aggregates.build_all(sources=changed)
+    for name in changed:
+        forecast.refresh(name)
+    return appended
+
+
+if __name__ == '__main__':
+    if '--incremental' in sys.argv[1:]:
+        for name, n_rows in refresh_all().items():
+            print(f"{name}: {n_rows} new rows")
+    else:
+        for name, frame in build_all().items():
+            print(f"{name}: {len(frame)} rows")
@@ -0,0 +1,64 @@
+"""
+
+Natural breaks (Fisher-Jenks) classification.
+
+scheme='NaturalBreaks' of GeoDataFrame.plot() classifies the values again on
+every call, with the k-means heuristic of mapclassify. natural_breaks()
+computes the exact optimal classes of Fisher and Jenks (minimal sum of the
+squared deviations of the values from the mean of their class), by dynamic
+programming over the sorted values with numpy: the sums of squares of all
+the runs of values come from two cumulative sums, and each added class is a
+minimum over an (n+1, n+1) matrix. For the ~200 countries of a map, that is
+about a millisecond, so the breaks of all the years are computed in one
+batch (see the aggregate temperatures_countries_difference_breaks).
+
+"""
+
+import numpy as np
+
+
+K = 5
+
+
+def _run_costs(y):
+    """
+    Return the (n+1, n+1) matrix of the sums of squared deviations of the runs
+    y[i:j] of the sorted values, inf where i >= j.
+    """
+    n = len(y)
+    s1 = np.concatenate([[0.0], np.cumsum(y)])
+    s2 = np.concatenate([[0.0], np.cumsum(y * y)])
+    i, j = np.triu_indices(n + 1, 1)
+    costs = np.full((n + 1, n + 1), np.inf)
+    costs[i, j] = np.maximum(s2[j] - s2[i] - (s1[j] - s1[i]) ** 2 / (j - i), 0)
+    return costs
+
+
+def natural_breaks(values, k=K):
+    """
+    Return the upper bounds of the 'k' classes of 'values' (NaN ignored)
+    which minimize the sum of the squared deviations from the class means,
+    as mapclassify.FisherJenks. Fewer bounds if there are fewer than 'k'
+    distinct values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    y = np.sort(values[~np.isnan(values)])
+    n = len(y)
+    k = min(k, len(np.unique(y)))
+    if k == 0:
+        return np.array([])
+    costs = _run_costs(y)
+    columns = np.arange(n + 1)
+    # best[j]: cost of the best classification of y[:j] in the current number
+    # of classes; starts[c][j]: start of the last class of that classification.
+    best = costs[0]
+    starts = []
+    for _ in range(k - 1):
+        total = best[:, None] + costs
+        start = np.argmin(total, axis=0)
+        best = total[start, columns]
+        starts.append(start)
+    ends = [n]
+    for start in reversed(starts):
+        ends.append(start[ends[-1]])
+    return y[np.array(ends[::-1]) - 1]
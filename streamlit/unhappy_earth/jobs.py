@@ -0,0 +1,158 @@
+"""
+
+Background jobs shared by all the sessions of the app.
+
+Long computations (model fits) run in a pool of worker processes, so that
+they neither hold the GIL of the Streamlit server nor block the sessions that
+do not need them. Jobs are deduplicated by key ("single flight"): while a job
+is running, later submissions of the same key get the same Future instead of
+starting another computation. submit() runs the jobs in the shared pool of
+this module; a ProcessPool of its own keeps other jobs (e.g. the rendering of
+the figures) from waiting behind the model fits.
+
+The workers are started with the 'spawn' method, which is safe in the
+multi-threaded Streamlit server, and inherit its sys.path. Streamlit runs the
+app script as the __main__ module: it is hidden while the workers start, so
+that they do not import it (and run the app) again. Job functions must
+be importable module-level functions, should return small results (e.g.
+store their output on disk and return its key), and should not keep memory
+from one job to the next, as the workers live as long as the pool.
+
+"""
+
+import atexit
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+import types
+
+
+# All the cores but one, left to the Streamlit server.
+MAX_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+
+
+@contextlib.contextmanager
+def _hidden_main():
+    """
+    Replace the __main__ module by an empty one, which the spawned workers do
+    not import.
+    """
+    main = sys.modules.get('__main__')
+    placeholder = types.ModuleType('__main__')
+    sys.modules['__main__'] = placeholder
+    try:
+        yield
+    finally:
+        # Unless a script run of another session replaced it meanwhile.
+        if sys.modules.get('__main__') is placeholder:
+            sys.modules['__main__'] = main
+
+
+class ProcessPool:
+    """
+    Pool of 'max_workers' worker processes, started on first use, running
+    single-flight jobs.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        # key -> Future of the running job.
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'shared': 0}
+
+    def executor(self):
+        """
+        Return the process pool, started on first use.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+                atexit.register(self.shutdown)
+            return self._executor
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._running.get(key) is future:
+                del self._running[key]
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in a worker process and return its Future,
+        or the Future of the job of the same 'key' if one is already running.
+        """
+        with self._lock:
+            future = self._running.get(key)
+            if future is not None:
+                self._stats['shared'] += 1
+                return future
+        pool = self.executor()
+        with self._lock:
+            # Another session may have submitted the job meanwhile.
+            future = self._running.get(key)
+            if future is not None:
+                self._stats['shared'] += 1
+                return future
+            # The pool starts its worker processes on submission.
+            with _hidden_main():
+                future = pool.submit(func, *args, **kwargs)
+            self._running[key] = future
+            self._stats['submitted'] += 1
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def running(self, key):
+        """
+        Return the Future of the running job 'key', or None.
+        """
+        with self._lock:
+            return self._running.get(key)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, running=len(self._running), workers=self.max_workers)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._executor = self._executor, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+_pool = ProcessPool()
+
+
+def executor():
+    """
+    Return the (shared) process pool, started on first use.
+    """
+    return _pool.executor()
+
+
+def submit(key, func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) in a worker process of the shared pool and
+    return its Future, or the Future of the job of the same 'key' if one is
+    already running.
+    """
+    return _pool.submit(key, func, *args, **kwargs)
+
+
+def running(key):
+    """
+    Return the Future of the running job 'key', or None.
+    """
+    return _pool.running(key)
+
+
+def stats():
+    return _pool.stats()
+
+
+def shutdown(wait=True):
+    _pool.shutdown(wait=wait)
@@ -0,0 +1,157 @@
+"""
+
+Lazy, column-projected access to the wide datasets.
+
+The tabs usually display a handful of columns picked in a multiselect among
+the ~180 countries of a dataset. A LazyDataset only reads the requested
+columns from the storage (sparse per-country store, columnar files, or CSV
+file with usecols, the first one up to date), and memoizes each column and each derived column: adding
+a country to the selection costs the work of one column.
+
+"""
+
+import csv
+import threading
+
+import pandas as pd
+
+from unhappy_earth import columnar, data, rolling, sparse
+
+
+# Columns identifying the rows of each dataset, always returned.
+KEYS = {
+    'temperatures_globales': ['date', 'year'],
+    'temperatures_hemispheres': ['date', 'year'],
+    'temperatures_countries': ['date', 'year'],
+    'co2_global': ['Year'],
+    'co2_countries': ['year'],
+    'country_codes': ['source', 'key'],
+}
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+class LazyDataset:
+    """
+    Handle on a dataset, reading and computing its columns on demand.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = KEYS[name]
+        self._version = None
+        self._header = None
+        # column -> array, and (operation, column, parameters) -> array.
+        self._columns = {}
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        """
+        Drop the memoized columns if the dataset changed. Must be called with
+        the lock held.
+        """
+        version = data.version(self.name)
+        if version != self._version:
+            self._version = version
+            self._header = None
+            self._columns.clear()
+            self._derived.clear()
+        return version
+
+    def _read_header(self):
+        meta = columnar.read_meta(self.name)
+        if meta is not None and meta['source_hash'] == self._version:
+            return [column['name'] for column in meta['columns']]
+        with open(data.path(self.name), newline='') as f:
+            return next(csv.reader(f))
+
+    @property
+    def columns(self):
+        """
+        Names of the value columns of the dataset (keys excluded).
+        """
+        with self._lock:
+            self._check_version()
+            if self._header is None:
+                self._header = self._read_header()
+            return [c for c in self._header if c not in self.keys]
+
+    def _read(self, columns):
+        """
+        Read 'columns' from the storage, pushing the projection down to it.
+        """
+        store = sparse.load() if self.name == sparse.NAME else None
+        if store is not None:
+            arrays = {'date': store.dates, 'year': store.years}
+            return {c: arrays[c] if c in arrays else store.column(c) for c in columns}
+
+        frame = columnar.load(self.name, source_hash=self._version, columns=columns, float64=True)
+        if frame is None:
+            frame = pd.read_csv(data.path(self.name), usecols=columns)
+        return {c: frame[c].to_numpy() for c in columns}
+
+    def _get_columns(self, columns):
+        """
+        Return {column: array}, reading the missing columns in one go.
+        Must be called with the lock held.
+        """
+        missing = [c for c in dict.fromkeys(columns) if c not in self._columns]
+        if missing:
+            self._columns.update(self._read(missing))
+        return {c: self._columns[c] for c in columns}
+
+    def select(self, columns):
+        """
+        Return a DataFrame with the key columns and 'columns'.
+        """
+        with self._lock:
+            self._check_version()
+            return pd.DataFrame(self._get_columns(self.keys + list(columns)))
+
+    def tail(self, n=10):
+        """
+        Return the last 'n' rows of the dataset, all columns.
+        """
+        with self._lock:
+            version = self._check_version()
+        store = sparse.load() if self.name == sparse.NAME else None
+        if store is not None:
+            return store.frame(store.countries, start=store.dates[-n])
+        # Memory-mapped columns: only the pages of the last rows are read, and
+        # widened to the values of the CSV file.
+        frame = columnar.load(self.name, source_hash=version)
+        if frame is None:
+            frame = data.load(self.name)
+        return columnar.widen_frame(frame.tail(n))
+
+    def rolling_mean(self, columns, window):
+        """
+        Return a DataFrame with the key columns and the rolling mean over
+        'window' rows of each of 'columns'.
+        """
+        with self._lock:
+            self._check_version()
+            arrays = self._get_columns(self.keys)
+            for column in columns:
+                key = ('rolling_mean', column, window)
+                if key not in self._derived:
+                    values = self._get_columns([column])[column]
+                    self._derived[key] = rolling.rolling_mean(values, window)
+                arrays[column] = self._derived[key]
+            return pd.DataFrame(arrays)
+
+    def stats(self):
+        with self._lock:
+            return {'columns': len(self._columns), 'derived': len(self._derived)}
+
+
+def dataset(name):
+    """
+    Return the (shared) LazyDataset of dataset 'name'.
+    """
+    with _datasets_lock:
+        if name not in _datasets:
+            _datasets[name] = LazyDataset(name)
+        return _datasets[name]
@@ -0,0 +1,147 @@
+"""
+
+Correlations between all the pairs of countries.
+
+The per-country series are sparse: most countries only have values over a
+part of the period, with gaps. The Pearson correlation of each pair is
+computed over the rows where both countries have a value (pairwise-complete
+observations), for all the pairs at once: with M the mask of the valid values
+and X the values (0 where missing), the sums over the common rows of every
+pair are the matrix products
+
+    n = M'M    Sx = X'M    Sxx = (X * X)'M    Sxy = X'X
+
+from which the correlation r and its two-sided p-value (Student's t with
+n - 2 degrees of freedom, as scipy.stats.pearsonr) follow element-wise.
+
+Two tables are correlated: the monthly temperature anomalies of the
+countries (temperatures minus the mean of each calendar month of the
+country, which removes the seasonal cycle) and the yearly CO2 emissions of
+the countries (ISO3 codes). The results are cached per data version.
+
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from unhappy_earth import data, lazy
+
+
+# Pairs with less common observations get NaN correlations.
+MIN_PERIODS = 24
+TEMPERATURES = 'temperatures_countries'
+CO2 = 'co2_countries'
+# Aggregates of the CO2 dataset, which are not countries.
+CO2_AGGREGATES = ['OWID_WRL']
+
+# (name, data version) -> Correlations.
+_cache = {}
+_lock = threading.Lock()
+
+
+class Correlations:
+    """
+    Correlation matrix of a table of series, with the p-values and numbers of
+    common observations of the pairs.
+    """
+
+    def __init__(self, names, r, p, n):
+        self.names = list(names)
+        # (series, series) arrays.
+        self.r = r
+        self.p = p
+        self.n = n
+        self._position = {name: i for i, name in enumerate(self.names)}
+
+    def frame(self, values='r'):
+        """
+        Return the matrix 'r', 'p' or 'n' as a DataFrame.
+        """
+        return pd.DataFrame(getattr(self, values), index=self.names, columns=self.names)
+
+    def top(self, name, k=10, ascending=False):
+        """
+        Return the 'k' series most correlated with 'name' (least correlated
+        if 'ascending'), as a frame of their r, p and n.
+        """
+        i = self._position[name]
+        order = np.argsort(self.r[i] if ascending else -self.r[i], kind='stable')
+        order = [j for j in order if j != i and not np.isnan(self.r[i, j])][:k]
+        return pd.DataFrame({'r': self.r[i, order], 'p': self.p[i, order], 'n': self.n[i, order]},
+                            index=pd.Index([self.names[j] for j in order], name=name))
+
+
+def correlate(values, names=None, min_periods=MIN_PERIODS):
+    """
+    Return the Correlations of the columns of 'values' (rows, series), NaN
+    where a series has no value, over the pairwise-complete rows.
+    'values' may also be a DataFrame, whose columns are the names.
+    """
+    if names is None:
+        names = list(values.columns) if isinstance(values, pd.DataFrame) else range(values.shape[1])
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    mask = valid.astype(np.float64)
+    # Centered on the mean of each series, which limits the cancellation in
+    # the sums of squares below.
+    means = np.where(valid, values, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    x = np.where(valid, values - means, 0)
+
+    n = mask.T @ mask
+    sx = x.T @ mask
+    sxx = (x * x).T @ mask
+    sxy = x.T @ x
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sx.T / n
+        var = sxx - sx ** 2 / n
+        r = np.clip(cov / np.sqrt(var * var.T), -1, 1)
+        r[(n < max(min_periods, 3)) | (var <= 0) | (var.T <= 0)] = np.nan
+        t = r * np.sqrt((n - 2) / (1 - r ** 2))
+    p = 2 * stats.t.sf(np.abs(t), n - 2)
+    p[np.isnan(r)] = np.nan
+    return Correlations(names, r, p, n.astype(np.int64))
+
+
+def temperature_anomalies():
+    """
+    Return the monthly temperature anomalies of the countries: one column per
+    country, one row per date.
+    """
+    countries = lazy.dataset(TEMPERATURES)
+    frame = countries.select(countries.columns).drop(columns='year').set_index('date')
+    calendar_month = pd.to_datetime(frame.index).month
+    return frame - frame.groupby(calendar_month).transform('mean')
+
+
+def co2_emissions():
+    """
+    Return the yearly CO2 emissions of the countries: one column per ISO3
+    code, one row per year.
+    """
+    return data.load(CO2).set_index('year').drop(columns=CO2_AGGREGATES)
+
+
+TABLES = {
+    TEMPERATURES: temperature_anomalies,
+    CO2: co2_emissions,
+}
+
+
+def correlations(name):
+    """
+    Return the Correlations of the table 'name' (a key of TABLES), computed
+    once per version of its data.
+    """
+    cache_key = (name, data.version(name))
+    with _lock:
+        result = _cache.get(cache_key)
+    if result is None:
+        result = correlate(TABLES[name]())
+        with _lock:
+            for key in [key for key in _cache if key[0] == name]:
+                del _cache[key]
+            _cache[cache_key] = result
+    return result
@@ -0,0 +1,121 @@
+"""
+
+Polynomial regressions of every degree at once.
+
+The polynomial regressions y = c0 + c1 x + ... + cd x^d of increasing degrees
+are nested: the design matrix of degree d is made of the first d + 1 columns
+of the Vandermonde matrix V of the highest degree. With one QR factorization
+V = QR, the fit of degree d only uses the leading columns of Q and block of R:
+
+    yhat_d = Q[:, :d+1] Q[:, :d+1]' y        R[:d+1, :d+1] c_d = Q[:, :d+1]' y
+
+so that a single factorization gives the coefficients, predictions and R² of
+all the degrees. x is mapped to [-1, 1] first, which keeps V well
+conditioned, and the coefficients are converted back to powers of x.
+
+The cross-validated scores are computed the same way, with one factorization
+per fold, over contiguous folds (as scikit-learn's KFold without shuffling):
+the R² and RMSE of the out-of-fold predictions of all the folds together.
+
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+MAX_DEGREE = 5
+FOLDS = 5
+# Number of (key -> fits) kept by cached().
+CACHE_SIZE = 8
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _r2(y, yhat):
+    return 1 - ((y - yhat) ** 2).sum(axis=0) / ((y - y.mean()) ** 2).sum()
+
+
+def _nested_fits(v, y):
+    """
+    Return the (coefficients, predictions) of every degree fitted on the
+    Vandermonde matrix 'v': a list of (degree + 1,) arrays and the
+    (rows, degrees) array of predictions of the rows of 'v'.
+    """
+    q, r = np.linalg.qr(v)
+    qty = q.T @ y
+    # Degree d adds the projection on column d of Q to the fit of degree d - 1.
+    yhat = np.cumsum(q * qty, axis=1)[:, 1:]
+    coefs = [np.linalg.solve(r[:d + 1, :d + 1], qty[:d + 1]) for d in range(1, v.shape[1])]
+    return coefs, yhat
+
+
+def _scaled_predictions(coefs, v):
+    return np.column_stack([v[:, :len(c)] @ c for c in coefs])
+
+
+def fit_degrees(x, y, max_degree=MAX_DEGREE, folds=FOLDS):
+    """
+    Fit the polynomial regressions of y on x of degrees 1 to 'max_degree' and
+    return a dict degree -> dict with:
+    * 'intercept' and 'coef' (coefficients of x, x^2, ..., x^d), as the
+      LinearRegression of the PolynomialFeatures of x,
+    * 'yhat': the predictions of x,
+    * 'r2': the R² score of the fit, 'cv_r2' and 'cv_rmse': the scores of the
+      predictions of each of the 'folds' folds by the fit of the others.
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    domain = [x.min(), x.max()]
+    scaled = np.polynomial.polyutils.mapdomain(x, domain, [-1, 1])
+    v = np.vander(scaled, max_degree + 1, increasing=True)
+
+    coefs, yhat = _nested_fits(v, y)
+    r2 = _r2(y[:, None], yhat)
+
+    cv_yhat = np.empty_like(yhat)
+    for test in np.array_split(np.arange(len(x)), folds):
+        train = np.ones(len(x), dtype=bool)
+        train[test] = False
+        fold_coefs, _ = _nested_fits(v[train], y[train])
+        cv_yhat[test] = _scaled_predictions(fold_coefs, v[test])
+    cv_r2 = _r2(y[:, None], cv_yhat)
+    cv_rmse = np.sqrt(((y[:, None] - cv_yhat) ** 2).mean(axis=0))
+
+    fits = {}
+    for d, c in enumerate(coefs, start=1):
+        unscaled = np.polynomial.Polynomial(c, domain=domain).convert().coef
+        # convert() drops the trailing zero coefficients.
+        unscaled = np.pad(unscaled, (0, d + 1 - len(unscaled)))
+        fits[d] = {'intercept': unscaled[0], 'coef': unscaled[1:], 'yhat': yhat[:, d - 1],
+                   'r2': r2[d - 1], 'cv_r2': cv_r2[d - 1], 'cv_rmse': cv_rmse[d - 1]}
+    return fits
+
+
+def cached(key, x, y, max_degree=MAX_DEGREE, folds=FOLDS):
+    """
+    Return fit_degrees(x, y, max_degree, folds), computed once per 'key',
+    which must identify x and y (e.g. include the version of their data).
+    """
+    cache_key = (key, max_degree, folds)
+    with _lock:
+        fits = _cache.get(cache_key)
+    if fits is None:
+        fits = fit_degrees(x, y, max_degree, folds)
+        with _lock:
+            if len(_cache) >= CACHE_SIZE:
+                _cache.pop(next(iter(_cache)))
+            _cache[cache_key] = fits
+    return fits
+
+
+def scores(fits):
+    """
+    Return the table of the scores of each degree.
+    """
+    return pd.DataFrame({'r2': [f['r2'] for f in fits.values()],
+                         'cv_r2': [f['cv_r2'] for f in fits.values()],
+                         'cv_rmse': [f['cv_rmse'] for f in fits.values()]},
+                        index=pd.Index(list(fits), name='degree'))
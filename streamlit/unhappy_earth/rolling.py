@@ -0,0 +1,131 @@
+"""
+
+Rolling-window means computed with NumPy strided views.
+
+The windows of a column are the rows of a strided view of it, all summed in
+one NumPy call. Each window is summed on its own, as Series.mean() sums a
+slice, so that the means are those of the loops over the windows: the
+difference of two running sums would carry the rounding errors of all the rows
+before the window, growing with the length of the series. Missing values are
+ignored: each window is averaged over its valid values, and is NaN when it
+holds less than 'min_periods' of them.
+
+Windows follow the pandas conventions:
+* trailing (default): the 'window' rows ending with the current row,
+* closed='left': the 'window' rows preceding the current row,
+* center=True: the 'window' rows around the current row, like
+  rolling(window, center=True).
+
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _bounds(n, window, center=False, closed='right'):
+    """
+    Return the (start, end) row arrays of the windows of each of 'n' rows,
+    clipped to the rows of the table.
+    """
+    if closed not in ('right', 'left'):
+        raise ValueError(f"Unsupported closed={closed!r}, expected 'right' or 'left'")
+    end = np.arange(1, n + 1)
+    if center:
+        end += (window - 1) // 2
+    if closed == 'left':
+        end -= 1
+    start = end - window
+    return np.clip(start, 0, n), np.clip(end, 0, n)
+
+
+def _window_sums(values, start, end):
+    """
+    Return the sums of the valid values and the numbers of valid values of the
+    windows, for each column of 'values'.
+    """
+    valid = ~np.isnan(values)
+    # Exact for the counts.
+    counts = np.concatenate([np.zeros((1, values.shape[1]), dtype=np.int64),
+                             np.cumsum(valid, axis=0)])
+    # One contiguous row per column, so that each window is summed pairwise, as a slice.
+    filled = np.ascontiguousarray(np.where(valid, values, 0).T)
+    sums = np.zeros((len(start), values.shape[1]))
+    lengths = end - start
+    width = int(lengths.max(initial=0))
+    if width:
+        full = np.flatnonzero(lengths == width)
+        for column, row in enumerate(filled):
+            # Indexing the view copies the windows into a contiguous array.
+            sums[full, column] = sliding_window_view(row, width)[start[full]].sum(axis=1)
+    # The windows clipped to the first or last rows of the table.
+    for i in np.flatnonzero((lengths > 0) & (lengths < width)):
+        sums[i] = filled[:, start[i]:end[i]].sum(axis=1)
+    return sums, counts[end] - counts[start]
+
+
+def _as_2d(values):
+    values = np.asarray(values, dtype=np.float64)
+    return values.reshape(len(values), -1)
+
+
+def rolling_mean(values, window, min_periods=None, center=False, closed='right'):
+    """
+    Return the rolling means of 'values', a 1D array or a 2D array with one
+    column per series, with the same shape.
+    """
+    table = _as_2d(values)
+    start, end = _bounds(len(table), window, center, closed)
+    sums, counts = _window_sums(table, start, end)
+    min_periods = window if min_periods is None else max(min_periods, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts >= min_periods, sums / counts, np.nan)
+    return means.reshape(np.shape(values))
+
+
+def rolling_uncert(values, window, min_periods=None, center=False, closed='right',
+                   propagation='mean'):
+    """
+    Return the uncertainty of the rolling means of measures whose
+    uncertainties are 'values'.
+    With propagation='mean' it is the mean of the uncertainties, as displayed
+    in the tabs. With propagation='independent', the errors of the measures
+    are considered independent: sqrt(sum of the squared uncertainties) / n.
+    """
+    if propagation == 'mean':
+        return rolling_mean(values, window, min_periods, center, closed)
+    if propagation != 'independent':
+        raise ValueError(f"Unsupported propagation={propagation!r}")
+    table = _as_2d(values)
+    start, end = _bounds(len(table), window, center, closed)
+    sums, counts = _window_sums(table ** 2, start, end)
+    min_periods = window if min_periods is None else max(min_periods, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        uncert = np.where(counts >= min_periods, np.sqrt(sums) / counts, np.nan)
+    return uncert.reshape(np.shape(values))
+
+
+def is_uncert(column):
+    return column == 'uncert' or column.endswith('_uncert')
+
+
+def rolling_frame(frame, columns, window, min_periods=None, center=False, closed='right',
+                  propagation='mean'):
+    """
+    Return a DataFrame (same index as 'frame') with the rolling means of
+    'columns', computed in one pass. The '*_uncert' columns are propagated
+    according to 'propagation' (see rolling_uncert()).
+    """
+    columns = list(columns)
+    uncert = [c for c in columns if is_uncert(c)] if propagation != 'mean' else []
+    others = [c for c in columns if c not in uncert]
+    result = {}
+    if others:
+        means = rolling_mean(_as_2d(frame[others].to_numpy(np.float64)), window,
+                             min_periods, center, closed)
+        result.update(zip(others, means.T))
+    if uncert:
+        errors = rolling_uncert(_as_2d(frame[uncert].to_numpy(np.float64)), window,
+                                min_periods, center, closed, propagation)
+        result.update(zip(uncert, errors.T))
+    return pd.DataFrame({c: result[c] for c in columns}, index=frame.index)
@@ -0,0 +1,239 @@
+"""
+
+Compact storage of the per-country temperatures.
+
+temperatures_countries.csv is a wide table in which most countries only have
+values over a part of the rows. Here each country is stored as:
+* the contiguous array of its valid values (float32, served as the float64
+  values of the CSV file),
+* its valid range: first row and number of rows up to its last valid value,
+* the run-length encoded gaps (NaN runs) inside that range, as (offset, length).
+
+All countries share the row axis of the wide table (its dates, as month
+indices), so that the rebuilt series are the columns of the wide table.
+
+The store is saved in data/unhappy_earth/columnar/temperatures_countries_sparse/
+by the ingestion (unhappy_earth.ingest), or by:
+
+    PYTHONPATH=streamlit python -m unhappy_earth.sparse
+
+It is never built by the sessions from the dense table, which it avoids
+parsing: while it is missing or out of date, load() returns None and the
+countries are read from the columnar copy.
+
+"""
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from unhappy_earth import columnar, data
+
+
+NAME = 'temperatures_countries'
+FORMAT_VERSION = 1
+
+# Columns of the index array.
+VALUES_START, VALUES_COUNT, ROW_START, ROW_COUNT, GAPS_START, GAPS_COUNT = range(6)
+
+_store = {}
+_lock = threading.Lock()
+
+
+def store_dir():
+    return os.path.join(data.DATA_DIR, 'columnar', NAME + '_sparse')
+
+
+class CountryTemperatures:
+    """
+    Per-country temperatures, rebuilt on demand from the compact arrays.
+    """
+
+    def __init__(self, axis, countries, index, values, gaps):
+        # Month index of each row of the wide table.
+        self.axis = axis
+        self.countries = list(countries)
+        self.index = index
+        self.values = values
+        self.gaps = gaps
+        self._position = {c: i for i, c in enumerate(self.countries)}
+        self.dates = columnar.months_to_dates(axis)
+        self.years = np.asarray(axis) // 12
+
+    def valid_range(self, country):
+        """
+        Return the (first, last) dates with a value for 'country', or None.
+        """
+        row = self.index[self._position[country]]
+        if row[ROW_COUNT] == 0:
+            return None
+        return (self.dates[row[ROW_START]],
+                self.dates[row[ROW_START] + row[ROW_COUNT] - 1])
+
+    def _rows(self, start, end):
+        """
+        Return the [first, last) rows of the axis between dates 'start' and 'end'.
+        """
+        first = 0 if start is None else np.searchsorted(self.dates, start, side='left')
+        last = len(self.dates) if end is None else np.searchsorted(self.dates, end, side='right')
+        return int(first), int(last)
+
+    def _span(self, country):
+        """
+        Return (first row, values over the valid range with NaN in the gaps).
+        """
+        row = self.index[self._position[country]]
+        span = np.full(row[ROW_COUNT], np.nan)
+        valid = np.ones(row[ROW_COUNT], dtype=bool)
+        for offset, length in self.gaps[row[GAPS_START]:row[GAPS_START] + row[GAPS_COUNT]]:
+            valid[offset:offset + length] = False
+        span[valid] = columnar.widen(self.values[row[VALUES_START]:row[VALUES_START] + row[VALUES_COUNT]])
+        return row[ROW_START], span
+
+    def column(self, country, start=None, end=None):
+        """
+        Return the values of 'country' on the rows of the axis between dates
+        'start' and 'end' (included), NaN outside of its valid range.
+        """
+        first, last = self._rows(start, end)
+        out = np.full(last - first, np.nan)
+        span_start, span = self._span(country)
+        lo, hi = max(first, span_start), min(last, span_start + len(span))
+        if lo < hi:
+            out[lo - first:hi - first] = span[lo - span_start:hi - span_start]
+        return out
+
+    def series(self, country, start=None, end=None):
+        """
+        Return the temperatures of 'country' between dates 'start' and 'end'
+        (included) as a Series indexed by date.
+        """
+        first, last = self._rows(start, end)
+        return pd.Series(self.column(country, start, end),
+                         index=pd.Index(self.dates[first:last], name='date'),
+                         name=country)
+
+    def frame(self, countries, start=None, end=None):
+        """
+        Return the wide table (date, year, countries...) for 'countries' only.
+        """
+        first, last = self._rows(start, end)
+        columns = {'date': self.dates[first:last], 'year': self.years[first:last]}
+        for country in countries:
+            columns[country] = self.column(country, start, end)
+        return pd.DataFrame(columns, index=pd.RangeIndex(first, last))
+
+
+def from_frame(wide):
+    """
+    Build the compact arrays from the wide table (date, year, countries...).
+    """
+    axis = columnar.dates_to_months(wide['date'])
+    countries = list(wide.columns[2:])
+    index = np.zeros((len(countries), 6), dtype=np.int64)
+    values, gaps = [], []
+    n_values = n_gaps = 0
+
+    for i, country in enumerate(countries):
+        column = wide[country].to_numpy(np.float64)
+        valid = ~np.isnan(column)
+        rows = np.flatnonzero(valid)
+        if len(rows) == 0:
+            index[i] = [n_values, 0, 0, 0, n_gaps, 0]
+            continue
+        first, last = rows[0], rows[-1] + 1
+        span_valid = valid[first:last]
+        # Starts and ends of the NaN runs inside the valid range.
+        edges = np.diff(np.concatenate([[1], span_valid.astype(np.int8), [1]]))
+        run_starts, run_ends = np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)
+        country_gaps = np.column_stack([run_starts, run_ends - run_starts])
+
+        index[i] = [n_values, len(rows), first, last - first, n_gaps, len(country_gaps)]
+        values.append(column[rows].astype(np.float32))
+        gaps.append(country_gaps)
+        n_values += len(rows)
+        n_gaps += len(country_gaps)
+
+    return CountryTemperatures(
+        axis, countries, index,
+        np.concatenate(values) if values else np.zeros(0, dtype=np.float32),
+        np.concatenate(gaps).astype(np.int32) if gaps else np.zeros((0, 2), dtype=np.int32))
+
+
+def build():
+    """
+    Save the compact arrays of the current per-country dataset.
+    """
+    source_hash = data.version(NAME)
+    store = from_frame(pd.read_csv(data.path(NAME)))
+    out_dir = store_dir()
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for field in ['axis', 'index', 'values', 'gaps']:
+        np.save(os.path.join(tmp_dir, field + '.npy'), getattr(store, field))
+    meta = {'format': FORMAT_VERSION,
+            'source_hash': source_hash,
+            'countries': store.countries}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    # Swap the directories so that readers never see a half-written store.
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return store
+
+
+def _read_meta(source_hash):
+    try:
+        with open(os.path.join(store_dir(), 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != FORMAT_VERSION or meta.get('source_hash') != source_hash:
+        return None
+    return meta
+
+
+def is_current():
+    """
+    Return True if the saved store was built from the current per-country dataset.
+    """
+    return _read_meta(data.version(NAME)) is not None
+
+
+def _read(source_hash):
+    meta = _read_meta(source_hash)
+    if meta is None:
+        return None
+    arrays = {field: np.load(os.path.join(store_dir(), field + '.npy'), mmap_mode='r')
+              for field in ['axis', 'index', 'values', 'gaps']}
+    return CountryTemperatures(arrays['axis'], meta['countries'], arrays['index'],
+                               arrays['values'], arrays['gaps'])
+
+
+def load():
+    """
+    Return the CountryTemperatures of the current per-country dataset,
+    memory-mapped from the saved store, or None if it is missing or out of
+    date. Cached per data version.
+    """
+    source_hash = data.version(NAME)
+    with _lock:
+        store = _store.get(source_hash)
+        if store is None:
+            store = _read(source_hash)
+            if store is not None:
+                _store.clear()
+                _store[source_hash] = store
+    return store
+
+
+if __name__ == '__main__':
+    store = build()
+    print(f"{NAME}: {len(store.countries)} countries, {len(store.values)} values, "
+          f"{len(store.gaps)} gaps")
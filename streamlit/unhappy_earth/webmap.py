@@ -0,0 +1,232 @@
+"""
+
+Animated maps of the country temperatures, drawn in the browser.
+
+The map sliders of the existence tab need a rerun of the script and a new
+image from the server for each year. Here the simplified geometries of the
+countries (unhappy_earth.geometry) are sent once as SVG paths, with the
+temperatures of all the years as one compact array: centidegrees in
+little-endian int16, base64 encoded (about 100 kB for all the countries and
+years). Choosing a year, playing the animation and switching between the
+temperatures and their difference with a reference year then run in the
+browser only, without any request to the server.
+
+The page is built once per data version and set of labels, and displayed
+with streamlit.components.v1.html().
+
+"""
+
+import base64
+import json
+import threading
+
+import numpy as np
+
+from unhappy_earth import choropleth, geometry
+
+
+# Fixed-point encoding of the values.
+SCALE = 100
+MISSING = -32768
+# Upper bounds of the classes of the differences with the reference year, in °C.
+DIFFERENCE_BINS = [-1, -0.5, 0, 0.5, 1, 1.5, 2, 2.5, 3]
+REFERENCE_YEAR = 1900
+# Milliseconds between two years of the animation.
+FRAME_MS = 150
+HEIGHT = 760
+
+# (geometry version, labels) -> HTML page.
+_pages = {}
+_lock = threading.Lock()
+
+
+def _ring(coords, y_scale):
+    coords = np.asarray(coords)[:, :2]
+    points = ' '.join(f'{x:.2f} {-y * y_scale:.2f}' for x, y in coords[:-1])
+    return f'M{points}Z'
+
+
+def svg_path(geom, y_scale):
+    """
+    Return the SVG path data of a (Multi)Polygon, in degrees, latitudes
+    stretched by 'y_scale' as GeoDataFrame.plot() does.
+    """
+    polygons = geom.geoms if geom.geom_type == 'MultiPolygon' else [geom]
+    return ''.join(_ring(ring.coords, y_scale) for polygon in polygons
+                   for ring in [polygon.exterior, *polygon.interiors])
+
+
+def encode(values):
+    """
+    Return the base64 of the 'values' array as SCALE fixed-point int16, NaN
+    as MISSING.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    encoded = np.where(np.isnan(values), MISSING, np.round(np.nan_to_num(values) * SCALE))
+    return base64.b64encode(encoded.astype('<i2').tobytes()).decode('ascii')
+
+
+def _hex(colors):
+    return ['#%02x%02x%02x' % tuple(int(round(c * 255)) for c in color[:3]) for color in colors]
+
+
+def payload(frame, years):
+    """
+    Return the data of the page: bounds, paths, names, years and values
+    (country-major) of the countries of 'frame' with a geometry.
+    """
+    frame = frame.loc[frame['geometry'].notna()]
+    xmin, ymin, xmax, ymax = frame['geometry'].total_bounds
+    y_scale = 1 / np.cos(np.radians((ymin + ymax) / 2))
+    temperatures = choropleth.palette('YlOrRd', len(choropleth.TEMPERATURE_BINS) + 1)
+    differences = choropleth.palette('YlOrRd', len(DIFFERENCE_BINS) + 1)
+    return {
+        'viewBox': [float(v) for v in (xmin, -ymax * y_scale, xmax - xmin, (ymax - ymin) * y_scale)],
+        'paths': [svg_path(geom, y_scale) for geom in frame['geometry']],
+        'names': [str(name) for name in frame['name']],
+        'years': [int(year) for year in years],
+        'values': encode(frame[list(years)].to_numpy(np.float64)),
+        'scale': SCALE,
+        'missing': MISSING,
+        'reference': REFERENCE_YEAR,
+        'modes': {
+            'temperature': {'bins': choropleth.TEMPERATURE_BINS, 'colors': _hex(temperatures[:-1])},
+            'difference': {'bins': DIFFERENCE_BINS, 'colors': _hex(differences[:-1])},
+        },
+        'missingColor': _hex(temperatures[-1:])[0],
+        'frameMs': FRAME_MS,
+    }
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>
+body { margin: 0; font-family: sans-serif; font-size: 14px; }
+h3 { text-align: center; margin: 4px 0; font-weight: normal; font-size: 22px; }
+#map { width: 100%; height: 560px; }
+#map path { stroke: darkgrey; stroke-width: 0.3; fill-rule: evenodd; }
+#map path:hover { stroke: black; stroke-width: 0.8; }
+.controls { display: flex; gap: 12px; align-items: center; margin: 6px 12px; }
+#year { flex: 1; }
+#label { font-size: 20px; min-width: 3em; }
+#legend { display: flex; flex-wrap: wrap; gap: 2px 10px; margin: 4px 12px; font-size: 12px; }
+#legend span.box { display: inline-block; width: 14px; height: 10px; margin-right: 4px; border: 1px solid darkgrey; }
+#info { margin: 0 12px; min-height: 1.2em; }
+</style></head><body>
+<h3 id="title"></h3>
+<svg id="map" preserveAspectRatio="xMidYMid meet"></svg>
+<div class="controls">
+  <button id="play"></button>
+  <input id="year" type="range" step="1">
+  <span id="label"></span>
+  <select id="mode"></select>
+</div>
+<div id="legend"></div>
+<div id="info"></div>
+<script>
+const data = __DATA__;
+const labels = __LABELS__;
+const svg = document.getElementById('map');
+svg.setAttribute('viewBox', data.viewBox.join(' '));
+const paths = data.paths.map((d, i) => {
+  const path = document.createElementNS('http://www.w3.org/2000/svg', 'path');
+  path.setAttribute('d', d);
+  path.addEventListener('mouseenter', () => { hovered = i; info(); });
+  svg.appendChild(path);
+  return path;
+});
+const bytes = Uint8Array.from(atob(data.values), c => c.charCodeAt(0));
+const values = new Int16Array(bytes.buffer);
+const nYears = data.years.length;
+const slider = document.getElementById('year');
+const mode = document.getElementById('mode');
+const play = document.getElementById('play');
+let hovered = null, timer = null;
+slider.min = 0; slider.max = nYears - 1;
+slider.value = Math.max(0, data.years.indexOf(labels.initialYear));
+for (const name of ['temperature', 'difference']) {
+  const option = document.createElement('option');
+  option.value = name; option.textContent = labels[name];
+  mode.appendChild(option);
+}
+
+function value(country, column) {
+  const v = values[country * nYears + column];
+  if (v === data.missing) return null;
+  if (mode.value === 'temperature') return v / data.scale;
+  const ref = values[country * nYears + data.years.indexOf(data.reference)];
+  return ref === data.missing ? null : (v - ref) / data.scale;
+}
+
+function color(v, scheme) {
+  if (v === null) return data.missingColor;
+  let i = 0;
+  while (i < scheme.bins.length && scheme.bins[i] < v) i++;
+  return scheme.colors[i];
+}
+
+function legend(scheme) {
+  const b = scheme.bins, unit = ' °C';
+  const items = [['<= ' + b[0] + unit, scheme.colors[0]]];
+  for (let i = 1; i < b.length; i++) items.push(['(' + b[i - 1] + ', ' + b[i] + ']' + unit, scheme.colors[i]]);
+  items.push(['> ' + b[b.length - 1] + unit, scheme.colors[b.length]]);
+  items.push([labels.missing, data.missingColor]);
+  document.getElementById('legend').innerHTML = items.map(([text, c]) =>
+    '<span><span class="box" style="background:' + c + '"></span>' + text + '</span>').join('');
+}
+
+function info() {
+  if (hovered === null) return;
+  const v = value(hovered, +slider.value);
+  document.getElementById('info').textContent =
+    data.names[hovered] + ': ' + (v === null ? labels.missing : v.toFixed(2) + ' °C');
+}
+
+function draw() {
+  const column = +slider.value, scheme = data.modes[mode.value];
+  for (let i = 0; i < paths.length; i++) paths[i].style.fill = color(value(i, column), scheme);
+  document.getElementById('label').textContent = data.years[column];
+  document.getElementById('title').textContent = mode.value === 'temperature'
+    ? labels.temperatureTitle : labels.differenceTitle;
+  info();
+}
+
+function stop() { clearInterval(timer); timer = null; play.textContent = labels.play; }
+play.addEventListener('click', () => {
+  if (timer !== null) return stop();
+  if (+slider.value === nYears - 1) slider.value = 0;
+  play.textContent = labels.pause;
+  timer = setInterval(() => {
+    if (+slider.value >= nYears - 1) return stop();
+    slider.value = +slider.value + 1;
+    draw();
+  }, data.frameMs);
+});
+slider.addEventListener('input', draw);
+mode.addEventListener('change', () => { legend(data.modes[mode.value]); draw(); });
+stop();
+legend(data.modes[mode.value]);
+draw();
+</script></body></html>
+"""
+
+
+def page(labels):
+    """
+    Return the HTML page of the animated map of the yearly temperatures.
+    'labels' holds the texts of the page: temperature, difference (names of
+    the modes), temperatureTitle, differenceTitle, play, pause, missing, and
+    the initialYear shown.
+    """
+    key = (geometry.version(), json.dumps(labels, sort_keys=True))
+    with _lock:
+        html = _pages.get(key)
+    if html is None:
+        frame = geometry.world_temperatures()
+        years = [c for c in frame.columns if isinstance(c, (int, np.integer))]
+        html = (PAGE.replace('__DATA__', json.dumps(payload(frame, years)))
+                .replace('__LABELS__', json.dumps(labels)))
+        with _lock:
+            for stale in [k for k in _pages if k[0] != key[0]]:
+                del _pages[stale]
+            _pages[key] = html
+    return html
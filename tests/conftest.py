@@ -0,0 +1,8 @@
+import os
+import sys
+
+import matplotlib
+
+# The shared modules are imported as the apps do, from the streamlit directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'streamlit'))
+matplotlib.use('Agg')
@@ -0,0 +1,119 @@
+import os
+import random
+import threading
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from unhappy_earth import figures
+
+
+SERIES = ['france', 'china', 'brazil', 'australia', 'sudan', 'greenland']
+SESSIONS = 4
+
+
+def series(name):
+    seed = SERIES.index(name)
+    years = np.arange(1900, 2021)
+    return years, np.random.default_rng(seed).normal(seed, 1, len(years)).cumsum() / 10
+
+
+def chart(name):
+    fig, ax = figures.subplots(figsize=(6, 4))
+    ax.plot(*series(name), label=name)
+    ax.set_title(name)
+    ax.legend(loc='lower left')
+    return fig
+
+
+def pyplot_chart(name):
+    plt.figure(figsize=(6, 4))
+    plt.plot(*series(name), label=name)
+    plt.title(name)
+    plt.legend(loc='lower left')
+    return plt.gcf()
+
+
+def process(name):
+    """
+    Return the id of the process rendering the image of 'name'.
+    """
+    return str(os.getpid()).encode()
+
+
+def concurrently(draw):
+    """
+    Return {(session, name): image} of SESSIONS threads drawing all the
+    SERIES charts, each in a shuffled order.
+    """
+    images = {}
+    errors = []
+
+    def session(seed):
+        try:
+            for name in random.Random(seed).sample(SERIES, len(SERIES)):
+                images[seed, name] = draw(name)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=session, args=(seed,)) for seed in range(SESSIONS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return images
+
+
+@pytest.fixture
+def expected():
+    figures.clear()
+    yield {name: figures.render(chart(name)) for name in SERIES}
+    figures.clear()
+
+
+@pytest.mark.parametrize('engine', ['draw', 'image', 'pyplot'])
+def test_concurrent_sessions_render_their_own_charts(expected, engine):
+    draw = {'draw': lambda name: figures.draw(chart, name),
+            'image': lambda name: figures.image(chart, 'v1', 'en', name=name),
+            'pyplot': lambda name: figures.draw(pyplot_chart, name, pyplot=True)}[engine]
+    images = concurrently(draw)
+    assert len(images) == SESSIONS * len(SERIES)
+    for (_, name), image in images.items():
+        assert image == expected[name]
+    assert not plt.get_fignums()
+
+
+def test_concurrent_misses_render_once_in_worker_processes(expected):
+    before = figures.stats()['pool_submitted']
+    images = concurrently(lambda name: figures.image(process, 'v1', 'en', name=name))
+    # One rendering per image, shared by the sessions requesting it meanwhile.
+    assert figures.stats()['pool_submitted'] - before == len(SERIES)
+    for name in SERIES:
+        assert len({images[session, name] for session in range(SESSIONS)}) == 1
+    assert len(set(images.values())) <= figures.MAX_WORKERS
+    assert str(os.getpid()).encode() not in images.values()
+
+
+def test_image_is_drawn_once_per_key(expected):
+    calls = []
+
+    def counted(name, years):
+        calls.append(name)
+        return chart(name)
+
+    first = figures.image(counted, 'v1', 'en', data=('china',), years=[1900, 2020])
+    again = figures.image(counted, 'v1', 'en', data=('china',), years=(np.int64(1900), 2020))
+    assert first == again == expected['china']
+    assert calls == ['china']
+    figures.image(counted, 'v2', 'en', data=('china',), years=[1900, 2020])
+    assert calls == ['china', 'china']
+
+
+def test_encoded_images_are_returned_as_is():
+    # Not importable by the workers: drawn in the calling thread.
+    assert figures.draw(lambda: b'png') == b'png'
+    assert figures.draw(process, 'china') != str(os.getpid()).encode()
+    with pytest.raises(ValueError):
+        figures.draw(chart, 'china', format='jpg')
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from unhappy_earth import rolling
+
+
+@pytest.fixture
+def frame():
+    # Three centuries of monthly values, with missing months and a late start.
+    rng = np.random.default_rng(0)
+    values = rng.normal(15, 5, (3600, 3)) + np.linspace(0, 2, 3600)[:, None]
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[:500, 2] = np.nan
+    return pd.DataFrame(values, columns=['north_abs', 'south_abs', 'north_uncert'])
+
+
+def loop(frame, window, min_periods, center=False, closed='right'):
+    """
+    The rolling means as the tabs computed them, one Series.mean() per window.
+    """
+    start, end = rolling._bounds(len(frame), window, center, closed)
+    return np.array([[frame[c].iloc[s:e].mean() if frame[c].iloc[s:e].count() >= min_periods
+                      else np.nan for c in frame.columns] for s, e in zip(start, end)])
+
+
+@pytest.mark.parametrize('window, min_periods, center, closed', [
+    (120, 1, False, 'left'),
+    (120, 120, False, 'right'),
+    (121, 10, True, 'right'),
+    (10, 3, False, 'right'),
+])
+def test_rolling_frame_equals_the_loop(frame, window, min_periods, center, closed):
+    means = rolling.rolling_frame(frame, frame.columns, window, min_periods, center, closed)
+    expected = loop(frame, window, min_periods, center, closed)
+    np.testing.assert_array_equal(means.to_numpy(), expected)
+
+
+def test_rolling_mean_matches_pandas(frame):
+    means = rolling.rolling_mean(frame.to_numpy(), 120, min_periods=1)
+    expected = frame.rolling(120, min_periods=1).mean().to_numpy()
+    np.testing.assert_allclose(means, expected, rtol=0, atol=1e-12)
+    assert np.array_equal(np.isnan(means), np.isnan(expected))
+
+
+def test_independent_uncertainties(frame):
+    uncert = rolling.rolling_uncert(frame['north_uncert'].to_numpy(), 12, min_periods=1,
+                                    propagation='independent')
+    window = frame['north_uncert'].iloc[1000:1012]
+    assert uncert[1011] == pytest.approx(np.sqrt((window ** 2).sum()) / window.count())
+    with pytest.raises(ValueError):
+        rolling.rolling_uncert(frame['north_uncert'].to_numpy(), 12, propagation='max')